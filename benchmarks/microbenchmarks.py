@@ -0,0 +1,555 @@
+import time
+import boardom as bd
+
+# These are microbenchmarks (not part of the test suite, which is in test/).
+# Run with "pytest -s benchmarks/microbenchmarks.py" to see the timings.
+
+
+def _time_per_call(func, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter() - start) / n
+
+
+def _report(title, **timings):
+    bd.write(f'\n{title}')
+    for key, val in timings.items():
+        bd.write(f'\t{key}: {val * 1e6:.3f} us')
+
+
+def _make_iteration_engine(compile_events):
+    class Eng(bd.Engine, compile_events=compile_events):
+        @bd.on('training_iteration_setup', 'training_iteration_start')
+        def start(self):
+            return 1
+
+        @bd.on('training_iteration_end', 'training_iteration_cleanup')
+        def end(self, engine):
+            return 2
+
+        @bd.every(training_step=1)
+        @bd.on('training_iteration_end')
+        def log(self):
+            return 3
+
+    eng = Eng()
+    eng.training = {'global_step': 1}
+    return eng
+
+
+class TestEventDispatchBenchmark:
+    def test_compiled_event_dispatch(self):
+        events = [
+            'training_iteration_setup',
+            'training_iteration_start',
+            'training_iteration_end',
+            'training_iteration_cleanup',
+        ]
+        timings = {}
+        results = {}
+        for compiled in [False, True]:
+            eng = _make_iteration_engine(compiled)
+
+            def fire():
+                return [eng.event(x) for x in events]
+
+            results[compiled] = fire()
+            timings[f'compiled={compiled}'] = _time_per_call(fire, 5000) / len(
+                events
+            )
+        _report('Per event dispatch overhead', **timings)
+        assert results[False] == results[True]
+
+
+class TestAttributeAccessBenchmark:
+    def test_attribute_reads_on_trainer(self):
+        from boardom.engine.engine import _resolve_name
+
+        class Trainer(bd.DefaultSGDTrainer):
+            pass
+
+        trainer = Trainer()
+        trainer.datum.training = (1, 2)
+        # Names read in DefaultSGDTrainer.training_iteration
+        names = ['training', 'datum', 'models', 'optimizers', 'do_forward', 'event']
+        n = 2000
+
+        def cached():
+            for name in names:
+                getattr(trainer, name)
+
+        def uncached():
+            for name in names:
+                _resolve_name(trainer, name)
+
+        for name in names:
+            assert getattr(trainer, name) == _resolve_name(trainer, name)
+        timings = {
+            'uncached': _time_per_call(uncached, n) / len(names),
+            'cached': _time_per_call(cached, n) / len(names),
+        }
+        _report('Engine attribute read', **timings)
+        for key, val in timings.items():
+            bd.write(f'\t{key}: {1 / val:.0f} reads/s')
+        assert trainer.training.global_step == 0
+
+
+class TestStateBenchmark:
+    def test_counter_get_and_set(self):
+        state = bd.State({'training': {'global_step': 0, 'epoch_step': 0}})
+        training = state.training
+        # Plain dictionaries as a lower bound
+        plain = {'training': {'global_step': 0, 'epoch_step': 0}}
+        plain_training = plain['training']
+        n = 20000
+
+        def state_increment():
+            training.global_step += 1
+            training.epoch_step += 1
+
+        def dict_increment():
+            plain_training['global_step'] += 1
+            plain_training['epoch_step'] += 1
+
+        def state_dotted():
+            state['training.global_step'] = state['training.global_step'] + 1
+
+        def dict_dotted():
+            plain['training']['global_step'] = plain['training']['global_step'] + 1
+
+        _report(
+            'State counter increment',
+            state=_time_per_call(state_increment, n) / 2,
+            dict=_time_per_call(dict_increment, n) / 2,
+            state_dotted=_time_per_call(state_dotted, n),
+            dict_dotted=_time_per_call(dict_dotted, n),
+        )
+        assert training.global_step == 2 * n
+        assert training.epoch_step == n
+
+
+class TestCleanupStateBenchmark:
+    def test_cleanup_cost_is_independent_of_state_size(self):
+        timings = {}
+        for size in [10, 1000]:
+            eng = bd.Engine()
+            eng.training = {'global_step': 0}
+            eng.models = {f'm{i}': {f'p{j}': j for j in range(10)} for i in range(size)}
+
+            def iteration():
+                with bd.CleanupState(eng):
+                    eng.training.losses = 1
+                    eng.training.predictions = {'a': 1}
+                    eng.temporary = 2
+
+            timings[f'{size * 10} keys'] = _time_per_call(iteration, 1000)
+            assert 'training.losses' not in eng
+            assert 'temporary' not in eng
+            assert eng.models.m0.p9 == 9
+        _report('CleanupState per iteration', **timings)
+
+
+class TestExecutorBenchmark:
+    def test_slow_listener_overlaps_with_iteration(self):
+        def make_engine(executor):
+            class Eng(bd.Engine):
+                @bd.on('training_iteration')
+                def work(self):
+                    time.sleep(0.002)
+                    return 1
+
+                @bd.on('training_iteration_end', executor=executor)
+                def log(self):
+                    time.sleep(0.002)
+                    return 2
+
+            return Eng()
+
+        timings = {}
+        for executor in ['sync', 'thread']:
+            eng = make_engine(executor)
+
+            def iteration():
+                eng.training_iteration()
+                eng.training_iteration_end()
+
+            timings[executor] = _time_per_call(iteration, 50)
+            results = eng.wait_for_events('training_iteration_end')
+            assert all(x == 2 for x in results)
+        _report('Iteration with slow training_iteration_end listener', **timings)
+
+
+class TestDataPrefetchBenchmark:
+    def test_prefetch_overlaps_loading_with_iteration(self):
+        import torch
+        from boardom.components import Data
+
+        weight = torch.randn(256, 256)
+
+        class Loader:
+            def __iter__(self):
+                for _ in range(20):
+                    # Reading from disk (releases the GIL)
+                    time.sleep(0.002)
+                    batch = [torch.randn(64, 256) for _ in range(8)]
+                    yield {f'x{i}': torch.stack(batch) for i in range(4)}
+
+        timings = {}
+        for depth in [0, 2]:
+            eng = Data().set_data_prefetch(depth)
+            eng.data.training = Loader()
+
+            def epoch():
+                for datum in eng.iterate_data('training'):
+                    for _ in range(5):
+                        datum['x0'] @ weight
+
+            timings[f'prefetch={depth}'] = _time_per_call(epoch, 5) / 20
+        # Overlap of CPU-bound loading with the step requires more than one core
+        _report('Data iteration per step', **timings)
+
+
+class TestAmpBenchmark:
+    def test_amp_throughput_and_activation_memory(self):
+        import torch
+
+        class Trainer(bd.DefaultSGDTrainer):
+            pass
+
+        n, batch_size = 10, 64
+
+        def make_trainer(amp):
+            torch.manual_seed(0)
+            layers = []
+            for _ in range(4):
+                layers += [torch.nn.Linear(512, 512), torch.nn.ReLU()]
+            trainer = Trainer().set_amp(amp)
+            trainer.models.main = torch.nn.Sequential(*layers)
+            trainer.criteria.main = torch.nn.MSELoss()
+            trainer.optimizers.main = torch.optim.SGD(
+                trainer.models.main.parameters(), lr=1e-3
+            )
+            trainer.data.training = [
+                (torch.randn(batch_size, 512), torch.randn(batch_size, 512))
+                for _ in range(n)
+            ]
+            return trainer
+
+        # Bytes of the tensors saved for backward by the forward pass
+        def saved_bytes(trainer):
+            saved = []
+
+            def pack(x):
+                saved.append(x.numel() * x.element_size())
+                return x
+
+            with torch.autograd.graph.saved_tensors_hooks(pack, lambda x: x):
+                trainer.training_iteration()
+            return sum(saved)
+
+        timings, memory = {}, {}
+        for amp in [False, True]:
+            trainer = make_trainer(amp)
+            trainer.fit(max_epochs=1)
+            timings[f'amp={amp}'] = _time_per_call(
+                lambda: trainer.fit(max_epochs=trainer.training.epoch + 1), 3
+            ) / (n * batch_size)
+            trainer.datum.training = trainer.data.training[0]
+            memory[f'amp={amp}'] = saved_bytes(trainer)
+        _report('Training time per sample (cpu, bfloat16 autocast)', **timings)
+        for key, val in memory.items():
+            bd.write(f'\tSaved activations {key}: {val / 2 ** 20:.2f} MiB')
+        assert memory['amp=True'] < memory['amp=False']
+
+
+class TestCheckpointBenchmark:
+    def test_async_checkpoint_stall(self, tmp_path):
+        import torch
+
+        timings = {}
+        for asynchronous in [False, True]:
+            eng = bd.Checkpoint()
+            eng.models = {'main': torch.nn.Linear(2048, 2048)}
+            eng.attach_checkpointers(
+                'models.main',
+                directory=str(tmp_path / f'async_{asynchronous}'),
+                overwrite=True,
+                asynchronous=asynchronous,
+            )
+            eng.save_checkpoint()
+            eng.wait_for_checkpoints()
+            # Time that training is stalled by a checkpoint
+            timings[f'asynchronous={asynchronous}'] = _time_per_call(
+                eng.save_checkpoint, 3
+            )
+            eng.wait_for_checkpoints()
+        _report('Training stall per checkpoint (16 MiB model)', **timings)
+
+    def test_deduplicated_checkpoint_of_frozen_backbone(self, tmp_path):
+        import os
+        import torch
+
+        def dir_size(directory):
+            return sum(
+                os.path.getsize(os.path.join(root, f))
+                for root, _, files in os.walk(directory)
+                for f in files
+            )
+
+        timings, sizes = {}, {}
+        for deduplicate in [False, True]:
+            directory = str(tmp_path / f'deduplicate_{deduplicate}')
+            eng = bd.Checkpoint()
+            backbone = torch.nn.Linear(2048, 2048).requires_grad_(False)
+            head = torch.nn.Linear(2048, 10)
+            eng.models = {'main': torch.nn.Sequential(backbone, head)}
+            eng.attach_checkpointers(
+                'models.main',
+                directory=directory,
+                overwrite=False,
+                deduplicate=deduplicate,
+            )
+
+            def step_and_save():
+                with torch.no_grad():
+                    head.weight += 1
+                eng.save_checkpoint()
+
+            key = f'deduplicate={deduplicate}'
+            timings[key] = _time_per_call(step_and_save, 3)
+            sizes[key] = dir_size(directory)
+        _report('Checkpoint of a partially frozen model (16 MiB frozen)', **timings)
+        for key, val in sizes.items():
+            bd.write(f'\tDisk usage of 3 checkpoints {key}: {val / 2 ** 20:.2f} MiB')
+        assert sizes['deduplicate=True'] < sizes['deduplicate=False'] / 2
+
+    def test_flat_checkpoint_load(self, tmp_path):
+        import torch
+
+        def make_engine(file_format):
+            eng = bd.Checkpoint()
+            eng.models = {
+                'main': torch.nn.Sequential(
+                    *[torch.nn.Linear(1024, 1024) for _ in range(16)]
+                )
+            }
+            eng.attach_checkpointers(
+                'models.main',
+                directory=str(tmp_path / file_format),
+                format=file_format,
+            )
+            return eng
+
+        timings = {}
+        for file_format in ['torch', 'flat']:
+            make_engine(file_format).save_checkpoint()
+            eng = make_engine(file_format)
+            timings[f'format={file_format}'] = _time_per_call(eng.load_latest, 3)
+        timings['format=flat (models.main.0.*)'] = _time_per_call(
+            lambda: eng.load_latest('models.main.0.*'), 3
+        )
+        _report('Checkpoint loading (64 MiB model)', **timings)
+
+
+class TestLoggingBenchmark:
+    def test_buffered_logging_overhead(self, tmp_path):
+        import torch
+
+        n = 200
+        timings = {}
+        for flush_every in [None, 100]:
+            eng = bd.LoggerEngine()
+            eng.loggers.tb = eng.setup_tensorboard_logger(
+                'losses',
+                'step',
+                directory=str(tmp_path / f'tb_{flush_every}'),
+                flush_every=flush_every,
+            )
+            eng.loggers.csv = eng.setup_csv_logger(
+                'losses',
+                [f'loss_{i}' for i in range(8)],
+                directory=str(tmp_path / f'csv_{flush_every}'),
+                flush_every=flush_every,
+            )
+            losses = {f'loss_{i}': torch.rand(()) for i in range(8)}
+
+            def step():
+                eng.step = getattr(eng, 'step', 0) + 1
+                eng.losses = losses
+                eng.log()
+
+            timings[f'flush_every={flush_every}'] = _time_per_call(step, n)
+            eng.flush_loggers()
+        _report('Per step logging of 8 values (tensorboard + csv)', **timings)
+
+    def test_average_tracker_update(self):
+        import torch
+        from boardom.components.logger import AverageTracker
+
+        losses = {f'loss_{i}': torch.rand((), requires_grad=True) for i in range(8)}
+        averages = {k: bd.Average() for k in losses}
+
+        # Previous per field tracking (accumulates tensors and their graphs)
+        def per_field_update():
+            for key, val in losses.items():
+                averages[key].add(val, 1)
+
+        tracker = AverageTracker(None, None, None)
+        tracker_var = AverageTracker(None, None, None, variance=True)
+        _report(
+            'Average tracking of 8 tensor values per update (cpu)',
+            per_field=_time_per_call(per_field_update, 1000),
+            vectorized=_time_per_call(lambda: tracker.update(losses), 1000),
+            vectorized_variance=_time_per_call(
+                lambda: tracker_var.update(losses), 1000
+            ),
+        )
+
+
+def _image(value):
+    import numpy as np
+
+    return np.full((2160, 3840, 3), value, dtype=np.float32)
+
+
+class TestMultiprocessingBenchmark:
+    def test_shared_memory_result_throughput(self):
+        import functools
+
+        n, rounds = 4, 4
+        nbytes = 2160 * 3840 * 3 * 4
+        throughput = {}
+        for shared_memory in [False, True]:
+            pool = bd.multiprocessing.PersistentProcessPool(
+                num_workers=1, shared_memory=shared_memory
+            )
+            pool.run(functools.partial(_image, 0))
+            start = time.perf_counter()
+            for _ in range(rounds):
+                images = pool.run(*[functools.partial(_image, i) for i in range(n)])
+                assert all(img[0, 0, 0] == i for i, img in enumerate(images))
+                del images
+            elapsed = time.perf_counter() - start
+            pool._shutdown_workers()
+            throughput[f'shared_memory={shared_memory}'] = (
+                n * rounds * nbytes / elapsed / 1e6
+            )
+        bd.write('\nReturning 4K float32 images from a worker process')
+        for key, val in throughput.items():
+            bd.write(f'\t{key}: {val:.1f} MB/s')
+
+    def test_small_task_latency(self):
+        import functools
+
+        pool = bd.multiprocessing.PersistentProcessPool(num_workers=2)
+        pool.run(functools.partial(abs, 0))
+        single = _time_per_call(lambda: pool.run(functools.partial(abs, -1)), 50)
+        batch = _time_per_call(
+            lambda: pool.run(*[functools.partial(abs, -i) for i in range(200)]), 5
+        )
+        pool._shutdown_workers()
+        _report('Small task latency (2 workers)', single_task=single, tasks_200=batch)
+
+    def test_chunked_submission(self):
+        import functools
+
+        pool = bd.multiprocessing.PersistentProcessPool(num_workers=2)
+        funcs = [functools.partial(abs, -i) for i in range(5000)]
+        pool.run(*funcs[:10])
+
+        def _imap():
+            for _ in pool.imap(iter(funcs), ordered=False):
+                pass
+
+        timings = {
+            'chunk_size=1': _time_per_call(lambda: pool.run(*funcs, chunk_size=1), 1),
+            'tuned': _time_per_call(lambda: pool.run(*funcs), 3),
+            'imap_unordered': _time_per_call(_imap, 3),
+        }
+        pool._shutdown_workers()
+        _report('Running 5000 small tasks (2 workers)', **timings)
+
+
+class TestLMDBBenchmark:
+    def test_plot_xy_points_per_second(self, tmp_path):
+        from boardom.io.boardom_logger.lmdb_handler import LMDBHandler
+
+        bd.Singleton._instances.pop(LMDBHandler, None)
+        handler = LMDBHandler(str(tmp_path))
+        n = 1000
+
+        # Previous path: a value per key, a read and two commits per scalar
+        def per_scalar_write(value, name):
+            key = f'{name}/pid'
+            count = (handler._read(f'{key}/count') or 0) + 1
+            for k, v in [(f'{key}/{count:012d}', value), (f'{key}/count', count)]:
+                with handler.env.begin(write=True) as txn:
+                    txn.put(k.encode('utf-8'), bd.pack(v))
+
+        def per_key_read(name):
+            prefix = f'{name}/pid/'.encode('utf-8')
+            values = []
+            with handler.env.begin() as txn:
+                cursor = txn.cursor()
+                cursor.set_range(prefix)
+                for key, val in cursor:
+                    if not key.startswith(prefix):
+                        break
+                    if not key.endswith(b'/count'):
+                        values.append(bd.unpack(val))
+            return values
+
+        points = {}
+        start = time.perf_counter()
+        for i in range(n):
+            per_scalar_write(float(i), 'old_x')
+            per_scalar_write(float(i), 'old_y')
+        points['per_scalar_commits'] = n / (time.perf_counter() - start)
+        start = time.perf_counter()
+        for i in range(n):
+            handler.write_scalar(float(i), 'new_x', 'pid')
+            handler.write_scalar(float(i), 'new_y', 'pid')
+        handler.flush()
+        points['batched_columnar'] = n / (time.perf_counter() - start)
+        bd.write('\nLMDB plot_xy writes (x and y scalars per point)')
+        for key, val in points.items():
+            bd.write(f'\t{key}: {val:.0f} points/s')
+
+        assert len(per_key_read('old_x')) == n
+        assert len(handler.read_series('new_x', 'pid')['value']) == n
+        _report(
+            f'Reading a series of {n} points',
+            per_key_cursor_walk=_time_per_call(lambda: per_key_read('old_x'), 20),
+            columnar=_time_per_call(lambda: handler.read_series('new_x', 'pid'), 20),
+            downsampled_level_1=_time_per_call(
+                lambda: handler.read_series('new_x', 'pid', level=1), 20
+            ),
+        )
+        handler.env.close()
+        bd.Singleton._instances.pop(LMDBHandler, None)
+
+
+class TestLoggerProtocolBenchmark:
+    def test_engine_message_throughput(self):
+        import json
+        import random
+        from boardom.io.boardom_logger.coalescing import XYBatcher, batch_arrays
+
+        batcher = XYBatcher()
+        for i in range(1000):
+            for k in range(8):
+                batcher.add(i, random.random(), f'series_{k}', 1600000000000 + i)
+        task = batcher.pop()
+        messages = {
+            'json': (lambda: json.dumps(task), json.loads),
+            'msgpack': (lambda: bd.pack(batch_arrays(task)), bd.unpack),
+        }
+        bd.write('\nEngine websocket message of 8 series x 1000 points')
+        for key, (encode, decode) in messages.items():
+            data = encode()
+            elapsed = _time_per_call(lambda: decode(encode()), 20)
+            bd.write(
+                f'\t{key}: {len(data) / 1e3:.1f} kB, encode + decode '
+                f'{elapsed * 1e3:.2f} ms ({8000 / elapsed / 1e6:.2f} M points/s)'
+            )
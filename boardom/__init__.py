@@ -21,6 +21,8 @@ from .util import (
     find_layers,
     Average,
     MeanVar,
+    EMA,
+    LogHistogram,
     slide_window_,
     re_stride,
     moving_avg,
@@ -117,6 +119,10 @@ from .data import (
     DirectoryDataset,
     grow_dataset,
     ListDataset,
+    Prefetcher,
+    ResumableSampler,
+    split_micro_batches,
+    merge_micro_batches,
 )
 
 from .plot import plot_csv
@@ -224,7 +230,16 @@ from .models import (
 
 from .external import accuracy, compose, fft_conv2d, FFTConv2d
 
-from .multiprocessing import PersistentProcessPool, is_main_process, only_main_process
+from .multiprocessing import (
+    PersistentProcessPool,
+    is_main_process,
+    only_main_process,
+    is_distributed,
+    get_rank,
+    get_world_size,
+    is_main_rank,
+    only_main_rank,
+)
 
 from .engine import (
     Engine,
@@ -242,6 +257,7 @@ from .components import (
     Device,
     SGDTrainer,
     DefaultSGDTrainer,
+    DistributedSGDTrainer,
     SGDValidator,
     DefaultSGDValidator,
     Checkpoint,
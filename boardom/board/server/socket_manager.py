@@ -1,9 +1,15 @@
 import json
 import asyncio
 import aiohttp
+import numpy as np
 from aiohttp import web
+import boardom
 from .datastore import datastore
 
+# Engines (logger subprocesses) that support it exchange binary msgpack
+# messages with the server (negotiated on handshake). Front ends use JSON.
+WS_PROTOCOLS = ['msgpack']
+
 # These are received from front end
 class FrontMixin:
     async def front_initialize_connection(self):
@@ -46,6 +52,12 @@ class EngineMixin:
         print('[Server] got engine handshake')
         process_id = task['payload']['process_id']
         self.process_id = process_id
+        protocols = task['payload'].get('protocols', [])
+        protocol = next((p for p in WS_PROTOCOLS if p in protocols), None)
+        if protocol is not None:
+            # Sent before switching, the engine reads either
+            await self.send_task({'type': 'WS_PROTOCOL', 'payload': protocol})
+            self.protocol = protocol
         SocketManager.engine_connection_ids[process_id] = self.connection_id
         datastore.add_new_process(process_id)
         # Request for the engine to send the config store
@@ -104,6 +116,26 @@ class EngineMixin:
             await self.broadcast_to_all_fronts(data_task)
         await self.broadcast_to_all_fronts(plot_task)
 
+    # Points of several series, coalesced by the engine
+    async def plot_xy_scatter_batch(self, task):
+        for series in task['payload']['series']:
+            # Empty series have no plot to update
+            plot_task = None
+            points = zip(series['x'], series['y'], series['time'])
+            for x, y, time in points:
+                x, y, time = (_to_json_scalar(v) for v in (x, y, time))
+                payload = {**series, 'x': x, 'y': y, 'time': time}
+                plot_task, data_tasks = datastore.add_xy_data(payload, self.process_id)
+                for data_task in data_tasks:
+                    await self.broadcast_to_all_fronts(data_task)
+            if plot_task is not None:
+                await self.broadcast_to_all_fronts(plot_task)
+
+
+# Numeric series of msgpack messages are numpy arrays
+def _to_json_scalar(x):
+    return x.item() if isinstance(x, np.generic) else x
+
 
 def get_ws_route_handler(mode):
     async def _router(request):
@@ -119,10 +151,13 @@ def get_ws_route_handler(mode):
         # Perform initialization functionality after sending connection ID
         await getattr(ws_manager, f'{mode}_initialize_connection')()
         async for msg in ws_manager:
-            if msg.type == aiohttp.WSMsgType.TEXT:
-                json_data = json.loads(msg.data)
-                if isinstance(json_data, str):
-                    json_data = json.loads(json_data)
+            if msg.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                if msg.type == aiohttp.WSMsgType.BINARY:
+                    json_data = boardom.unpack(msg.data)
+                else:
+                    json_data = json.loads(msg.data)
+                    if isinstance(json_data, str):
+                        json_data = json.loads(json_data)
                 if json_data['type'] == 'disconnect':
                     print(f'Received disconnect for {ws_manager.connection_id}')
                     await ws_manager.close()
@@ -156,8 +191,14 @@ class SocketManager(web.WebSocketResponse, EngineMixin, FrontMixin):
             ]
         )
 
+    async def send_task(self, task):
+        if self.protocol == 'msgpack':
+            await self.send_bytes(boardom.pack(task))
+        else:
+            await self.send_json(task)
+
     async def _send(self, type, payload=None, meta={'passive': True}):
-        await self.send_json({'type': type, 'payload': None, 'meta': meta})
+        await self.send_task({'type': type, 'payload': None, 'meta': meta})
 
     def _print_socket_info(self):
         ws_dict = SocketManager.ws_dict
@@ -172,6 +213,7 @@ class SocketManager(web.WebSocketResponse, EngineMixin, FrontMixin):
         assert mode in ['front', 'engine']
         super().__init__(**kwargs)
         self.mode = mode
+        self.protocol = 'json'
         self.connection_id = SocketManager.ws_count
         SocketManager.ws_count += 1
         SocketManager.ws_dict[mode][self.connection_id] = self
@@ -5,6 +5,7 @@ from .optimizers import Optimizers
 from .models import Models
 from .criteria import Criteria
 from .sgd import SGDTrainer, DefaultSGDTrainer, SGDValidator, DefaultSGDValidator
+from .distributed import DistributedSGDTrainer
 from .checkpointer import Checkpoint
 from .logger import LoggerEngine
 from .image_sampler import ImageSampler
@@ -0,0 +1,115 @@
+import os
+import copy
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, wait
+import torch
+
+
+# New mapping of the same type as obj.
+# Keeps the _metadata of state dicts (used by load_state_dict).
+def rebuild_mapping(obj, items):
+    ret = type(obj)(items)
+    metadata = getattr(obj, '_metadata', None)
+    if metadata is not None:
+        ret._metadata = copy.deepcopy(metadata)
+    return ret
+
+
+# Applies fn to the leaves of nested mappings, lists and tuples
+def map_leaves(fn, obj):
+    if isinstance(obj, Mapping):
+        return rebuild_mapping(
+            obj, {key: map_leaves(fn, val) for key, val in obj.items()}
+        )
+    elif isinstance(obj, (list, tuple)) and not hasattr(obj, '_fields'):
+        return type(obj)(map_leaves(fn, x) for x in obj)
+    else:
+        return fn(obj)
+
+
+def _snapshot_leaf(x):
+    if isinstance(x, torch.Tensor):
+        return x.detach().to('cpu', copy=True)
+    return copy.deepcopy(x)
+
+
+# Copy of a state (dict) that is not affected by further training steps.
+# Tensors are copied to CPU memory.
+def snapshot(obj):
+    return map_leaves(_snapshot_leaf, obj)
+
+
+def _fsync(path, directory=False):
+    flags = os.O_RDONLY
+    if directory and hasattr(os, 'O_DIRECTORY'):
+        flags |= os.O_DIRECTORY
+    try:
+        fd = os.open(path, flags)
+    except OSError:
+        # e.g. directories can not be opened on some platforms
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# Writes to a temporary file that replaces full_name once it is on disk.
+# Save func is save(object, filename)
+def durable_save(obj, full_name, save_func):
+    tmp_file = full_name + '.tmp'
+    save_func(obj, tmp_file)
+    _fsync(tmp_file)
+    os.replace(tmp_file, full_name)
+    _fsync(os.path.dirname(os.path.abspath(full_name)), directory=True)
+
+
+class CheckpointWriter:
+    """Runs checkpoint writing tasks in order.
+
+    In asynchronous mode tasks run in a background thread and exceptions
+    are raised by wait(). Otherwise tasks run when submitted (and return
+    their result). Tasks submitted with submit_background() always run in
+    the background thread.
+    """
+
+    def __init__(self, asynchronous=False):
+        self.asynchronous = asynchronous
+        self._executor = None
+        self._futures = []
+
+    def submit(self, fn, *args, **kwargs):
+        if not self.asynchronous:
+            # Runs after the background tasks that were submitted before
+            self.wait()
+            return fn(*args, **kwargs)
+        return self.submit_background(fn, *args, **kwargs)
+
+    def submit_background(self, fn, *args, **kwargs):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='bd_checkpoint_writer'
+            )
+        future = self._executor.submit(fn, *args, **kwargs)
+        # Keep failed futures so that wait() raises their exceptions
+        self._futures = [
+            f for f in self._futures if not (f.done() and f.exception() is None)
+        ]
+        self._futures.append(future)
+        return future
+
+    def in_flight(self):
+        return sum(not f.done() for f in self._futures)
+
+    # True if a task raised an exception (that is not raised by wait() yet)
+    def failed(self):
+        return any(f.done() and (f.exception() is not None) for f in self._futures)
+
+    # Raises the first exception once all tasks are done
+    def wait(self):
+        futures, self._futures = self._futures, []
+        wait(futures)
+        for future in futures:
+            future.result()
@@ -1,10 +1,15 @@
 import os
+from fnmatch import fnmatch
 from inspect import signature
 from collections.abc import Mapping
 import json
 import torch
 import boardom as bd
-from .util import _create_state_dict_element, _prepare_cfg
+from .util import _create_state_dict_element, _prepare_cfg, _set_default_value
+from .checkpoint_writer import CheckpointWriter, durable_save, snapshot
+from .chunk_store import chunk_path, is_manifest, join_chunks, split_chunks
+from .flat_checkpoint import FLAT_EXT, FORMATS, load_flat, save_flat, select_keys
+from .retention import check_retention, has_retention, retained
 from ..config.common import CHECKPOINT_KEYS
 
 
@@ -20,11 +25,22 @@ from ..config.common import CHECKPOINT_KEYS
 #              'overwrite': True,
 #              'use_timestamps': True,
 #              'save_state_dicts': True,
+#              'deduplicate': False,
+#              'format': 'torch',
+#              'keep_last': None,
+#              'keep_every': None,
+#              'keep_best': None,
+#              'best_mode': 'min',
 #              'files': {
 #                  'k1_chk1': {
 #                      'timestamp': '2020-12-31T23:59:59',
 #                      'basename': 'state.key_1.2020-12-31T23:59:59.tag.pth',
 #                      'extra': None,
+#                      'chunks': [],  # Digests of tensors if deduplicated
+#                      'format': 'torch',
+#                      'step': 1000,  # e.g. training.global_step
+#                      'metric': None,
+#                      'forced': False,
 #                  },
 #                  'k1_chk2': {
 #                      'timestamp': '2021-01-01T23:59:59',
@@ -43,10 +59,41 @@ from ..config.common import CHECKPOINT_KEYS
 EXT = '.pth'
 
 
+# ELEMENTS:
+#     self.checkpointing
+#     self.checkpoint_writer
+# EVENTS ISSUED:
+#     attach_checkpointers() -> "get_checkpoint_settings"
+# EVENTS LISTENED:
+#     "training_end" -> wait_for_checkpoints
+# ATTACH FUNCTIONS:
+#     attach_checkpointers
+#
+# With asynchronous=True, save_checkpoint() snapshots the state to CPU memory
+# and files are written by a background thread. The metafile is only updated
+# once the files of a checkpoint are on disk. Write errors are raised by
+# wait_for_checkpoints() (or the next save_checkpoint()), which also rolls
+# the metadata back to the checkpoints that were written.
+#
+# With deduplicate=True, every tensor is stored once in a content addressed
+# "chunks" directory and checkpoint files are manifests referencing them,
+# so unchanged tensors (e.g. frozen layers) are not written again. Tensors
+# are hashed by the writer (in the background for asynchronous checkpoints).
+#
+# With format='flat', files are written with save_flat() and loaded by memory
+# mapping them (see flat_checkpoint.py), which avoids a full in memory copy
+# of the checkpoint and allows loading only some entries of a state.
+#
+# With overwrite=False, old checkpoints can be removed with retention
+# policies (keep_last, keep_every, keep_best, see retention.py) that are
+# evaluated on the metadata after every save. Files of removed checkpoints
+# are deleted by the background thread, also with asynchronous=False
+# (wait_for_checkpoints() waits for them).
 class Checkpoint(bd.Engine):
     def __init__(self):
         super().__init__()
         _create_state_dict_element(self, 'checkpointing')
+        _set_default_value(self, 'checkpoint_writer', CheckpointWriter())
 
     # If state_keys are provided they override the get_checkpoint_settings() call
     def attach_checkpointers(
@@ -57,7 +104,17 @@ class Checkpoint(bd.Engine):
         use_timestamps=True,
         save_state_dicts=True,
         sanitize_metadata=False,
+        asynchronous=False,
+        deduplicate=False,
+        format='torch',
+        keep_last=None,
+        keep_every=None,
+        keep_best=None,
+        best_mode='min',
     ):
+        self.wait_for_checkpoints()
+        self.checkpoint_writer.asynchronous = asynchronous
+
         def create_default_dict():
             return {
                 'state_key': bd.Null,
@@ -65,6 +122,12 @@ class Checkpoint(bd.Engine):
                 'overwrite': overwrite,
                 'use_timestamps': use_timestamps,
                 'save_state_dicts': save_state_dicts,
+                'deduplicate': deduplicate,
+                'format': format,
+                'keep_last': keep_last,
+                'keep_every': keep_every,
+                'keep_best': keep_best,
+                'best_mode': best_mode,
                 'files': {},
             }
 
@@ -123,6 +186,13 @@ class Checkpoint(bd.Engine):
         *state_keys,
         cfg=None,
         sanitize_metadata=False,
+        asynchronous=False,
+        deduplicate=False,
+        format='torch',
+        keep_last=None,
+        keep_every=None,
+        keep_best=None,
+        best_mode='min',
     ):
         cfg = _prepare_cfg(cfg, CHECKPOINT_KEYS + ['session_path'])
         directory = os.path.join(cfg.dg.session_path, 'checkpoints')
@@ -133,12 +203,23 @@ class Checkpoint(bd.Engine):
             use_timestamps=cfg.use_timestamps,
             save_state_dicts=cfg.save_state_dicts,
             sanitize_metadata=sanitize_metadata,
+            asynchronous=asynchronous,
+            deduplicate=deduplicate,
+            format=format,
+            keep_last=keep_last,
+            keep_every=keep_every,
+            keep_best=keep_best,
+            best_mode=best_mode,
         )
         # Rebase the directory from metadata in case it is accessed
         # from a different mount point
         for val in self.checkpointing.metadata.values():
             val.directory = directory
 
+    # Only the main rank writes files when training is distributed (the
+    # checkpoint counters and metadata are updated on every rank).
+    # step defaults to training.global_step (if it exists) and metric is
+    # used by the keep_best retention policy.
     def save_checkpoint(
         self,
         *state_keys,
@@ -146,6 +227,8 @@ class Checkpoint(bd.Engine):
         tag=None,
         save_fn=torch.save,
         force_no_overwrite=False,  # Helpful for saving "special" checkpoints
+        step=None,
+        metric=None,
     ):
         with bd.interrupt_guard(reason='Saving checkpoints'):
             _save(
@@ -155,11 +238,30 @@ class Checkpoint(bd.Engine):
                 tag=tag,
                 save_fn=save_fn,
                 force_no_overwrite=force_no_overwrite,
+                step=step,
+                metric=metric,
+                write=bd.is_main_rank(),
             )
 
+    # Barrier for asynchronous checkpoints.
+    # Raises exceptions that occured while writing (the metadata of the
+    # checkpoints that were not written is rolled back first).
+    @bd.on('training_end')
+    def wait_for_checkpoints(self):
+        try:
+            self.checkpoint_writer.wait()
+        except Exception:
+            _rollback(self.checkpointing)
+            raise
+
+    # Keys (and exclude) can be fnmatch patterns. Patterns of entries of a
+    # state load only those entries (non strictly), e.g. "models.main.encoder.*"
+    # For the flat format, load_fn is not used, and the other entries are
+    # not read from disk.
     def load_latest(
         self, *keys, exclude=None, load_fn=torch.load, strict=True, **kwargs
     ):
+        self.wait_for_checkpoints()
         chkp = self.checkpointing
         chkp_num = chkp.previous_checkpoint_num
         if chkp_num == 0:
@@ -167,9 +269,10 @@ class Checkpoint(bd.Engine):
         for altered_key, val in chkp.metadata.items():
             directory = val.directory
             state_key = val.state_key
-            if keys and (state_key not in keys):
+            patterns = _entry_patterns(state_key, keys)
+            if keys and (not patterns):
                 continue
-            if (exclude is not None) and (state_key in exclude):
+            if (exclude is not None) and any(fnmatch(state_key, x) for x in exclude):
                 continue
             current_key = f'{altered_key}_chk{chkp_num}'
             if current_key not in val.files:
@@ -180,11 +283,33 @@ class Checkpoint(bd.Engine):
             latest = val.files[current_key]
             basename = latest.basename
             full_name = os.path.join(directory, basename)
-            loaded = load_fn(full_name, **kwargs)
+            if latest.get('format', 'torch') == 'flat':
+                # Other kwargs are specific to load_fn
+                map_location = kwargs.get('map_location', None)
+                loaded = load_flat(full_name, patterns, map_location=map_location)
+            else:
+                loaded = load_fn(full_name, **kwargs)
+                if patterns is not None:
+                    loaded = select_keys(loaded, patterns)
+            if is_manifest(loaded):
+                loaded = join_chunks(
+                    loaded,
+                    lambda digest: load_fn(chunk_path(directory, digest), **kwargs),
+                )
+            strict = strict and (patterns is None)
             _set_state(self, state_key, loaded, val.save_state_dicts, strict=strict)
             bd.log(f'Loaded {state_key} checkpoint: {basename}')
 
 
+# Patterns of the entries of state_key to load from the given keys.
+# Returns None to load the whole state.
+def _entry_patterns(state_key, keys):
+    if not keys or any(fnmatch(state_key, x) for x in keys):
+        return None
+    prefix = f'{state_key}.'
+    return [x[len(prefix) :] for x in keys if x.startswith(prefix)]
+
+
 def _set_state(self, state_key, loaded, save_state_dicts, strict=True):
     obj = self.get(state_key, bd.Null)
     if obj is bd.Null:
@@ -238,17 +363,72 @@ def _create_metadict(given_dict, directory, new_dict):
             )
         if val is bd.Null:
             raise RuntimeError(f'Checkpointer setup missing "{key}" value')
+    if new_dict['format'] not in FORMATS:
+        raise RuntimeError(
+            f'Invalid checkpoint format: {new_dict["format"]}'
+            f'\nValid formats: {", ".join(FORMATS)}'
+        )
+    if new_dict['deduplicate'] and (new_dict['format'] != 'torch'):
+        raise RuntimeError('Deduplicated checkpoints must use the torch format')
+    check_retention(new_dict)
     return new_dict
 
 
+# Restores the metadata of the last written checkpoint (the metafile) after
+# failed writes, and removes entries of missing (e.g. partially written) files
+def _rollback(chkp):
+    if os.path.exists(chkp.metafile):
+        with open(chkp.metafile, 'r') as f:
+            written = json.load(f)
+    else:
+        written = {'previous_checkpoint_num': 0, 'metadata': {}}
+    chkp.previous_checkpoint_num = written['previous_checkpoint_num']
+    for key, val in chkp.metadata.items():
+        val.files = written['metadata'].get(key, {}).get('files', {})
+    _sanitize(chkp)
+
+
+# Removes entries of missing files (or chunks) from the metadata,
+# and the chunks that are not referenced anymore
 def _sanitize(chkp):
     meta = chkp.metadata
+    released = []
     for key, val in meta.items():
         directory = val.directory
-        for subkey, subval in val.files.items():
+        for subkey, subval in list(val.files.items()):
             full_path = os.path.join(directory, subval.basename)
-            if not os.path.exists(full_path):
+            chunks = subval.get('chunks', [])
+            paths = [full_path] + [chunk_path(directory, x) for x in chunks]
+            if not all(os.path.exists(x) for x in paths):
+                released += [(directory, x) for x in chunks]
                 del val.files[subkey]
+    for full_name in _unreferenced_chunks(meta, released):
+        if os.path.exists(full_name):
+            os.remove(full_name)
+
+
+# Digests of the chunks referenced by the checkpoints of a directory
+def _referenced_chunks(meta, directory):
+    return {
+        digest
+        for val in meta.values()
+        if val['directory'] == directory
+        for file_meta in val['files'].values()
+        for digest in file_meta.get('chunks', [])
+    }
+
+
+# Files of released (directory, digest) chunks that are not referenced
+def _unreferenced_chunks(meta, released):
+    referenced = {}
+    ret = []
+    for directory, digest in released:
+        if directory not in referenced:
+            referenced[directory] = _referenced_chunks(meta, directory)
+        full_name = chunk_path(directory, digest)
+        if (digest not in referenced[directory]) and (full_name not in ret):
+            ret.append(full_name)
+    return ret
 
 
 def _file_meta(timestamp, basename, checkpoint_id):
@@ -260,13 +440,38 @@ def _file_meta(timestamp, basename, checkpoint_id):
     }
 
 
-def _save(self, state_keys, extra_meta, tag, save_fn, force_no_overwrite):
+# With write=False only the metadata is updated (no files are written or
+# removed)
+def _save(
+    self,
+    state_keys,
+    extra_meta,
+    tag,
+    save_fn,
+    force_no_overwrite,
+    step,
+    metric,
+    write=True,
+):
+    writer = self.checkpoint_writer
+    if writer.failed():
+        # Raises the error of a previous asynchronous checkpoint
+        self.wait_for_checkpoints()
+    to_write, to_remove, released = [], [], []
     chkp = self.checkpointing
     previous_checkpoint_num = chkp.previous_checkpoint_num
     current_checkpoint_num = previous_checkpoint_num + 1
     all_meta = chkp.metadata
     state_keys = state_keys or [x['state_key'] for x in all_meta.values()]
+    if write and any(x.get('deduplicate', False) for x in all_meta.values()):
+        # The chunks of previous checkpoints are known once they are written
+        # (and are part of the metadata copy written to the metafile)
+        self.wait_for_checkpoints()
     timestamp = bd.timestamp()
+    if step is None:
+        step = self.get('training.global_step', None)
+    step = None if step is None else int(step)
+    metric = None if metric is None else float(metric)
     for state_key in state_keys:
         altered_key = state_key.replace('.', '_')
         metadata = all_meta[altered_key]
@@ -274,19 +479,34 @@ def _save(self, state_keys, extra_meta, tag, save_fn, force_no_overwrite):
         directory = metadata.directory
         if state_key not in self:
             raise RuntimeError(f'Could not find {state_key} to checkpoint.')
-        to_save = _get_state(
-            self[state_key], save_state_dicts=metadata.save_state_dicts
-        )
+        to_save = None
+        if write:
+            to_save = _get_state(
+                self[state_key], save_state_dicts=metadata.save_state_dicts
+            )
+        if write and writer.asynchronous:
+            to_save = snapshot(to_save)
+        file_format = metadata.get('format', 'torch')
+        if file_format == 'flat':
+            extension, file_save_fn = FLAT_EXT, save_flat
+        else:
+            extension, file_save_fn = chkp.extension, save_fn
         new_tag = f'.{str(tag)}' if tag else ''
         str_timestamp = f'.{timestamp}' if metadata.use_timestamps else ''
-        basename = f'{state_key}{str_timestamp}{new_tag}{chkp.extension}'
+        basename = f'{state_key}{str_timestamp}{new_tag}{extension}'
         # if not overwriting, make sure that we give a new name to the file
         # (incase it already exists)
         if not overwrite:
             _fullname = os.path.join(directory, basename)
             basename = os.path.basename(bd.number_file_if_exists(_fullname))
+            # Files of in-flight checkpoints are not on disk yet
+            taken = {x.basename for x in metadata.files.values()}
+            name, ext = os.path.splitext(basename)
+            count = 0
+            while basename in taken:
+                count += 1
+                basename = f'{name}_{count}{ext}'
         full_name = os.path.join(directory, basename)
-        safe_save(to_save, full_name, save_fn)
 
         # If we are overwiting and the new name is not the same
         # as the previous one delete the previous one
@@ -296,7 +516,8 @@ def _save(self, state_keys, extra_meta, tag, save_fn, force_no_overwrite):
             if prev_meta is not None:
                 prev_fullname = os.path.join(directory, prev_meta.basename)
                 if full_name != prev_fullname:
-                    os.remove(prev_fullname)
+                    to_remove.append(prev_fullname)
+                released.append((directory, prev_meta))
                 del metadata.files[prev_key]
 
         # TODO: Add metadata info
@@ -305,29 +526,88 @@ def _save(self, state_keys, extra_meta, tag, save_fn, force_no_overwrite):
             'timestamp': timestamp,
             'basename': basename,
             'extra': extra_meta,
+            'chunks': [],  # Filled by _write (if deduplicated)
+            'format': file_format,
+            'step': step,
+            'metric': metric,
+            'forced': force_no_overwrite,
         }
-        bd.log(f'Saved {state_key} checkpoint: {basename}')
+        chunked = None
+        if metadata.get('deduplicate', False):
+            chunked = (directory, altered_key, metakey, metadata.files[metakey])
+        to_write.append((state_key, to_save, full_name, file_save_fn, chunked))
+
+        if has_retention(metadata):
+            keep = retained(
+                metadata.files,
+                keep_last=metadata.keep_last,
+                keep_every=metadata.keep_every,
+                keep_best=metadata.keep_best,
+                best_mode=metadata.best_mode,
+            )
+            for key in [x for x in metadata.files if x not in keep]:
+                file_meta = metadata.files.pop(key)
+                to_remove.append(os.path.join(directory, file_meta.basename))
+                released.append((directory, file_meta))
 
     chkp.previous_checkpoint_num = current_checkpoint_num
-    # Save the metadata too
-    safe_save(chkp, chkp.metafile, json_save_func)
-
-
-# Save func is save(object, filename)
-def safe_save(obj, full_name, save_func):
-    if os.path.exists(full_name):
-        # Write temporary new file
-        tmp_file = full_name + '.tmp'
-        save_func(obj, tmp_file)
-        # Backup current file
-        bak_current_file = full_name + '.bak'
-        os.replace(full_name, bak_current_file)
-        # Rename temporary file
-        os.replace(tmp_file, full_name)
-        # Remove backup
-        os.remove(bak_current_file)
-    else:
-        save_func(obj, full_name)
+    if not write:
+        return
+    # Copy of the metadata as of this checkpoint
+    metadata = json.loads(json.dumps(chkp))
+    args = (to_write, to_remove, released, save_fn, chkp.metafile, metadata)
+    try:
+        if writer.asynchronous:
+            writer.submit(_write_and_remove, *args)
+        else:
+            # Files are removed in the background (also when writing synchronously)
+            writer.submit_background(_remove_files, writer.submit(_write, *args))
+    except Exception:
+        _rollback(chkp)
+        raise
+
+
+# Deduplicated states are split into chunks here (the tensors are hashed
+# by the writer, i.e. in the background for asynchronous checkpoints).
+# The chunks of the (directory, file_meta) pairs of released checkpoints
+# are removed if they are not referenced anymore.
+# Returns the files to remove once the checkpoint is written.
+def _write(to_write, to_remove, released, save_fn, metafile, metadata):
+    for state_key, obj, full_name, file_save_fn, chunked in to_write:
+        if chunked is not None:
+            directory, altered_key, metakey, file_meta = chunked
+            obj, chunks = split_chunks(obj)
+            for digest, tensor in chunks.items():
+                chunk_name = chunk_path(directory, digest)
+                # Chunks are immutable, so existing ones are not rewritten
+                if not os.path.exists(chunk_name):
+                    bd.make_dir(os.path.dirname(chunk_name))
+                    durable_save(tensor, chunk_name, save_fn)
+            file_meta['chunks'] = sorted(chunks)
+            # The checkpoint may already be removed by retention policies
+            files = metadata['metadata'][altered_key]['files']
+            if metakey in files:
+                files[metakey]['chunks'] = sorted(chunks)
+        durable_save(obj, full_name, file_save_fn)
+        bd.log(f'Saved {state_key} checkpoint: {os.path.basename(full_name)}')
+    # The metafile only references files that are on disk
+    durable_save(metadata, metafile, json_save_func)
+    released = [
+        (directory, digest)
+        for directory, file_meta in released
+        for digest in file_meta.get('chunks', [])
+    ]
+    return to_remove + _unreferenced_chunks(metadata['metadata'], released)
+
+
+def _remove_files(to_remove):
+    for full_name in to_remove:
+        if os.path.exists(full_name):
+            os.remove(full_name)
+
+
+def _write_and_remove(*args):
+    _remove_files(_write(*args))
 
 
 def json_save_func(obj, file):
@@ -0,0 +1,102 @@
+import os
+import hashlib
+from collections.abc import Mapping
+import torch
+from .checkpoint_writer import map_leaves
+
+# Content addressed storage of checkpoint tensors.
+#
+# A deduplicated checkpoint is a small manifest, i.e. the saved state with
+# its tensors replaced by ChunkRefs. Every tensor is stored once in the
+# chunk directory, in a file named after the digest of its contents, so
+# tensors that do not change between checkpoints (e.g. frozen layers) are
+# only written once.
+
+CHUNK_DIR = 'chunks'
+MANIFEST_KEY = '__bd_manifest__'
+
+
+class ChunkRef:
+    __slots__ = ['digest']
+
+    def __init__(self, digest):
+        self.digest = digest
+
+    def __repr__(self):
+        return f'ChunkRef({self.digest})'
+
+    def __eq__(self, other):
+        return isinstance(other, ChunkRef) and (self.digest == other.digest)
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __getstate__(self):
+        return self.digest
+
+    def __setstate__(self, state):
+        self.digest = state
+
+
+# Detached, contiguous CPU tensor that does not reference a larger storage
+# (torch.save writes the whole storage of a tensor)
+# storage() is deprecated in favor of untyped_storage() (torch >= 2.0)
+def _storage_nbytes(tensor):
+    if hasattr(tensor, 'untyped_storage'):
+        return tensor.untyped_storage().nbytes()
+    return tensor.storage().nbytes()
+
+
+def _compact(tensor):
+    tensor = tensor.detach().cpu().contiguous()
+    nbytes = tensor.numel() * tensor.element_size()
+    if tensor.storage_offset() != 0 or _storage_nbytes(tensor) != nbytes:
+        tensor = tensor.clone()
+    return tensor
+
+
+# The digest covers the dtype, the shape and the data of the tensor
+def tensor_digest(tensor):
+    return _digest(_compact(tensor))
+
+
+def _digest(tensor):
+    h = hashlib.sha256()
+    h.update(f'{tensor.dtype}{tuple(tensor.shape)}'.encode())
+    if tensor.numel() > 0:
+        h.update(tensor.reshape(-1).view(torch.uint8).numpy())
+    return h.hexdigest()
+
+
+def chunk_path(directory, digest):
+    return os.path.join(directory, CHUNK_DIR, f'{digest}.pth')
+
+
+# Returns the manifest of obj and a {digest: tensor} dictionary of its chunks
+def split_chunks(obj):
+    chunks = {}
+
+    def _split(x):
+        if not isinstance(x, torch.Tensor):
+            return x
+        x = _compact(x)
+        digest = _digest(x)
+        chunks[digest] = x
+        return ChunkRef(digest)
+
+    return {MANIFEST_KEY: 1, 'state': map_leaves(_split, obj)}, chunks
+
+
+def is_manifest(obj):
+    return isinstance(obj, Mapping) and (MANIFEST_KEY in obj)
+
+
+# Rebuilds the state of a manifest.
+# load_chunk(digest) returns the tensor of a chunk.
+def join_chunks(manifest, load_chunk):
+    def _join(x):
+        if isinstance(x, ChunkRef):
+            return load_chunk(x.digest)
+        return x
+
+    return map_leaves(_join, manifest['state'])
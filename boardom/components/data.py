@@ -1,3 +1,4 @@
+from itertools import islice
 import boardom as bd
 from torch.utils.data import DataLoader
 from torch.utils.data.dataloader import default_collate
@@ -9,6 +10,8 @@ from .util import (
     _prepare_cfg,
 )
 from ..config.common import DATALOADER_KEYS
+from ..data.prefetch import Prefetcher, to_device
+from ..data.resumable import ResumableSampler
 
 # TODO: Implement TORCHVISION CHECKPOINTS
 
@@ -16,6 +19,8 @@ from ..config.common import DATALOADER_KEYS
 # ELEMENTS:
 #     self.data =  {mode: ...}
 #     self.datum = {mode: ...}
+#     self.data_prefetch = {mode: depth}
+#     self.data_samplers = {mode: bd.ResumableSampler}
 # EVENTS ISSUED:
 #     (<mode> in ['training', 'validation', 'testing'])
 #     iterate_data(mode) -> "<mode>_epoch_setup"
@@ -25,7 +30,7 @@ from ..config.common import DATALOADER_KEYS
 #     iterate_data(mode) -> "<mode>_iteration_start"
 #     iterate_data(mode) -> "<mode>_iteration_end"
 # EVENTS LISTENED:
-#     None
+#     "get_checkpoint_settings" -> setup_sampler_checkpoints
 # ATTACH FUNCTIONS:
 #     attach_trainining_data
 #     attach_validation_data
@@ -36,21 +41,69 @@ class Data(Device, StateUtils):
         # Manage self.data and self.datum dictionaries
         _create_state_dict_element(self, 'data')
         _create_state_dict_element(self, 'datum')
+        _create_state_dict_element(self, 'data_prefetch')
+        _create_state_dict_element(self, 'data_samplers')
 
-    def iterate_data_no_events(self, mode):
+    # Checkpoints the state of the resumable samplers of the attached data
+    @bd.on('get_checkpoint_settings')
+    def setup_sampler_checkpoints(self):
+        for mode, data in self.data.items():
+            sampler = getattr(data, 'sampler', None)
+            if isinstance(sampler, ResumableSampler):
+                self.data_samplers[mode] = sampler
+        if not self.data_samplers:
+            return None
+        return [dict(state_key=f'data_samplers.{k}') for k in self.data_samplers]
+
+    # Prefetch depth batches of the data of the given modes (all if None)
+    # in a background thread, moving them to the default device
+    # (see bd.data.Prefetcher). Use depth=0 to disable prefetching.
+    def set_data_prefetch(self, depth=1, modes=None):
+        if modes is None:
+            modes = ['training', 'validation', 'testing']
+        elif isinstance(modes, str):
+            modes = [modes]
+        for mode in modes:
+            self.data_prefetch[mode] = depth
+        return self
+
+    # Yields the batches of self.data[mode] moved to the default device,
+    # starting from batch start_step of the epoch.
+    # Data with a bd.ResumableSampler skip batches without loading them.
+    def _iterate_on_device(self, mode, start_step=0, epoch=None):
         _check_member_exists(self, f'data.{mode}')
-        for self.datum[mode] in self.data[mode]:
+        data, device = self.data[mode], self.devices.default
+        sampler = getattr(data, 'sampler', None)
+        # e.g. ResumableSampler or torch's DistributedSampler
+        if (epoch is not None) and hasattr(sampler, 'set_epoch'):
+            sampler.set_epoch(epoch)
+        if isinstance(sampler, ResumableSampler):
+            sampler.set_start(start_step * (getattr(data, 'batch_size', None) or 1))
+        elif start_step > 0:
+            bd.warn(
+                f'{mode} data does not use a bd.ResumableSampler. '
+                f'Loading {start_step} batches to skip them.'
+            )
+            data = islice(data, start_step, None)
+        depth = self.data_prefetch.get(mode, 0)
+        if depth > 0:
+            yield from Prefetcher(data, device, depth)
+        else:
+            for datum in data:
+                yield to_device(datum, device)
+
+    def iterate_data_no_events(self, mode, start_step=0, epoch=None):
+        for self.datum[mode] in self._iterate_on_device(mode, start_step, epoch):
             with bd.CleanupState(self):
-                self.to(self.devices.default, 'datum')
                 yield self.datum[mode]
             del self.datum[mode]
 
-    def iterate_data(self, mode):
+    # start_step and epoch are used to resume iterating from the middle of an epoch
+    def iterate_data(self, mode, start_step=0, epoch=None):
         _check_member_exists(self, f'data.{mode}')
         self.event(f'{mode}_epoch_start')
-        for self.datum[mode] in self.data[mode]:
+        for self.datum[mode] in self._iterate_on_device(mode, start_step, epoch):
             with bd.CleanupState(self):
-                self.to(self.devices.default, 'datum')
                 self.event(f'{mode}_iteration_setup')
                 self.event(f'{mode}_iteration_start')
                 yield self.datum[mode]
@@ -80,8 +133,21 @@ class Data(Device, StateUtils):
     def attach_testing_data(self, force=False):
         self.attach_data('testing', force=False)
 
+    # Sampler for create_dataloader_from_cfg (None for the DataLoader default)
+    def create_sampler(self, dataset, shuffle, resumable=False):
+        if resumable:
+            return ResumableSampler(dataset, shuffle=shuffle)
+        return None
+
+    # If resumable is True, a bd.ResumableSampler is used for sampling
     def create_dataloader_from_cfg(
-        self, dataset, cfg=None, worker_init_fn=None, collate_fn=None, postprocess=None
+        self,
+        dataset,
+        cfg=None,
+        worker_init_fn=None,
+        collate_fn=None,
+        postprocess=None,
+        resumable=False,
     ):
         cfg = _prepare_cfg(cfg, DATALOADER_KEYS)
         kwargs = {
@@ -103,4 +169,8 @@ class Data(Device, StateUtils):
             collate_new = collate_fn
 
         kwargs['collate_fn'] = collate_new
+        sampler = self.create_sampler(dataset, cfg.shuffle, resumable)
+        if sampler is not None:
+            kwargs['sampler'] = sampler
+            kwargs['shuffle'] = False
         return DataLoader(dataset, **kwargs)
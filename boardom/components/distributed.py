@@ -0,0 +1,113 @@
+import contextlib
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data.distributed import DistributedSampler
+import boardom as bd
+from .util import _create_state_dict_element, _set_default_value
+from .sgd import DefaultSGDTrainer
+from ..data.resumable import ResumableSampler
+
+
+# DistributedDataParallel with state dicts of the wrapped module, so that
+# checkpoints are the same as the ones of non distributed training
+class DistributedModel(DistributedDataParallel):
+    def state_dict(self, *args, **kwargs):
+        return self.module.state_dict(*args, **kwargs)
+
+    def load_state_dict(self, state_dict, strict=True):
+        return self.module.load_state_dict(state_dict, strict=strict)
+
+
+def _has_trainable_parameters(model):
+    return isinstance(model, torch.nn.Module) and any(
+        p.requires_grad for p in model.parameters()
+    )
+
+
+# ELEMENTS:
+#     self.distributed = {'backend': ..., 'rank': ..., 'world_size': ...}
+# EVENTS ISSUED:
+#     None
+# EVENTS LISTENED:
+#     "training_start" -> distribute_models
+# ATTACH FUNCTIONS:
+#     None
+#
+# Checkpoints, image samples and logs are only written by rank 0
+# (see bd.only_main_rank), and tracked averages are all-reduced.
+# Gradients are not all-reduced for backward passes that are followed by
+# more accumulated ones (gradient accumulation or micro-batches).
+class DistributedSGDTrainer(DefaultSGDTrainer):
+    def __init__(self):
+        super().__init__()
+        _create_state_dict_element(self, 'distributed')
+        _set_default_value(self.distributed, 'backend', None)
+        _set_default_value(self.distributed, 'rank', 0)
+        _set_default_value(self.distributed, 'world_size', 1)
+
+    # Initializes the default process group (if not already initialized).
+    # With the default init_method, MASTER_ADDR, MASTER_PORT, RANK and
+    # WORLD_SIZE are read from the environment.
+    def setup_distributed(
+        self, backend='gloo', init_method='env://', rank=None, world_size=None
+    ):
+        if not bd.is_distributed():
+            kwargs = {}
+            if rank is not None:
+                kwargs['rank'] = rank
+            if world_size is not None:
+                kwargs['world_size'] = world_size
+            dist.init_process_group(backend, init_method=init_method, **kwargs)
+        self.distributed.backend = dist.get_backend()
+        self.distributed.rank = dist.get_rank()
+        self.distributed.world_size = dist.get_world_size()
+        bd.log(
+            f'Distributed training: rank {self.distributed.rank} '
+            f'of {self.distributed.world_size} ({self.distributed.backend})'
+        )
+        return self
+
+    # Wraps models with trainable parameters in DistributedDataParallel.
+    # Runs at training_start, so models can be attached before or after
+    # setup_distributed().
+    @bd.on('training_start')
+    def distribute_models(self):
+        if not bd.is_distributed():
+            return
+        device = self.devices.default
+        device_ids = [device] if device.type == 'cuda' else None
+        for key, model in self.models.items():
+            if isinstance(model, DistributedDataParallel):
+                continue
+            if not _has_trainable_parameters(model):
+                continue
+            self.models[key] = DistributedModel(model, device_ids=device_ids)
+
+    def gradient_sync(self, sync):
+        stack = contextlib.ExitStack()
+        if not sync:
+            for model in self.models.values():
+                if isinstance(model, DistributedDataParallel):
+                    stack.enter_context(model.no_sync())
+        return stack
+
+    # Samplers are sharded across ranks.
+    # With resumable=True, all ranks use the seed of rank 0.
+    def create_sampler(self, dataset, shuffle, resumable=False):
+        if not bd.is_distributed():
+            return super().create_sampler(dataset, shuffle, resumable)
+        rank, world_size = dist.get_rank(), dist.get_world_size()
+        if not resumable:
+            return DistributedSampler(
+                dataset, num_replicas=world_size, rank=rank, shuffle=shuffle
+            )
+        seed = torch.empty((), dtype=torch.int64).random_()
+        dist.broadcast(seed, src=0)
+        return ResumableSampler(
+            dataset,
+            shuffle=shuffle,
+            seed=int(seed.item()),
+            num_replicas=world_size,
+            rank=rank,
+        )
@@ -0,0 +1,197 @@
+import json
+import math
+import mmap
+import pickle
+import struct
+from fnmatch import fnmatch
+from collections.abc import Mapping
+import torch
+from .checkpoint_writer import map_leaves, rebuild_mapping
+from .chunk_store import _compact, is_manifest
+
+# Flat checkpoint format (similar to safetensors):
+#
+#   MAGIC | header size (uint64, little endian) | JSON header
+#   | pickled skeleton | padding | tensor data
+#
+# The skeleton is the saved object with its tensors replaced by TensorRefs.
+# The header holds the dtype, shape and location (relative to the start of
+# the aligned data section) of every tensor, named by its dotted path in
+# the skeleton (e.g. "encoder.0.weight" for a state dict).
+#
+# Files are loaded by memory mapping the data section, so tensors are views
+# of the (copy on write) mapping that are only read from disk when accessed.
+
+FLAT_EXT = '.flat'
+MAGIC = b'BDFLAT01'
+ALIGNMENT = 64
+FORMATS = ['torch', 'flat']
+
+
+class TensorRef:
+    __slots__ = ['name']
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f'TensorRef({self.name})'
+
+    def __getstate__(self):
+        return self.name
+
+    def __setstate__(self, state):
+        self.name = state
+
+
+def _align(n):
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+
+def _dtype_name(dtype):
+    return str(dtype).split('.')[-1]
+
+
+# Replaces the tensors of obj with TensorRefs named by their path.
+# Returns the skeleton and a {name: tensor} dictionary.
+def flatten_tensors(obj):
+    tensors = {}
+
+    def _flatten(x, path):
+        if isinstance(x, torch.Tensor):
+            name = '.'.join(path)
+            while name in tensors:
+                name += '_'
+            tensors[name] = x
+            return TensorRef(name)
+        elif isinstance(x, Mapping):
+            items = {k: _flatten(v, path + (str(k),)) for k, v in x.items()}
+            return rebuild_mapping(x, items)
+        elif isinstance(x, (list, tuple)) and not hasattr(x, '_fields'):
+            return type(x)(_flatten(v, path + (str(i),)) for i, v in enumerate(x))
+        else:
+            return x
+
+    return _flatten(obj, ()), tensors
+
+
+# Replaces the TensorRefs of a skeleton with get_tensor(name)
+def unflatten_tensors(skeleton, get_tensor):
+    def _unflatten(x):
+        if isinstance(x, TensorRef):
+            return get_tensor(x.name)
+        return x
+
+    return map_leaves(_unflatten, skeleton)
+
+
+# Keeps the entries of (nested) mappings whose dotted path matches any of the
+# (fnmatch) patterns, e.g. "encoder.*"
+def select_keys(obj, patterns):
+    if is_manifest(obj):
+        return {**obj, 'state': select_keys(obj['state'], patterns)}
+
+    def _select(x, path):
+        items = {}
+        for key, val in x.items():
+            subpath = f'{path}.{key}' if path else str(key)
+            if any(fnmatch(subpath, p) for p in patterns):
+                items[key] = val
+            elif isinstance(val, Mapping):
+                selected = _select(val, subpath)
+                if selected:
+                    items[key] = selected
+        return rebuild_mapping(x, items)
+
+    if not isinstance(obj, Mapping):
+        return obj
+    return _select(obj, '')
+
+
+# Save func is save(object, filename)
+def save_flat(obj, filename):
+    skeleton, tensors = flatten_tensors(obj)
+    skeleton_bytes = pickle.dumps(skeleton)
+    entries, data, offset = {}, [], 0
+    for name, tensor in tensors.items():
+        tensor = _compact(tensor)
+        nbytes = tensor.numel() * tensor.element_size()
+        entries[name] = {
+            'dtype': _dtype_name(tensor.dtype),
+            'shape': list(tensor.shape),
+            'offset': offset,
+            'nbytes': nbytes,
+        }
+        data.append((offset, tensor))
+        offset = _align(offset + nbytes)
+    header = json.dumps(
+        {'skeleton_nbytes': len(skeleton_bytes), 'tensors': entries}
+    ).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header) + len(skeleton_bytes))
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        f.write(skeleton_bytes)
+        for offset, tensor in data:
+            f.write(bytes(data_start + offset - f.tell()))
+            if tensor.numel() > 0:
+                f.write(tensor.reshape(-1).view(torch.uint8).numpy())
+
+
+class FlatCheckpoint:
+    """Memory mapped flat checkpoint file.
+
+    Tensors are views of a copy on write memory mapping of the file, so they
+    are only read from disk when accessed and modifying them does not modify
+    the file.
+
+    Args:
+        filename (str): File written with save_flat().
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise RuntimeError(f'{filename} is not a flat checkpoint file.')
+            (header_nbytes,) = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_nbytes))
+            self.skeleton = pickle.loads(f.read(header['skeleton_nbytes']))
+            self.tensors = header['tensors']
+            self._data_start = _align(f.tell())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    def keys(self):
+        return self.tensors.keys()
+
+    def get_tensor(self, name):
+        entry = self.tensors[name]
+        dtype = getattr(torch, entry['dtype'])
+        if entry['nbytes'] == 0:
+            return torch.empty(entry['shape'], dtype=dtype)
+        tensor = torch.frombuffer(
+            self._mmap,
+            dtype=dtype,
+            count=math.prod(entry['shape']),
+            offset=self._data_start + entry['offset'],
+        )
+        return tensor.reshape(entry['shape'])
+
+    # Only the tensors of the entries matching the patterns are mapped
+    def load(self, patterns=None, map_location=None):
+        skeleton = self.skeleton
+        if patterns is not None:
+            skeleton = select_keys(skeleton, patterns)
+
+        def _get_tensor(name):
+            tensor = self.get_tensor(name)
+            if map_location is not None:
+                tensor = tensor.to(map_location)
+            return tensor
+
+        return unflatten_tensors(skeleton, _get_tensor)
+
+
+# Load func is load(filename, **kwargs)
+def load_flat(filename, patterns=None, map_location=None):
+    return FlatCheckpoint(filename).load(patterns, map_location=map_location)
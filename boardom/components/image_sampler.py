@@ -6,6 +6,8 @@ from ..config.common import IMAGE_SAMPLER_KEYS
 
 # save_fn is save(obj, filename)
 class ImageSampler(bd.Engine):
+    # Only the main rank saves when training is distributed
+    @bd.only_main_rank
     def save_sample(
         self,
         sample,
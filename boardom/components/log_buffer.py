@@ -0,0 +1,86 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import torch
+
+
+# Host (python) values of the rows. The tensors of all rows are transferred
+# with a single copy per device (and dtype).
+def _to_host(rows):
+    tensors = {}
+    for i, (_, _, values) in enumerate(rows):
+        for key, val in values.items():
+            if torch.is_tensor(val):
+                tensors.setdefault((val.device, val.dtype), []).append((i, key, val))
+    host_rows = [(info, walltime, dict(values)) for info, walltime, values in rows]
+    for entries in tensors.values():
+        stacked = torch.stack([val for _, _, val in entries]).reshape(len(entries))
+        for (i, key, _), val in zip(entries, stacked.tolist()):
+            host_rows[i][2][key] = val
+    return host_rows
+
+
+class LogBuffer:
+    """Buffers logged values and writes them in batches.
+
+    Tensor values are kept (detached, on their device) until the buffer is
+    flushed, so logging does not synchronize with the device at every step.
+    The buffer is flushed when it holds flush_every rows or when
+    flush_interval seconds have passed since the last flush, and the rows
+    are written by write_fn(rows) in a background thread.
+    Rows are (info, walltime, values) tuples, where info is given to add().
+
+    Args:
+        write_fn (Callable): Writes a list of rows.
+        flush_every (int, optional): Number of rows that triggers a flush.
+        flush_interval (float, optional): Seconds between flushes.
+    """
+
+    def __init__(self, write_fn, flush_every=None, flush_interval=None):
+        if flush_every is None and flush_interval is None:
+            flush_every = 1
+        self.write_fn = write_fn
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._last_flush = time.monotonic()
+        self._executor = None
+        self._futures = []
+
+    def add(self, values, info=None):
+        values = {
+            k: v.detach() if torch.is_tensor(v) else v for k, v in values.items()
+        }
+        self._rows.append((info, time.time(), values))
+        if self._due():
+            self.flush()
+
+    def _due(self):
+        if (self.flush_every is not None) and len(self._rows) >= self.flush_every:
+            return True
+        if self.flush_interval is not None:
+            return time.monotonic() - self._last_flush >= self.flush_interval
+        return False
+
+    # With wait=True, also waits for the rows to be written (and raises
+    # exceptions that occured while writing)
+    def flush(self, wait=False):
+        rows, self._rows = self._rows, []
+        self._last_flush = time.monotonic()
+        if rows:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='bd_log_writer'
+                )
+            future = self._executor.submit(self.write_fn, _to_host(rows))
+            # Keep failed futures so that flush(wait=True) raises their exceptions
+            self._futures = [
+                f for f in self._futures if not (f.done() and f.exception() is None)
+            ]
+            self._futures.append(future)
+        if wait:
+            futures, self._futures = self._futures, []
+            for future in futures:
+                future.result()
+
+    def __len__(self):
+        return len(self._rows)
@@ -1,66 +1,275 @@
 import os
 from collections.abc import Mapping, Sequence, Callable
+import torch
+import torch.distributed as dist
 from torch.utils.tensorboard import SummaryWriter
+from torch.utils.tensorboard.summary import scalar
+from tensorboard.compat.proto.summary_pb2 import Summary
 import boardom as bd
 from .util import _create_state_dict_element, _prepare_cfg
+from .log_buffer import LogBuffer
+
+
+# Float64 tensor (on device) of a list of values (tensors are averaged)
+@torch.no_grad()
+def _stack_scalars(values, device):
+    n_tensors = sum(torch.is_tensor(x) for x in values)
+    if n_tensors == 0:
+        return torch.tensor(values, dtype=torch.float64, device=device)
+    if n_tensors < len(values):
+        values = [torch.as_tensor(x, device=device) for x in values]
+    elif any(x.device != device for x in values):
+        values = [x.to(device, non_blocking=True) for x in values]
+    values = [x if x.dim() == 0 else x.to(torch.float64).mean() for x in values]
+    return torch.stack(values).to(torch.float64)
 
 
 class AverageTracker:
-    def __init__(self, engine, size_key, fields):
-        self.trackers = {}
+    """Tracks the (weighted) averages of the fields of logged values.
+
+    The sums of all fields are kept in a single float64 tensor on the device
+    of the tracked values and are updated with one in-place operation, so
+    update() does not synchronize with the device, and tensor values are
+    detached. Values are only copied to the host by get() and
+    get_variances(). Counts (sizes) are kept on the host.
+    With variance=True, the (weighted) variance of the values is also
+    tracked using Welford's algorithm.
+
+    Values are numbers or tensors. Tensors with multiple elements (e.g.
+    per sample losses) are averaged before they are tracked.
+    """
+
+    def __init__(self, engine, size_key, fields, variance=False):
         self.engine = engine
         self.size_key = size_key
         self.fields = fields
+        self.variance = variance
+        self.keys = []
+        self.device = None
+        self._counts = []
+        # Rows: sum (or mean and m2 with variance=True)
+        self._stats = None
+        self._positions = {}
+
+    # Positions (list and index tensor on the device) of the given keys
+    def _get_positions(self, keys):
+        positions = self._positions.get(keys, None)
+        if positions is None:
+            new_keys = [k for k in keys if k not in self.keys]
+            if new_keys:
+                self.keys += new_keys
+                self._counts += [0.0] * len(new_keys)
+                new_stats = torch.zeros(
+                    (2 if self.variance else 1, len(self.keys)),
+                    dtype=torch.float64,
+                    device=self.device,
+                )
+                if self._stats is not None:
+                    new_stats[:, : self._stats.shape[1]] = self._stats
+                self._stats = new_stats
+                # Positions of keys that are all the tracked ones change
+                self._positions = {}
+            pos = [self.keys.index(k) for k in keys]
+            index = None
+            if pos != list(range(len(self.keys))):
+                index = torch.tensor(pos, dtype=torch.long, device=self.device)
+            positions = (pos, index)
+            self._positions[keys] = positions
+        return positions
 
     def update(self, values):
         size = 1
         if self.size_key is not None:
             size = self.engine[self.size_key]
+        size = float(size)
+        fields = values.keys() if self.fields is None else self.fields
+        keys = tuple(f for f in fields if f in values)
+        if not keys:
+            return
+        if self.device is None:
+            self.device = next(
+                (values[k].device for k in keys if torch.is_tensor(values[k])),
+                torch.device('cpu'),
+            )
+        pos, index = self._get_positions(keys)
+        x = _stack_scalars([values[k] for k in keys], self.device)
+        counts = self._counts
+        for p in pos:
+            counts[p] += size
+        stats = self._stats
+        if not self.variance:
+            if index is None:
+                stats[0].add_(x, alpha=size)
+            else:
+                stats[0].index_add_(0, index, x, alpha=size)
+            return
+        # Weighted Welford update
+        ratio = torch.tensor(
+            [size / counts[p] for p in pos], dtype=torch.float64, device=self.device
+        )
+        mean, m2 = stats if index is None else stats[:, index]
+        delta = x - mean
+        new_mean = mean + delta * ratio
+        new_m2 = m2 + size * delta * (x - new_mean)
+        if index is None:
+            stats.copy_(torch.stack([new_mean, new_m2]))
+        else:
+            stats[:, index] = torch.stack([new_mean, new_m2])
+
+    def reset(self):
+        self._counts = [0.0] * len(self.keys)
+        if self._stats is not None:
+            self._stats.zero_()
+
+    # Count, sum and sum of squared deviations of each field (on the host)
+    def _moments(self):
+        counts = torch.tensor(self._counts, dtype=torch.float64)
+        if self._stats is None:
+            return torch.zeros((3, 0), dtype=torch.float64)
+        stats = self._stats.cpu()
+        if self.variance:
+            mean, m2 = stats
+            return torch.stack([counts, counts * mean, m2])
+        return torch.stack([counts, stats[0], torch.zeros_like(counts)])
+
+    def get(self):
+        count, total, _ = self._all_moments()
+        return {
+            k: v / c for k, c, v in zip(self._sorted_keys(), count, total) if c > 0
+        }
+
+    # Population variances (unbiased=False) or sample variances
+    def get_variances(self, unbiased=False):
+        if not self.variance:
+            raise RuntimeError('Variance is not tracked (use variance=True)')
+        count, _, m2 = self._all_moments()
+        offset = 1 if unbiased else 0
+        return {
+            k: v / (c - offset)
+            for k, c, v in zip(self._sorted_keys(), count, m2)
+            if c > offset
+        }
+
+    def _sorted_keys(self):
+        return sorted(self.keys) if bd.is_distributed() else self.keys
+
+    def _all_moments(self):
+        moments = self._moments()
+        if bd.is_distributed():
+            moments = self._all_reduced(moments)
+        return moments.tolist()
+
+    # Moments over all ranks (all ranks must call get() and track the same fields)
+    def _all_reduced(self, moments):
+        order = sorted(range(len(self.keys)), key=lambda i: self.keys[i])
+        count, total, m2 = moments[:, order]
+        mean = total / count.clamp(min=1)
+        # Sums of counts, values and squared values
+        sums = torch.stack([count, total, m2 + count * mean**2])
+        dist.all_reduce(sums)
+        count, total, squares = sums
+        mean = total / count.clamp(min=1)
+        return torch.stack([count, total, squares - count * mean**2])
+
+
+class MeterTracker:
+    """Tracks the fields of logged values with a meter per field.
+
+    Meters are created with meter_fn() and must implement add(values),
+    get(), and merge(other) (e.g. bd.EMA, bd.LogHistogram). When training is
+    distributed, the meters of all ranks are merged by get().
+    """
+
+    def __init__(self, fields, meter_fn):
+        self.fields = fields
+        self.meter_fn = meter_fn
+        self.meters = {}
+
+    def update(self, values):
         fields = values.keys() if self.fields is None else self.fields
-        trackers = self.trackers
         for f in fields:
             if f not in values:
                 continue
-            tracker = trackers.get(f, bd.Average())
-            tracker.add(values[f], size)
-            trackers[f] = tracker
+            meter = self.meters.get(f, None)
+            if meter is None:
+                meter = self.meters[f] = self.meter_fn()
+            meter.add(values[f])
 
     def reset(self):
-        for tracker in self.trackers.values():
-            tracker.reset()
+        self.meters = {}
 
     def get(self):
-        ret = {k: t.get() for k, t in self.trackers.items()}
+        meters = self.meters
+        if bd.is_distributed():
+            meters = self._all_merged()
+        ret = {k: m.get() for k, m in meters.items()}
         return {k: v for k, v in ret.items() if v is not None}
 
+    # All ranks must call get()
+    def _all_merged(self):
+        gathered = [None] * dist.get_world_size()
+        dist.all_gather_object(gathered, self.meters)
+        merged = {}
+        for meters in gathered:
+            for key in sorted(meters):
+                if key in merged:
+                    merged[key].merge(meters[key])
+                else:
+                    merged[key] = meters[key]
+        return merged
+
 
 class GenericLogger:
-    def __init__(self, get_value_fn, log_fn, state_key, fields):
+    def __init__(self, get_value_fn, log_fn, state_key, fields, flush_fn=None):
         self._get_value_fn = get_value_fn
-        self._log_fn = log_fn
+        # Values are computed on all ranks (averages are all-reduced)
+        # but only written by the main rank
+        self._log_fn = bd.only_main_rank(log_fn)
+        self._flush_fn = flush_fn
         self.state_key = state_key
         self.fields = fields
         self._trackers = {}
 
-    def track_averages(self, engine=None, size_key=None):
+    # With variance=True, log_averages() also logs the variances
+    # meters is a {name: meter_fn} dictionary of additional meters
+    # (see MeterTracker), e.g. {'ema': lambda: bd.EMA(0.9)}
+    # Meters that return a dictionary (e.g. bd.LogHistogram) are logged
+    # with a tag for every key (e.g. "quantiles_p99").
+    def track_averages(self, engine=None, size_key=None, variance=False, meters=None):
         if (size_key is not None) and (not isinstance(engine, (bd.Engine, bd.State))):
             raise RuntimeError('Expected engine for provided size_key')
-        self._trackers['average'] = AverageTracker(engine, size_key, self.fields)
+        self._trackers = {
+            'average': AverageTracker(
+                engine, size_key, self.fields, variance=variance
+            )
+        }
+        for name, meter_fn in (meters or {}).items():
+            if name in ['average', 'variance']:
+                raise RuntimeError(f'Meter name "{name}" is reserved')
+            self._trackers[name] = MeterTracker(self.fields, meter_fn)
 
     def reset_averages(self):
-        self._trackers['average'].reset()
+        for tracker in self._trackers.values():
+            tracker.reset()
 
     def update_averages(self, value=None):
         value = self._get_value_fn() if value is None else value
         if value is None:
             return
-        self._trackers['average'].update(value)
+        for tracker in self._trackers.values():
+            tracker.update(value)
 
     def log_averages(self):
-        value = self._trackers['average'].get()
-        if value is None:
+        tracker = self._trackers['average']
+        value = tracker.get()
+        if not value:
             return
         self._log_fn(value, tag='average')
+        if tracker.variance:
+            self._log_fn(tracker.get_variances(), tag='variance')
+        for name, tracker in self._trackers.items():
+            if name != 'average':
+                _log_meter_values(self._log_fn, name, tracker.get())
 
     def log(self, value=None):
         value = self._get_value_fn() if value is None else value
@@ -69,6 +278,27 @@ class GenericLogger:
             return
         self._log_fn(value)
 
+    # Writes buffered values and waits until they are written
+    def flush(self):
+        if self._flush_fn is not None:
+            self._flush_fn()
+
+
+# Logs {field: value} or {field: {key: value}} meter values
+def _log_meter_values(log_fn, name, values):
+    if not values:
+        return
+    if not any(isinstance(v, Mapping) for v in values.values()):
+        log_fn(values, tag=name)
+        return
+    by_key = {}
+    for field, val in values.items():
+        for key, subval in val.items():
+            if subval is not None:
+                by_key.setdefault(key, {})[field] = subval
+    for key, subvalues in by_key.items():
+        log_fn(subvalues, tag=f'{name}_{key}')
+
 
 def _make_logger(lgr):
     if isinstance(lgr, GenericLogger):
@@ -79,6 +309,17 @@ def _make_logger(lgr):
         raise RuntimeError(f'Loggers must be Callables, got: {type(lgr)}')
 
 
+# Flushes the buffer (if any) and waits for it to be written
+def _buffer_flusher(buffer):
+    if buffer is None:
+        return None
+
+    def flush_fn():
+        buffer.flush(wait=True)
+
+    return flush_fn
+
+
 def _value_getter(self, state_key, fields):
     def get_value_fn():
         if state_key not in self:
@@ -96,6 +337,20 @@ def _value_getter(self, state_key, fields):
     return get_value_fn
 
 
+# ELEMENTS:
+#     self.loggers
+#     self.tensorboard (if a tensorboard logger is set up)
+#     self.csv_writers (if a csv logger is set up)
+# EVENTS ISSUED:
+#     None
+# EVENTS LISTENED:
+#     "training_end" -> flush_loggers
+# ATTACH FUNCTIONS:
+#     attach_loggers
+#
+# Tensorboard and csv loggers that are set up with flush_every and/or
+# flush_interval keep logged values (as tensors, on their device) in a
+# LogBuffer, and write them in batches in a background thread.
 class LoggerEngine(bd.Engine):
     def __init__(self):
         super().__init__()
@@ -131,6 +386,8 @@ class LoggerEngine(bd.Engine):
         category='plots',
         fields=None,
         directory='.',
+        flush_every=None,
+        flush_interval=None,
         **kwargs,
     ):
         if 'tensorboard' not in self:
@@ -145,6 +402,19 @@ class LoggerEngine(bd.Engine):
             writer = self.tensorboard
 
         category = category.rstrip('/') + '/'
+        buffer = None
+        if (flush_every is not None) or (flush_interval is not None):
+
+            # One event (with all the values) per step
+            def write_rows(rows):
+                file_writer = writer._get_file_writer()
+                for step, walltime, values in rows:
+                    summary = Summary(
+                        value=[scalar(k, v).value[0] for k, v in values.items()]
+                    )
+                    file_writer.add_summary(summary, step, walltime)
+
+            buffer = LogBuffer(write_rows, flush_every, flush_interval)
 
         if mode in ['scalar', 'scalars']:
             get_value_fn = _value_getter(self, values_key, fields)
@@ -155,6 +425,13 @@ class LoggerEngine(bd.Engine):
                 if step_key not in self:
                     return
                 step = self[step_key]
+                if buffer is not None:
+                    values = {
+                        f'{new_cat}{values_key}.{key}': val
+                        for key, val in values.items()
+                    }
+                    buffer.add(values, info=int(step))
+                    return
                 for key, val in values.items():
                     writer.add_scalar(
                         f'{new_cat}{values_key}.{key}', val, global_step=step
@@ -163,7 +440,9 @@ class LoggerEngine(bd.Engine):
         else:
             raise RuntimeError(f'Tensorboard logger mode "{mode}" not supported.')
 
-        return GenericLogger(get_value_fn, log_fn, values_key, fields)
+        return GenericLogger(
+            get_value_fn, log_fn, values_key, fields, _buffer_flusher(buffer)
+        )
 
     def setup_tensorboard_logger_from_cfg(
         self,
@@ -173,15 +452,33 @@ class LoggerEngine(bd.Engine):
         category='plots',
         fields=None,
         cfg=None,
+        flush_every=None,
+        flush_interval=None,
         **kwargs,
     ):
         cfg = _prepare_cfg(cfg, ['session_path'])
         directory = bd.process_path(os.path.join(cfg.session_path, 'tensorboard'))
         return self.setup_tensorboard_logger(
-            values_key, step_key, mode, category, fields, directory, **kwargs
+            values_key,
+            step_key,
+            mode,
+            category,
+            fields,
+            directory,
+            flush_every=flush_every,
+            flush_interval=flush_interval,
+            **kwargs,
         )
 
-    def setup_csv_logger(self, state_key, fields, directory='.', **kwargs):
+    def setup_csv_logger(
+        self,
+        state_key,
+        fields,
+        directory='.',
+        flush_every=None,
+        flush_interval=None,
+        **kwargs,
+    ):
         directory = bd.process_path(directory, create=True)
         if 'csv_writers' not in self:
             self.csv_writers = {}
@@ -199,14 +496,38 @@ class LoggerEngine(bd.Engine):
             return writer
 
         get_value_fn = _value_getter(self, state_key, fields)
+        buffer = None
+        if (flush_every is not None) or (flush_interval is not None):
+
+            # One write per csv file
+            def write_rows(rows):
+                grouped = {}
+                for writer, _, values in rows:
+                    grouped.setdefault(writer, []).append(values)
+                for writer, writer_rows in grouped.items():
+                    writer.log_rows(writer_rows)
+
+            buffer = LogBuffer(write_rows, flush_every, flush_interval)
 
         def log_fn(values, tag=''):
-            get_writer(tag)(values)
+            if buffer is not None:
+                buffer.add(values, info=get_writer(tag))
+            else:
+                get_writer(tag)(values)
 
-        return GenericLogger(get_value_fn, log_fn, state_key, fields)
+        return GenericLogger(
+            get_value_fn, log_fn, state_key, fields, _buffer_flusher(buffer)
+        )
 
     def setup_csv_logger_from_cfg(
-        self, state_key, fields, cfg=None, delimiter=',', resume=True
+        self,
+        state_key,
+        fields,
+        cfg=None,
+        delimiter=',',
+        resume=True,
+        flush_every=None,
+        flush_interval=None,
     ):
         cfg = _prepare_cfg(cfg, ['session_path'])
         directory = bd.process_path(os.path.join(cfg.session_path, 'csv'), create=True)
@@ -214,6 +535,8 @@ class LoggerEngine(bd.Engine):
             state_key,
             fields=fields,
             directory=directory,
+            flush_every=flush_every,
+            flush_interval=flush_interval,
             delimiter=delimiter,
             resume=resume,
         )
@@ -237,3 +560,9 @@ class LoggerEngine(bd.Engine):
     def reset_averages(self):
         for logger in self.loggers.values():
             logger.reset_averages()
+
+    # Writes the values of buffered loggers
+    @bd.on('training_end')
+    def flush_loggers(self):
+        for logger in self.loggers.values():
+            logger.flush()
@@ -0,0 +1,73 @@
+import math
+
+# Checkpoint retention policies.
+# They are evaluated on the file entries of the checkpointing metadata
+# (see checkpointer.py), in the order they were saved (by the checkpoint
+# number of their key, as the metafile is written with sorted keys):
+#     keep_last: Keep the last N checkpoints.
+#     keep_every: Keep the first checkpoint saved at or after every
+#                 multiple of K steps (uses the recorded "step").
+#     keep_best: Keep the best K checkpoints by the recorded "metric",
+#                lowest first if best_mode is 'min', highest if 'max'.
+# A checkpoint is kept if any policy keeps it. The latest checkpoint and
+# forced checkpoints are always kept.
+
+BEST_MODES = ['min', 'max']
+
+
+def has_retention(metadata):
+    return any(
+        metadata.get(key, None) is not None
+        for key in ['keep_last', 'keep_every', 'keep_best']
+    )
+
+
+def check_retention(metadata):
+    for key in ['keep_last', 'keep_every', 'keep_best']:
+        val = metadata.get(key, None)
+        if (val is not None) and ((not isinstance(val, int)) or val < 1):
+            raise RuntimeError(f'{key} must be a positive integer (got {val})')
+    if metadata.get('best_mode', 'min') not in BEST_MODES:
+        raise RuntimeError(
+            f'Invalid best_mode: {metadata["best_mode"]}'
+            f'\nValid modes: {", ".join(BEST_MODES)}'
+        )
+    if has_retention(metadata) and metadata.get('overwrite', False):
+        raise RuntimeError('Checkpoint retention policies require overwrite=False')
+
+
+# Checkpoint number of a file key (e.g. 'models_main_chk12' -> 12)
+def checkpoint_num(key):
+    return int(key.rsplit('_chk', 1)[-1])
+
+
+# Returns the keys of the files to keep.
+# files is a {key: file_meta} mapping, the highest checkpoint number is the
+# latest.
+def retained(files, keep_last=None, keep_every=None, keep_best=None, best_mode='min'):
+    keys = sorted(files, key=checkpoint_num)
+    keep = set(keys[-1:])
+    keep.update(k for k in keys if files[k].get('forced', False))
+    if keep_last is not None:
+        keep.update(keys[-keep_last:])
+    if keep_every is not None:
+        seen = set()
+        for k in keys:
+            step = files[k].get('step', None)
+            if step is None:
+                continue
+            bucket = step // keep_every
+            if bucket not in seen:
+                seen.add(bucket)
+                keep.add(k)
+    if keep_best is not None:
+        scored = [
+            k
+            for k in keys
+            if files[k].get('metric', None) is not None
+            and not math.isnan(files[k]['metric'])
+        ]
+        sign = 1 if best_mode == 'min' else -1
+        scored.sort(key=lambda k: sign * files[k]['metric'])
+        keep.update(scored[:keep_best])
+    return keep
@@ -1,24 +1,43 @@
+import contextlib
 import torch
 import boardom as bd
-from .util import _set_default_value, _create_state_dict_element
+from .util import _set_default_value, _create_state_dict_element, _prepare_cfg
 from .data import Data
 from .optimizers import Optimizers
 from .models import Models
 from .criteria import Criteria
+from ..config.common import AMP_KEYS
+from ..data.split import split_micro_batches, merge_micro_batches, batch_size
 
 
-# TODO: Restarting iterator from iteration.
 # TODO: Disable gradients for validation
 # TODO: torch.set_grad_enabled(False)
 # TODO: Do .train() after validation ends
 
+# Checkpointable view of the training counters of an engine
+# (restoring them is what allows fit() to resume mid-epoch)
+class TrainingProgress:
+    KEYS = ['epoch', 'global_step', 'epoch_step']
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def state_dict(self):
+        return {key: self.engine.training[key] for key in self.KEYS}
+
+    def load_state_dict(self, state_dict):
+        for key in self.KEYS:
+            self.engine.training[key] = state_dict[key]
+
+
 # ELEMENTS:
 #     self.training
+#     self.training_progress
 # EVENTS ISSUED:
 #     fit() -> "training_start"
 #     fit() -> "training_end"
 # EVENTS LISTENED:
-#     None
+#     "get_checkpoint_settings" -> setup_training_progress_checkpoints
 # ATTACH FUNCTIONS:
 #     None
 
@@ -34,8 +53,15 @@ class SGDTrainer(Data, Optimizers, Criteria, Models):
         _set_default_value(self.training, 'global_step', 0)
         _set_default_value(self.training, 'epoch_step', 0)
         _set_default_value(self.training, 'should_stop_training', False)
+        _set_default_value(self, 'training_progress', TrainingProgress(self))
+
+    @bd.on('get_checkpoint_settings')
+    def setup_training_progress_checkpoints(self):
+        return dict(state_key='training_progress')
 
     # Requires Data engine with iterate_data generator API
+    # If training.epoch_step is not 0 (e.g. after loading a checkpoint saved
+    # mid-epoch) the epoch is resumed from that step
     def fit(self, max_epochs=None):
         self.event('training_start')
         if ('max_epochs' not in self.training) or (max_epochs is not None):
@@ -45,41 +71,91 @@ class SGDTrainer(Data, Optimizers, Criteria, Models):
             bd.warn('max_epochs not set, training will continue indefinitely')
 
         while True:
-            self.training.epoch_step = 0
-            for _ in self.iterate_data('training'):
+            training = self.training
+            for _ in self.iterate_data(
+                'training', start_step=training.epoch_step, epoch=training.epoch
+            ):
                 self.training.global_step += 1
                 self.training.epoch_step += 1
                 self.train()
                 self.training_iteration()
                 if self.training.should_stop_training:
                     break
+            if self.training.should_stop_training:
+                break
+            # The epoch is complete, so a later fit() does not resume it
+            self.training.epoch_step = 0
             # Get max epochs again in case it changed:
             me = self.training.max_epochs
-            if self.training.should_stop_training or (
-                (me is not None) and (self.training.epoch == me)
-            ):
+            if (me is not None) and (self.training.epoch == me):
                 break
             self.training.epoch += 1
         self.event('training_end')
 
 
+def _amp_dtype(device_type, dtype):
+    if dtype in [None, 'auto']:
+        return torch.float16 if device_type == 'cuda' else torch.bfloat16
+    if isinstance(dtype, str):
+        return getattr(torch, dtype)
+    return dtype
+
+
 # ELEMENTS:
 #     self.training.n_accumulate_gradients
+#     self.training.n_micro_batches
+#     self.training.amp
+#     self.training.amp_dtype
 #     self.training.losses
 #     self.training.predictions
 #     self.training.metrics
+#     self.grad_scaler
 # EVENTS ISSUED:
-#     training_iteration() -> "forward"
-#     training_iteration() -> "backward"
+#     training_iteration() -> "did_micro_forward" (every forward, if listened)
+#     training_iteration() -> "did_micro_backward" (every backward, if listened)
+#     training_iteration() -> "did_forward" (once per optimizer step)
+#     training_iteration() -> "did_backward" (once per optimizer step)
+#     training_iteration() -> "optimizer_step"
 #     fit() -> "training_end"
 # EVENTS LISTENED:
-#     None
+#     "get_checkpoint_settings" -> setup_grad_scaler_checkpoints
 # ATTACH FUNCTIONS:
 #     None
 class DefaultSGDTrainer(SGDTrainer):
     def __init__(self):
         super().__init__()
         _set_default_value(self.training, 'n_accumulate_gradients', 1)
+        _set_default_value(self.training, 'n_micro_batches', 1)
+        _set_default_value(self.training, 'amp', False)
+        _set_default_value(self.training, 'amp_dtype', None)
+        # Disabled unless set_amp() is used with float16 on cuda
+        grad_scaler = torch.cuda.amp.GradScaler(enabled=False)
+        _set_default_value(self, 'grad_scaler', grad_scaler)
+
+    @bd.on('get_checkpoint_settings')
+    def setup_grad_scaler_checkpoints(self):
+        if not self.grad_scaler.is_enabled():
+            return None
+        return dict(state_key='grad_scaler')
+
+    # Automatic mixed precision: do_forward() runs under autocast and losses are
+    # scaled with self.grad_scaler (float16 only).
+    # dtype: 'auto' (or None) uses float16 on cuda and bfloat16 on cpu.
+    # Call after setting the default device.
+    def set_amp(self, enabled=True, dtype='auto'):
+        device_type = self.devices.default.type
+        dtype = _amp_dtype(device_type, dtype)
+        self.training.amp = enabled
+        self.training.amp_dtype = dtype
+        use_scaler = enabled and (device_type == 'cuda') and (dtype == torch.float16)
+        self.grad_scaler = torch.cuda.amp.GradScaler(enabled=use_scaler)
+        return self
+
+    def setup_amp_from_cfg(self, cfg=None):
+        cfg = _prepare_cfg(cfg, AMP_KEYS)
+        if cfg.amp:
+            bd.log(f'Using automatic mixed precision (dtype={cfg.amp_dtype})')
+        return self.set_amp(cfg.amp, cfg.amp_dtype)
 
     def accumulate_gradients(self, num_iter=1):
         if (not isinstance(num_iter, int)) or num_iter < 1:
@@ -89,27 +165,106 @@ class DefaultSGDTrainer(SGDTrainer):
 
         self.training.n_accumulate_gradients = num_iter
 
+    # Splits each batch (self.datum.training) into num_chunks micro-batches
+    # and accumulates their gradients (trading throughput for memory).
+    # Losses are weighted by the relative size of the micro-batches
+    # before do_backward(). After the iteration, self.datum.training, predictions and losses are the
+    # ones of the full batch (losses are detached).
+    def use_micro_batches(self, num_chunks=1):
+        if (not isinstance(num_chunks, int)) or num_chunks < 1:
+            raise RuntimeError(
+                f'Expected num_chunks to be a positive integer. Got: {num_chunks}'
+            )
+        self.training.n_micro_batches = num_chunks
+        return self
+
+    def _autocast_forward(self):
+        training = self.training
+        if not training.amp:
+            self.do_forward()
+            return
+        device_type = self.devices.default.type
+        with torch.autocast(
+            device_type, dtype=_amp_dtype(device_type, training.amp_dtype)
+        ):
+            self.do_forward()
+
     def training_iteration(self):
-        self.do_forward()
-        self.event('did_forward')
         training = self.training
         step = training.global_step
-        if (step % training.n_accumulate_gradients) == 0:
-            self.optimizers.main.zero_grad()
-        self.do_backward()
-        self.event('did_backward')
-        if (step % training.n_accumulate_gradients) == 0:
-            self.optimizers.main.step()
+        n_accumulate = training.n_accumulate_gradients
+        # Gradients are zeroed at the first step of each accumulation window
+        if ((step - 1) % n_accumulate) == 0:
+            self.optimizers.main.zero_grad(set_to_none=True)
+        # Gradients are only synchronized for the optimizer step
+        sync = (step % n_accumulate) == 0
+        if training.n_micro_batches > 1:
+            self._micro_batch_iteration(sync)
+        else:
+            with self.gradient_sync(sync):
+                self._autocast_forward()
+                self._micro_event('did_micro_forward')
+                if sync:
+                    self.event('did_forward')
+                self.do_backward()
+            self._micro_event('did_micro_backward')
+            if sync:
+                self.event('did_backward')
+        if sync:
+            # Same as optimizer.step() if the scaler is not enabled
+            self.grad_scaler.step(self.optimizers.main)
+            self.grad_scaler.update()
             self.event('optimizer_step')
 
+    # Events of intermediate steps and micro-batches are only issued
+    # if they are listened to (listeners opt in by registering for them)
+    def _micro_event(self, name):
+        if name in self._actions:
+            self.event(name)
+
     def do_forward(self):
         pred = self.models.main(self.datum.training[0])
         self.training.predictions = pred
         self.training.losses = self.criteria.main(pred, self.datum.training[1])
         self.training.metrics = None
 
+    # Context of the forward and backward pass of each micro-batch.
+    # sync is False if more gradients are accumulated before the next optimizer
+    # step (DistributedSGDTrainer skips the gradient all-reduce then).
+    def gradient_sync(self, sync):
+        return contextlib.nullcontext()
+
+    def _micro_batch_iteration(self, sync=True):
+        training, datum = self.training, self.datum
+        batch = datum.training
+        chunks = split_micro_batches(batch, training.n_micro_batches)
+        total = batch_size(batch)
+        predictions, loss = [], 0.0
+        try:
+            for i, chunk in enumerate(chunks):
+                last = i == len(chunks) - 1
+                datum.training = chunk
+                with self.gradient_sync(sync and last):
+                    self._autocast_forward()
+                    self._micro_event('did_micro_forward')
+                    if total is not None:
+                        training.losses = training.losses * (
+                            batch_size(chunk) / total
+                        )
+                    predictions.append(training.predictions)
+                    loss = loss + training.losses.detach()
+                    self.do_backward()
+                self._micro_event('did_micro_backward')
+        finally:
+            datum.training = batch
+        training.predictions = merge_micro_batches(predictions)
+        training.losses = loss
+        if sync:
+            self.event('did_forward')
+            self.event('did_backward')
+
     def do_backward(self):
-        self.training.losses.backward()
+        self.grad_scaler.scale(self.training.losses).backward()
 
 
 # ELEMENTS:
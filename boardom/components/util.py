@@ -56,8 +56,15 @@ def _iterate_state(state, prefix='', recurse=False):
                 yield m
 
 
+# Namedtuples take their fields as positional arguments
+def _is_namedtuple(item):
+    return isinstance(item, tuple) and hasattr(item, '_fields')
+
+
 def _skip_states(func, item):
-    if isinstance(item, (list, tuple)):
+    if _is_namedtuple(item):
+        return type(item)(*(_skip_states(func, x) for x in item))
+    elif isinstance(item, (list, tuple)):
         return type(item)(_skip_states(func, x) for x in item)
     elif isinstance(item, bd.State):
         return item
@@ -68,7 +75,9 @@ def _skip_states(func, item):
 
 
 def _recurse_apply(func, item):
-    if isinstance(item, (list, tuple)):
+    if _is_namedtuple(item):
+        return type(item)(*(_recurse_apply(func, x) for x in item))
+    elif isinstance(item, (list, tuple)):
         return type(item)(_recurse_apply(func, x) for x in item)
     elif isinstance(item, Mapping):
         return type(item)({key: _recurse_apply(func, val) for key, val in item.items()})
@@ -103,6 +103,7 @@ OPTIMIZERS = [
 ]
 
 DEVICE_KEYS = ['device', 'cudnn_benchmark']
+AMP_KEYS = ['amp', 'amp_dtype']
 CRITERIA_KEYS = ['criteria', 'criterion_weight']
 OPTIMIZER_KEYS = [
     'optimizer',
@@ -257,6 +258,19 @@ EXTRA_SETTINGS = [
         default=False,
         help='Use cudnn benchmark mode',
     ),
+    dict(
+        flag='--amp',
+        type=str2bool,
+        default=False,
+        help='Use automatic mixed precision for training',
+    ),
+    dict(
+        flag='--amp_dtype',
+        type=str.lower,
+        choices=['auto', 'float16', 'bfloat16'],
+        default='auto',
+        help='Autocast dtype (auto: float16 on cuda, bfloat16 on cpu)',
+    ),
     dict(
         flag='--criteria',
         nargs='+',
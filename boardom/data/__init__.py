@@ -3,3 +3,6 @@ from .loaded import LoadedDataset
 from .directory import DirectoryDataset
 from .grow import grow_dataset
 from .list import ListDataset
+from .prefetch import Prefetcher, to_device
+from .resumable import ResumableSampler
+from .split import split_micro_batches, merge_micro_batches, batch_size
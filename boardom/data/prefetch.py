@@ -0,0 +1,129 @@
+import queue
+import threading
+from functools import partial
+import torch
+from torch._utils import ExceptionWrapper
+
+_END = object()
+_PUT_TIMEOUT = 0.1
+
+
+# Imported on use, as boardom.components needs the rest of boardom
+def _recurse_apply(func, item):
+    from ..components.util import _recurse_apply
+
+    return _recurse_apply(func, item)
+
+
+def _to(x, device, non_blocking, pin):
+    if isinstance(x, torch.Tensor):
+        if pin and (x.device.type == 'cpu') and (not x.is_pinned()):
+            x = x.pin_memory()
+        return x.to(device, non_blocking=non_blocking)
+    elif hasattr(x, 'to'):
+        return x.to(device)
+    return x
+
+
+def _record_stream(x, stream):
+    if isinstance(x, torch.Tensor) and x.is_cuda:
+        x.record_stream(stream)
+    return x
+
+
+def to_device(item, device, non_blocking=False, pin=False):
+    """Moves the tensors in (nested lists, tuples and mappings of) item to device.
+
+    Args:
+        item: Object to move.
+        device (torch.device): Target device.
+        non_blocking (bool): Passed to torch.Tensor.to.
+        pin (bool): Pin CPU tensors before copying (for non blocking copies to CUDA).
+    """
+    to = partial(_to, device=device, non_blocking=non_blocking, pin=pin)
+    return _recurse_apply(to, item)
+
+
+def _put(out_queue, item, done):
+    while not done.is_set():
+        try:
+            out_queue.put(item, timeout=_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+class Prefetcher:
+    """Iterates over an iterable, fetching and moving items to a device ahead of time.
+
+    Items are fetched (and moved to the device) in a background thread, up to
+    `depth` items ahead of the consumer, so that loading and copying batch N+1
+    overlaps with the processing of batch N.
+    For CUDA devices, CPU tensors are pinned and copied with non blocking copies
+    on a side stream. The current stream waits for the copy before an item is
+    returned.
+
+    Args:
+        iterable: Iterable to prefetch from (e.g. a torch DataLoader).
+        device (torch.device or str): Device to move items to.
+        depth (int): Maximum number of items fetched ahead.
+    """
+
+    def __init__(self, iterable, device='cpu', depth=1):
+        if depth < 1:
+            raise ValueError(f'Prefetch depth must be at least 1 (got {depth}).')
+        self.iterable = iterable
+        self.device = torch.device(device)
+        self.depth = depth
+
+    def __len__(self):
+        return len(self.iterable)
+
+    def __iter__(self):
+        stream = None
+        if self.device.type == 'cuda':
+            stream = torch.cuda.Stream(self.device)
+        out_queue = queue.Queue(maxsize=self.depth)
+        done = threading.Event()
+        # Daemon thread, as it may be blocked fetching from the iterable
+        # when iteration stops early. It exits on its next put.
+        thread = threading.Thread(
+            target=self._fetch, args=(out_queue, done, stream), daemon=True
+        )
+        thread.start()
+        try:
+            while True:
+                item = out_queue.get()
+                if item is _END:
+                    break
+                if isinstance(item, ExceptionWrapper):
+                    item.reraise()
+                item, copied = item
+                if copied is not None:
+                    current = torch.cuda.current_stream(self.device)
+                    current.wait_event(copied)
+                    _recurse_apply(partial(_record_stream, stream=current), item)
+                yield item
+        finally:
+            done.set()
+
+    def _fetch(self, out_queue, done, stream):
+        try:
+            for item in self.iterable:
+                if done.is_set():
+                    return
+                copied = None
+                if stream is None:
+                    item = to_device(item, self.device)
+                else:
+                    with torch.cuda.stream(stream):
+                        item = to_device(item, self.device, non_blocking=True, pin=True)
+                        copied = torch.cuda.Event()
+                        copied.record(stream)
+                if not _put(out_queue, (item, copied), done):
+                    return
+        except Exception:
+            _put(out_queue, ExceptionWrapper(where='in prefetch thread'), done)
+            return
+        _put(out_queue, _END, done)
@@ -0,0 +1,78 @@
+import math
+import torch
+from torch.utils.data import Sampler
+
+
+class ResumableSampler(Sampler):
+    """Sampler that can start iterating from the middle of an epoch.
+
+    The order of the samples of an epoch is determined by the seed and the epoch
+    (set with set_epoch), so an interrupted epoch can be resumed by setting the
+    same epoch and the number of already consumed samples (set_start).
+    Skipped indices are never yielded, so their data is not loaded.
+    The seed is saved and loaded with state_dict() and load_state_dict().
+
+    For distributed training, each replica samples a different shard of the
+    epoch (as torch.utils.data.DistributedSampler, the indices are padded so
+    that all replicas get the same number of samples). All replicas must use
+    the same seed.
+
+    Args:
+        data_source (Sized): Dataset to sample from.
+        shuffle (bool): Shuffle the samples of every epoch.
+        seed (int, optional): Seed used for shuffling (random if not provided).
+        num_replicas (int): Number of replicas (processes) sampling the data.
+        rank (int): Rank of the current replica.
+    """
+
+    def __init__(self, data_source, shuffle=True, seed=None, num_replicas=1, rank=0):
+        if not (0 <= rank < num_replicas):
+            raise ValueError(f'Invalid rank {rank} for {num_replicas} replicas.')
+        self.data_source = data_source
+        self.shuffle = shuffle
+        if seed is None:
+            seed = int(torch.empty((), dtype=torch.int64).random_().item())
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def set_start(self, start):
+        if start < 0:
+            raise ValueError(f'Expected a non-negative start (got {start}).')
+        self.start = start
+
+    def indices(self):
+        n = len(self.data_source)
+        if not self.shuffle:
+            indices = list(range(n))
+        else:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            indices = torch.randperm(n, generator=generator).tolist()
+        if (self.num_replicas == 1) or (n == 0):
+            return indices
+        padding = self.num_samples() * self.num_replicas - n
+        indices += (indices * math.ceil(padding / n))[:padding]
+        return indices[self.rank :: self.num_replicas]
+
+    # Number of samples of an epoch for this replica
+    def num_samples(self):
+        return math.ceil(len(self.data_source) / self.num_replicas)
+
+    def __iter__(self):
+        return iter(self.indices()[self.start :])
+
+    def __len__(self):
+        return max(self.num_samples() - self.start, 0)
+
+    def state_dict(self):
+        return {'seed': self.seed, 'shuffle': self.shuffle}
+
+    def load_state_dict(self, state_dict):
+        self.seed = state_dict['seed']
+        self.shuffle = state_dict['shuffle']
@@ -0,0 +1,106 @@
+from collections.abc import Mapping
+import torch
+
+
+def batch_size(batch):
+    """Returns the size of the first dimension of the first tensor in batch.
+
+    Args:
+        batch: Tensor or (nested) list, tuple or mapping containing tensors.
+
+    Returns:
+        int or None: The batch size (None if batch does not contain tensors).
+    """
+    if isinstance(batch, torch.Tensor):
+        return batch.shape[0] if batch.dim() > 0 else None
+    if isinstance(batch, Mapping):
+        batch = list(batch.values())
+    if isinstance(batch, (list, tuple)):
+        for item in batch:
+            size = batch_size(item)
+            if size is not None:
+                return size
+    return None
+
+
+def _rebuild(item, values):
+    # Namedtuples take their fields as positional arguments
+    if isinstance(item, tuple) and hasattr(item, '_fields'):
+        return type(item)(*values)
+    return type(item)(values)
+
+
+def _split(item, num_chunks):
+    if isinstance(item, torch.Tensor) and (item.dim() > 0):
+        return list(torch.tensor_split(item, num_chunks))
+    elif isinstance(item, (list, tuple)):
+        parts = [_split(x, num_chunks) for x in item]
+        return [_rebuild(item, [p[i] for p in parts]) for i in range(num_chunks)]
+    elif isinstance(item, Mapping):
+        parts = {key: _split(val, num_chunks) for key, val in item.items()}
+        return [
+            type(item)({key: val[i] for key, val in parts.items()})
+            for i in range(num_chunks)
+        ]
+    else:
+        return [item] * num_chunks
+
+
+def split_micro_batches(batch, num_chunks):
+    """Splits the tensors of a batch along the first dimension into micro-batches.
+
+    Non tensor elements are shared by all micro-batches. If the batch is smaller
+    than num_chunks, it is split into batch_size(batch) micro-batches.
+
+    Args:
+        batch: Tensor or (nested) list, tuple or mapping containing tensors.
+        num_chunks (int): Number of micro-batches.
+
+    Returns:
+        list: The micro-batches (with the same structure as batch).
+
+    Example:
+        >>> x, y = torch.zeros(5, 3), torch.zeros(5)
+        >>> [c[0].shape[0] for c in split_micro_batches((x, y), 2)]
+        [3, 2]
+    """
+    if (not isinstance(num_chunks, int)) or num_chunks < 1:
+        raise ValueError(f'Expected a positive integer. Got: {num_chunks}')
+    size = batch_size(batch)
+    if size is not None:
+        num_chunks = max(min(num_chunks, size), 1)
+    return _split(batch, num_chunks)
+
+
+def _merge(items):
+    first = items[0]
+    if isinstance(first, torch.Tensor) and (first.dim() > 0):
+        return torch.cat(items)
+    elif isinstance(first, (list, tuple)):
+        return _rebuild(first, [_merge(list(p)) for p in zip(*items)])
+    elif isinstance(first, Mapping):
+        return type(first)({key: _merge([x[key] for x in items]) for key in first})
+    else:
+        return first
+
+
+def merge_micro_batches(chunks):
+    """Concatenates micro-batches (e.g. the outputs of split_micro_batches).
+
+    Inverse of split_micro_batches: tensors are concatenated along the first
+    dimension and non tensor elements are taken from the first micro-batch.
+
+    Args:
+        chunks (list): Micro-batches with the same structure.
+
+    Returns:
+        The merged batch (with the same structure as the micro-batches).
+
+    Example:
+        >>> x = torch.zeros(5, 3)
+        >>> merge_micro_batches(split_micro_batches(x, 2)).shape
+        torch.Size([5, 3])
+    """
+    if not chunks:
+        raise ValueError('Expected at least one micro-batch')
+    return _merge(list(chunks))
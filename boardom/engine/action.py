@@ -2,6 +2,7 @@ from functools import partial
 import inspect
 import boardom as bd
 from .event import _check_valid_eventname
+from .executor import get_executor
 
 
 # TODO:
@@ -17,6 +18,7 @@ class Action:
         'id',
         'bound_engine',
         'bound_self_name',
+        'executor',
     ]
 
     def __init__(self, event_name, function):
@@ -26,6 +28,9 @@ class Action:
         self.sig_params = inspect.signature(self.function).parameters
         self.argnames = list(self.sig_params)
         self.id = hash((event_name, function))
+        # Set with bd.on(..., executor=...). Takes precedence over the
+        # executor set for the event (Engine.set_executor)
+        self.executor = getattr(function, '_bd_executor', None)
         bound_engine = None
         bound_self_name = None
 
@@ -51,15 +56,55 @@ class Action:
         return f'Action(on={self.event_name}, func={self.function})'
 
     # TODO: Optimize
-    def __call__(self, calling_engine, event):
-        args = event.args
-        kwargs = event.kwargs
+    def __call__(self, calling_engine, event, executor=None):
+        return self.call(calling_engine, event.args, event.kwargs, executor)
+
+    # Binding happens in the calling thread; with an executor the (wrapped)
+    # function is submitted and a concurrent.futures.Future is returned
+    def call(self, calling_engine, args, kwargs, executor=None):
+        engine, func, final_kwargs = self.bind(calling_engine, args, kwargs)
+        call = self.wrap_middleware(engine, func)
+        executor = self.get_executor(executor)
+        if executor is None:
+            return call(**final_kwargs)
+        return executor.submit(call, **final_kwargs)
+
+    # Returns a callable that takes no arguments and behaves like calling the
+    # action without args or kwargs from calling_engine.
+    # Used by compiled dispatch plans (see dispatch.py)
+    def compile(self, calling_engine, executor=None):
+        engine, func, final_kwargs = self.bind(calling_engine, (), {})
+        call = self.wrap_middleware(engine, func)
+        if final_kwargs:
+            call = partial(call, **final_kwargs)
+        executor = self.get_executor(executor)
+        if executor is not None:
+            call = partial(executor.submit, call)
+        return call
+
+    def get_executor(self, event_executor=None):
+        if self.executor is not None:
+            return get_executor(self.executor)
+        return get_executor(event_executor)
+
+    @property
+    def middleware(self):
+        return getattr(self.function, '_bd_middleware', None)
+
+    def wrap_middleware(self, engine, func):
+        call = func
+        # Once engine resolution is done, apply middleware and function
+        for m in self.middleware or ():
+            # middleware are f(engine, callback, **kwargs)
+            # kwargs is a dict - not **kwargs
+            call = partial(m, engine=engine, callback=call)
+        return call
+
+    # Resolves the engine, the function to call and its kwargs
+    def bind(self, calling_engine, args, kwargs):
         argnames = self.argnames
         sig_params = self.sig_params
         have_bound_engine = self.bound_engine is not None
-        middleware = []
-        if hasattr(self.function, '_bd_middleware'):
-            middleware += self.function._bd_middleware
 
         engine = None
 
@@ -117,11 +162,4 @@ class Action:
         if args:
             raise RuntimeError('Provided extra args that could not be accounted for.')
 
-        call = func
-        # Once engine resolution is done, apply middleware and function
-        for m in middleware:
-            # middleware are f(engine, callback, **kwargs)
-            # kwargs is a dict - not **kwargs
-            call = partial(m, engine=engine, callback=call)
-
-        return call(**final_kwargs)
+        return engine, func, final_kwargs
@@ -1,24 +1,115 @@
+import weakref
+from collections import deque
 import boardom as bd
+from . import state as state_module
+from .state import KeyJournal
 
+# Paths of (nested) States in the state of an engine.
+# Stored per engine as an index {id(state): path} of all reachable States.
+# States can only become reachable when a State is stored in another State
+# (counted by state.state_links), so until then the index is complete and
+# finding a state (or that it is not in the engine, e.g. temporary States)
+# is O(depth). Paths are validated on use, as states may have been deleted.
+_STATE_PATHS = weakref.WeakKeyDictionary()
 
-def _recurse_get_keys(state):
-    ret = set()
-    for p, o in state.items():
-        if isinstance(o, bd.State):
-            ret |= set(f'{p}.{k}' for k in _recurse_get_keys(o))
-    return ret | set(state.keys())
 
+class _Paths:
+    __slots__ = ['paths', 'links']
 
+    def __init__(self):
+        self.paths = {}
+        self.links = None
+
+
+def _root_state(engine):
+    if isinstance(engine, bd.Engine):
+        return object.__getattribute__(engine, 'state')
+    return engine
+
+
+def _resolve(root, path):
+    state = root
+    for key in path:
+        if not isinstance(state, bd.State):
+            return None
+        state = dict.get(state, key, None)
+    return state
+
+
+def _find_path(root, target):
+    queue = deque([(root, ())])
+    seen = set()
+    while queue:
+        state, path = queue.popleft()
+        if state is target:
+            return path
+        seen.add(id(state))
+        for key, val in dict.items(state):
+            if isinstance(val, bd.State) and (id(val) not in seen):
+                queue.append((val, path + (key,)))
+    return None
+
+
+def _index_paths(root):
+    paths = {id(root): ()}
+    queue = deque([(root, ())])
+    while queue:
+        state, path = queue.popleft()
+        for key, val in dict.items(state):
+            if isinstance(val, bd.State) and (id(val) not in paths):
+                paths[id(val)] = path + (key,)
+                queue.append((val, path + (key,)))
+    return paths
+
+
+def _get_path(engine, root, state):
+    if not isinstance(engine, bd.Engine):
+        return _find_path(root, state)
+    if state is root:
+        return ()
+    cache = _STATE_PATHS.get(engine, None)
+    if cache is None:
+        cache = _STATE_PATHS[engine] = _Paths()
+    path = cache.paths.get(id(state), None)
+    if (path is not None) and (_resolve(root, path) is state):
+        return path
+    if cache.links == state_module.state_links:
+        # The index is complete, so the state is not in the engine
+        return None
+    cache.links = state_module.state_links
+    cache.paths = _index_paths(root)
+    path = cache.paths.get(id(state), None)
+    if (path is not None) and (_resolve(root, path) is state):
+        return path
+    return None
+
+
+# Deletes the keys of the engine state that were created inside the context
+# (keys that existed on __enter__ are kept, even if deleted and reassigned)
 class CleanupState:
     def __init__(self, engine):
         self.engine = engine
 
     def __enter__(self):
-        self.start_keys = _recurse_get_keys(self.engine)
+        self.journal = KeyJournal().start()
 
     def __exit__(self, exc_type, exc_value, traceback):
-        end_keys = _recurse_get_keys(self.engine)
-        new_keys = end_keys - self.start_keys
-        for new_key in new_keys:
-            if new_key in self.engine:
-                del self.engine[new_key]
+        self.journal.stop()
+        engine = self.engine
+        root = _root_state(engine)
+        entries = [
+            (state, key)
+            for state, key in self.journal.entries
+            if dict.__contains__(state, key)
+        ]
+        # States assigned to new keys are deleted with their parents
+        created = set(
+            id(dict.__getitem__(state, key))
+            for state, key in entries
+            if isinstance(dict.__getitem__(state, key), bd.State)
+        )
+        for state, key in entries:
+            if (id(state) in created) or (_get_path(engine, root, state) is None):
+                continue
+            if dict.__contains__(state, key):
+                dict.__delitem__(state, key)
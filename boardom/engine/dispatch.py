@@ -0,0 +1,76 @@
+from .event import EventReturnValue
+from .action import Action
+
+
+# Compiled dispatch plans
+# Built once per event name (per engine) and reused until Engine.register()
+# changes the registered actions.
+# Calls without arguments (the common case, e.g. "training_iteration_start")
+# use pre-bound callables with the middleware chain already composed.
+# Calls with arguments go through the regular Action binding (without
+# creating an Event on each call).
+
+# Incremented by bd.middleware() since middleware can be added to functions
+# after they are registered (and plans compiled)
+_middleware_generation = 0
+
+
+def middleware_changed():
+    global _middleware_generation
+    _middleware_generation += 1
+
+
+def ordered_actions(name, action_dict, orig_func=None):
+    actions = list(action_dict[name].values())
+    if orig_func is None:
+        return actions
+    # See bind_func_and_event_of_same_name (engine.py)
+    orig_fn_action = Action(name, orig_func)
+    if orig_fn_action in actions:
+        actions.remove(orig_fn_action)
+    return [orig_fn_action] + actions
+
+
+class DispatchPlan:
+    __slots__ = [
+        'name',
+        'engine',
+        'actions',
+        'executor',
+        'pending',
+        'generation',
+        'calls',
+    ]
+
+    def __init__(self, engine, name, actions, executor=None, pending=None):
+        self.name = name
+        self.engine = engine
+        self.actions = tuple(actions)
+        self.executor = executor
+        # Only set if any of the actions returns futures (see executor.py)
+        self.pending = None
+        if any(x.get_executor(executor) is not None for x in self.actions):
+            self.pending = pending
+        self.generation = None
+        self.calls = None
+
+    def compile(self):
+        generation = _middleware_generation
+        self.calls = tuple(
+            action.compile(self.engine, self.executor) for action in self.actions
+        )
+        self.generation = generation
+
+    def __call__(self, args, kwargs):
+        if args or kwargs:
+            engine, executor = self.engine, self.executor
+            ret = EventReturnValue(
+                action.call(engine, args, kwargs, executor) for action in self.actions
+            )
+        else:
+            if self.generation != _middleware_generation:
+                self.compile()
+            ret = EventReturnValue([call() for call in self.calls])
+        if self.pending is not None:
+            self.pending.track(self.name, ret)
+        return ret
@@ -1,19 +1,34 @@
 import inspect
-from collections.abc import Mapping
+from collections.abc import Mapping, Sequence
+from concurrent.futures import wait
 from functools import partial
 import boardom as bd
 from .event import Event, _check_valid_eventname, EventReturnValue
 from .state import State
 from .action import Action
+from .dispatch import DispatchPlan, ordered_actions
+from .executor import PendingFutures, check_valid_executor
 
 # TODO: __hasattr__
 # TODO: __repr__
 # TODO: saving and loading state
-# TODO: Implement async / multithreading / multiprocessing executors
+# TODO: Implement multiprocessing executors
 # TODO: Maybe make events be UPPERCASE only?
 
-_OWN = ['state', '_actions', '_prior', 'get_no_event']
-_API = ['register', 'event'] + [x for x in dir({}) if not x.startswith('_')]
+_OWN = [
+    'state',
+    '_actions',
+    '_prior',
+    'get_no_event',
+    '_compile_events',
+    '_dispatch_plans',
+    '_name_cache',
+    '_executors',
+    '_pending_futures',
+]
+_API = ['register', 'event', 'compile_events', 'set_executor', 'wait_for_events'] + [
+    x for x in dir({}) if not x.startswith('_')
+]
 _ALL = _OWN + _API
 
 
@@ -23,6 +38,12 @@ class _NonExisting(metaclass=bd.Singleton):
 
 NonExisting = _NonExisting()
 
+# Kinds of names stored in Engine._name_cache
+_STATE_KEY = 0
+_OWN_ATTRIBUTE = 1
+_EVENT = 2
+_EVENT_AND_METHOD = 3
+
 
 def _makeboundprop(obj, old_prop):
     def fget(self):
@@ -61,6 +82,14 @@ def _makeboundprop(obj, old_prop):
 
 
 def bind_func_and_event_of_same_name(orig_func, event_fn, name, action_dict, engine):
+    if object.__getattribute__(engine, '_compile_events'):
+
+        def ret_fn(*args, **kwargs):
+            return _get_dispatch_plan(engine, name, orig_func)(args, kwargs)
+
+        ret_fn._bound_func_with_event = orig_func
+        return ret_fn
+
     def ret_fn(*args, **kwargs):
         orig_fn_action = Action(name, orig_func)
         action_list = list(action_dict[name].values())
@@ -68,13 +97,37 @@ def bind_func_and_event_of_same_name(orig_func, event_fn, name, action_dict, eng
             action_list.remove(orig_fn_action)
         action_list = [orig_fn_action] + action_list
         event = Event(name, args, kwargs)
-        return EventReturnValue(action(engine, event) for action in action_list)
+        executor = object.__getattribute__(engine, '_executors').get(name, None)
+        ret = EventReturnValue(
+            action(engine, event, executor) for action in action_list
+        )
+        object.__getattribute__(engine, '_pending_futures').track(name, ret)
+        return ret
 
     ret_fn._bound_func_with_event = orig_func
 
     return ret_fn
 
 
+# Plans for methods with the same name as an event are stored under (name, method)
+def _get_dispatch_plan(engine, name, orig_func=None):
+    plans = object.__getattribute__(engine, '_dispatch_plans')
+    key = name if orig_func is None else (name, orig_func)
+    plan = plans.get(key, None)
+    if plan is None:
+        action_dict = object.__getattribute__(engine, '_actions')
+        _check_valid_eventname(name)
+        plan = DispatchPlan(
+            engine,
+            name,
+            ordered_actions(name, action_dict, orig_func),
+            executor=object.__getattribute__(engine, '_executors').get(name, None),
+            pending=object.__getattribute__(engine, '_pending_futures'),
+        )
+        plans[key] = plan
+    return plan
+
+
 def _delegated_dict_api(self, method):
     def func(*args, **kwargs):
         return getattr(self.state, method)(*args, **kwargs)
@@ -82,9 +135,67 @@ def _delegated_dict_api(self, method):
     return func
 
 
+def _resolve_name(self, key):
+    raised = False
+    try:
+        default = object.__getattribute__(self, key)
+    except AttributeError as final_exc:
+        raised = final_exc
+
+    name_cache = object.__getattribute__(self, '_name_cache')
+    try:
+        # Delegate attribute logic to __getitem__
+        action_dict = object.__getattribute__(self, '_actions')
+        if key in action_dict:
+            ret = partial(object.__getattribute__(self, 'event'), key)
+            if not raised:
+                if not callable(default):
+                    raise AttributeError(
+                        'Attribute key is not a function and the name is also used as an event.'
+                    )
+                name_cache[key] = _EVENT_AND_METHOD
+                return bind_func_and_event_of_same_name(
+                    default, ret, key, action_dict, self
+                )
+            name_cache[key] = _EVENT
+            return ret
+
+        else:
+            ret = object.__getattribute__(self, 'state')[key]
+            # Dotted keys (e.g. getattr(engine, 'a.b')) are not cached
+            if '.' not in key:
+                name_cache[key] = _STATE_KEY
+            return ret
+    except KeyError:
+        pass
+    if key in object.__getattribute__(self, '_prior'):
+        # key was defined in class or instance and moved to state but then it was deleted
+        raise AttributeError(f'{key} is not accessible.')
+    if raised:
+        raise AttributeError(str(raised))
+    name_cache[key] = _OWN_ATTRIBUTE
+    return default
+
+
+def _uncache_name(self, key):
+    if (not isinstance(key, str)) and isinstance(key, Sequence) and key:
+        key = key[0]
+    if isinstance(key, str):
+        key = key.split('.', 1)[0]
+        object.__getattribute__(self, '_name_cache').pop(key, None)
+
+
 class Engine:
+    # If True, events are dispatched using compiled plans (see dispatch.py).
+    # Can be set for subclasses with: class Foo(bd.Engine, compile_events=True)
+    _compile_events = False
+
     def __init__(self, *components):
+        self._name_cache = {}
         self._actions = {}
+        self._dispatch_plans = {}
+        self._executors = {}
+        self._pending_futures = PendingFutures()
         self._prior = []
         self.state = State()
         # Iterate over members and add things to state if needed
@@ -170,6 +281,8 @@ class Engine:
             already_exists = action.id in action_dict
             action_dict[action.id] = action
             self._actions[event] = action_dict
+            self._dispatch_plans.clear()
+            self._name_cache.clear()
             if already_exists:
                 bd.warn(f'Compoenent {component} already defined for event {event}.')
             #  else:
@@ -180,49 +293,80 @@ class Engine:
         action_dict = object.__getattribute__(self, '_actions')
         if name not in action_dict:
             return
+        if object.__getattribute__(self, '_compile_events'):
+            return _get_dispatch_plan(self, name)(args, kwargs)
         event = Event(name, args, kwargs)
         actions = action_dict[name].values()
-        return EventReturnValue(action(self, event) for action in actions)
+        executor = self._executors.get(name, None)
+        ret = EventReturnValue(action(self, event, executor) for action in actions)
+        self._pending_futures.track(name, ret)
+        return ret
 
     def __call__(self, name, *args, **kwargs):
         return self.event(name, *args, **kwargs)
 
+    def compile_events(self, enabled=True):
+        self._compile_events = enabled
+        self._dispatch_plans.clear()
+        return self
+
+    # Sets the executor used for the actions of an event.
+    # executor: 'sync' (or None), 'thread', 'async' or a concurrent.futures.Executor
+    # Actions that specify an executor with bd.on(..., executor=...) keep theirs.
+    def set_executor(self, name, executor):
+        _check_valid_eventname(name)
+        check_valid_executor(executor)
+        if executor in [None, 'sync']:
+            self._executors.pop(name, None)
+        else:
+            self._executors[name] = executor
+        self._dispatch_plans.clear()
+        return self
+
+    # Barrier for actions run by executors.
+    # Waits for the futures returned by the given events (all if none are given)
+    # and returns their results in submission order.
+    # Raises the first exception raised by an action
+    # (or TimeoutError if the futures are not done after timeout seconds).
+    def wait_for_events(self, *names, timeout=None):
+        futures = self._pending_futures.pop(names)
+        wait(futures, timeout=timeout)
+        return [f.result(timeout=0) for f in futures]
+
     def get_no_event(self, key):
         return object.__getattribute__(self, key)
 
-    # Needs optimizing maybe
+    # Names are classified on first access and stored in self._name_cache
+    # so that repeated accesses skip the full resolution (_resolve_name).
+    # Cached entries are checked against the state (which takes precedence),
+    # so only changes of events and own attributes need to invalidate the cache.
     def __getattribute__(self, key):
-        raised = False
-        try:
-            default = object.__getattribute__(self, key)
-        except AttributeError as final_exc:
-            raised = final_exc
-
-        try:
-            # Delegate attribute logic to __getitem__
-            action_dict = object.__getattribute__(self, '_actions')
-            if key in action_dict:
-                ret = partial(object.__getattribute__(self, 'event'), key)
-                if not raised:
-                    if not callable(default):
-                        raise AttributeError(
-                            'Attribute key is not a function and the name is also used as an event.'
-                        )
-                    return bind_func_and_event_of_same_name(
-                        default, ret, key, action_dict, self
-                    )
-                return ret
-
-            else:
-                return object.__getattribute__(self, 'state')[key]
-        except KeyError:
+        kind = object.__getattribute__(self, '_name_cache').get(key, None)
+        if kind is None:
             pass
-        if key in object.__getattribute__(self, '_prior'):
-            # key was defined in class or instance and moved to state but then it was deleted
-            raise AttributeError(f'{key} is not accessible.')
-        if raised:
-            raise AttributeError(str(raised))
-        return default
+        elif kind == _STATE_KEY:
+            state = object.__getattribute__(self, 'state')
+            ret = dict.get(state, key, NonExisting)
+            if not isinstance(ret, property):
+                if ret is not NonExisting:
+                    return ret
+            elif ret.fget is not None:
+                return ret.fget(None)  # self already bound with closure
+        elif kind == _OWN_ATTRIBUTE:
+            state = object.__getattribute__(self, 'state')
+            if not dict.__contains__(state, key):
+                return object.__getattribute__(self, key)
+        elif kind == _EVENT:
+            return partial(object.__getattribute__(self, 'event'), key)
+        elif kind == _EVENT_AND_METHOD:
+            return bind_func_and_event_of_same_name(
+                object.__getattribute__(self, key),
+                partial(object.__getattribute__(self, 'event'), key),
+                key,
+                object.__getattribute__(self, '_actions'),
+                self,
+            )
+        return _resolve_name(self, key)
 
     def __getitem__(self, key):
         try:
@@ -233,6 +377,8 @@ class Engine:
     def __setattr__(self, key, value):
         if key in _API:
             raise AttributeError(f'Can not set {key} of Engine.')
+        if key not in _OWN:
+            _uncache_name(self, key)
         if key == 'state':
             if not isinstance(value, Mapping):
                 raise TypeError(
@@ -249,6 +395,8 @@ class Engine:
     def __setitem__(self, key, value):
         if key in _API:
             raise KeyError(f'Can not set {key} of Engine')
+        if key not in _OWN:
+            _uncache_name(self, key)
         if key == 'state':
             if not isinstance(value, Mapping):
                 raise TypeError(
@@ -271,6 +419,7 @@ class Engine:
             self.state.__setitem__(key, value)
 
     def __delattr__(self, key):
+        _uncache_name(self, key)
         try:
             super().__delattr__(key)
             return
@@ -282,14 +431,17 @@ class Engine:
             raise AttributeError(str(e)) from e
 
     def __delitem__(self, key):
+        _uncache_name(self, key)
         del self.state[key]
 
     def __contains__(self, key):
         return key in self.state
 
     # This is to inherit @on assignments
-    def __init_subclass__(cls, **kwargs):
+    def __init_subclass__(cls, compile_events=None, **kwargs):
         super().__init_subclass__(**kwargs)
+        if compile_events is not None:
+            cls._compile_events = compile_events
         own_members = {key: val for key, val in inspect.getmembers(cls)}
         for base in cls.__bases__:
             for key, base_method in inspect.getmembers(base):
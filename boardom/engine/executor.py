@@ -0,0 +1,103 @@
+import asyncio
+import inspect
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+
+# Executors run actions and return concurrent.futures.Future objects.
+# They are selected with strings ('sync', 'thread', 'async') or by passing
+# a concurrent.futures.Executor directly. 'sync' (or None) runs actions
+# in the calling thread and returns their values as usual.
+EXECUTORS = ['sync', 'thread', 'async']
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+class AsyncLoopExecutor(Executor):
+    """Runs callables (and awaits their results if needed) in an asyncio loop.
+
+    The loop runs in a daemon thread. Coroutine functions registered as actions
+    can be used with this executor.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, /, *args, **kwargs):
+        async def run():
+            ret = fn(*args, **kwargs)
+            if inspect.isawaitable(ret):
+                ret = await ret
+            return ret
+
+        return asyncio.run_coroutine_threadsafe(run(), self._loop)
+
+    def shutdown(self, wait=True, **kwargs):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        if wait:
+            self._thread.join()
+
+
+def check_valid_executor(executor):
+    if (executor is None) or isinstance(executor, Executor):
+        return
+    if executor not in EXECUTORS:
+        valid = ', '.join(f'"{x}"' for x in EXECUTORS)
+        raise ValueError(
+            f'Invalid executor: {executor}. '
+            f'Expected one of {valid} or a concurrent.futures.Executor.'
+        )
+
+
+# Thread and async executors are created once and shared between engines
+def get_executor(executor):
+    if isinstance(executor, Executor):
+        return executor
+    if (executor is None) or (executor == 'sync'):
+        return None
+    check_valid_executor(executor)
+    with _shared_lock:
+        if executor not in _shared:
+            if executor == 'thread':
+                _shared[executor] = ThreadPoolExecutor(
+                    thread_name_prefix='bd_event_executor'
+                )
+            else:
+                _shared[executor] = AsyncLoopExecutor()
+        return _shared[executor]
+
+
+class PendingFutures:
+    """Futures returned by events, kept until they are waited for.
+
+    If more than max_pending futures of an event are not waited for, the
+    successfully completed ones are dropped (failed ones are kept so that
+    their exceptions are raised when waiting).
+    """
+
+    __slots__ = ['futures', 'lock', 'max_pending']
+
+    def __init__(self, max_pending=1024):
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.max_pending = max_pending
+
+    def track(self, name, values):
+        new = [x for x in values if isinstance(x, Future)]
+        if not new:
+            return
+        with self.lock:
+            pending = self.futures.setdefault(name, [])
+            pending += new
+            if len(pending) > self.max_pending:
+                pending[:] = [
+                    f for f in pending if not (f.done() and (f.exception() is None))
+                ]
+
+    def pop(self, names):
+        with self.lock:
+            if not names:
+                names = list(self.futures)
+            return [f for name in names for f in self.futures.pop(name, [])]
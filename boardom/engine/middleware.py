@@ -2,6 +2,7 @@ import time
 import boardom as bd
 import inspect
 from functools import partial
+from .dispatch import middleware_changed
 
 
 def _every_second(num_seconds):
@@ -85,6 +86,7 @@ def middleware(mw):
             # Add to start for correct ordering
             middleware = middleware + obj._bd_middleware
         obj._bd_middleware = middleware
+        middleware_changed()
         return wrapped
 
     return wrapper
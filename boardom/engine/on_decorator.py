@@ -1,12 +1,16 @@
 import boardom as bd
 from functools import partial
 import inspect
+from .executor import check_valid_executor
 
 
 # TODO: Every is for the frequency
-def on(*event_name, every=None):
+# executor: 'sync' (default), 'thread', 'async' or a concurrent.futures.Executor.
+#           Actions with an executor other than 'sync' return futures.
+def on(*event_name, every=None, executor=None):
     if len(event_name) < 1:
         raise ValueError('bd.on expected an event name')
+    check_valid_executor(executor)
     if not all(isinstance(x, str) for x in event_name):
         raise RuntimeError('Attempted to register invalid (non-string type) event.')
     event_name = list(event_name)
@@ -41,6 +45,8 @@ def on(*event_name, every=None):
             events += obj._bd_engine_events
         events = list(set(events + event_name))
         obj._bd_engine_events = events
+        if executor is not None:
+            obj._bd_executor = executor
         if should_register:
             wrapped.__self__.register(wrapped)
         return wrapped
@@ -1,4 +1,6 @@
+import threading
 from collections.abc import Mapping, Sequence
+from functools import lru_cache
 
 # TODO:
 # > object.__contains__(self, item)
@@ -10,7 +12,99 @@ class KeepDict(dict):
     pass
 
 
+# Dotted keys (e.g. 'training.global_step') are used repeatedly,
+# so parsing them is cached
+@lru_cache(maxsize=4096)
+def _split_key(key):
+    return tuple(key.split('.'))
+
+
+def _resolve_property(value, key):
+    if isinstance(value, property):
+        fget = value.fget
+        if fget is None:
+            raise KeyError(f'Can not read {key} attribute. fget not provided')
+        return fget(None)  # self already bound with closure
+    return value
+
+
+# Journals currently recording key creations in this thread (see KeyJournal)
+class _Journals(threading.local):
+    def __init__(self):
+        self.active = []
+
+
+_journals = _Journals()
+_MISSING = object()
+
+# Number of times a State was stored in a State. States can only become
+# reachable from other States then (used to validate cached lookups).
+state_links = 0
+
+
+class KeyJournal:
+    """Records the keys created in any State (by the same thread) while active.
+
+    Entries are (state, key) pairs (in order of creation) of the keys that did
+    not exist when the journal was started. Used by CleanupState to find new
+    keys without walking the whole state.
+    """
+
+    __slots__ = ['entries', '_seen']
+
+    def __init__(self):
+        self.entries = []
+        # {(id(state), key): state} of the keys created or deleted so far
+        # (the states are kept so that their ids are not reused)
+        self._seen = {}
+
+    def start(self):
+        _journals.active.append(self)
+        return self
+
+    def stop(self):
+        # Journals are not necessarily stopped in order (e.g. in generators)
+        active = _journals.active
+        for i, journal in enumerate(active):
+            if journal is self:
+                del active[i]
+                break
+
+    # Keys are only created if missing and can only go missing if deleted,
+    # so the first creation or deletion tells if a key existed at start
+    def record(self, state, key, existed):
+        seen_key = (id(state), key)
+        if seen_key not in self._seen:
+            self._seen[seen_key] = state
+            if not existed:
+                self.entries.append((state, key))
+
+
+def _record_deletion(state, key):
+    for journal in _journals.active:
+        journal.record(state, key, True)
+
+
+# Properties are detected by type (no exceptions are raised for other values)
+def _set_single(state, key, value):
+    curr_val = dict.get(state, key, _MISSING)
+    if curr_val is _MISSING:
+        for journal in _journals.active:
+            journal.record(state, key, False)
+    elif isinstance(curr_val, property) and (curr_val.fset is not None):
+        curr_val.fset(None, value)  # self already bound with closure
+        return
+    if isinstance(value, Mapping) and not isinstance(value, KeepDict):
+        if not isinstance(value, State):
+            value = State(value)
+        global state_links
+        state_links += 1
+    dict.__setitem__(state, key, value)
+
+
 class State(dict):
+    __slots__ = ()
+
     def __init__(self, data_dict=None):
         if data_dict is None:
             data_dict = {}
@@ -31,80 +125,62 @@ class State(dict):
 
     def __setattr__(self, key, value):
         try:
-            self.__setitem__(key, value)
+            self[key] = value
         except KeyError as e:
             raise AttributeError(str(e)) from e
 
     def __setitem__(self, key, value):
-        # Accommodate properties
-        try:
-            try:
-                splitkey = key.split('.')
-            except AttributeError:
-                splitkey = key
-
-            curr_val, rest = super().__getitem__(splitkey[0]), splitkey[1:]
-            if rest:
-                if isinstance(curr_val, State):
-                    curr_val = curr_val[rest]
-                else:
-                    raise KeyError(
-                        'Non state items can not be directly accessed with recursive indices.'
-                    )
-            curr_val.fset(None, value)  # self already bound with closure
-            return
-        except AttributeError:
-            pass
-        except TypeError:
-            pass
-        except KeyError as e:
-            if '@property' in str(e):
-                raise
-
-        if isinstance(value, Mapping) and not isinstance(value, (State, KeepDict)):
-            value = State(value)
-        if (not isinstance(key, str)) and isinstance(key, Sequence):
+        if isinstance(key, str):
+            # Fast path for single segment keys
+            if key.isidentifier():
+                _set_single(self, key, value)
+                return
+            path = _split_key(key.strip('. '))
+            if len(path) == 1:
+                if path[0].isidentifier():
+                    _set_single(self, path[0], value)
+                    return
+                raise KeyError(
+                    'bd.State only supports keys that can be valid Python identifiers. '
+                    f'Got: "{path[0]}"'
+                )
+        elif isinstance(key, Sequence):
             if len(key) == 0:
                 raise KeyError('Key Sequence is empty.')
-            elif len(key) == 1:
-                self[key[0]] = value
-            else:
-                self[key[0]][key[1:]] = value
-        elif not isinstance(key, str):
+            path = key
+            if len(path) == 1:
+                self[path[0]] = value
+                return
+        else:
             raise KeyError(
                 'Keys can only be strings or sequences of strings. '
                 f'Got {type(key)} for key {key}.'
             )
-        else:
-            key = key.strip('. ').split('.')
-            if len(key) == 1:
-                key = key[0]
-                if not key.isidentifier():
-                    raise KeyError(
-                        'bd.State only supports keys that can be valid Python identifiers. '
-                        f'Got: "{key}"'
-                    )
-                super().__setitem__(key, value)
-            else:
-                self[key] = value
+        substate = self[path[0]]
+        if not isinstance(substate, State):
+            raise KeyError(
+                'Non state items can not be directly accessed with recursive indices.'
+            )
+        substate[path[1:]] = value
 
     def __repr__(self):
         return f'State({super().__repr__()})'
 
     def __getattr__(self, key):
         try:
-            return self.__getitem__(key)
+            return self[key]
         except KeyError as e:
             # This is so that hasattr works on State
             raise AttributeError(str(e)) from e
 
     def __getitem__(self, key):
-        try:
-            key = key.split('.')
-        except AttributeError:
-            pass
+        if isinstance(key, str):
+            # Fast path for single segment keys
+            if '.' not in key:
+                return _resolve_property(dict.__getitem__(self, key), key)
+            key = _split_key(key)
 
-        ret, rest = super().__getitem__(key[0]), key[1:]
+        ret, rest = dict.__getitem__(self, key[0]), key[1:]
         if rest:
             if isinstance(ret, State):
                 ret = ret[rest]
@@ -112,12 +188,7 @@ class State(dict):
                 raise KeyError(
                     'Non state items can not be directly accessed with recursive indices.'
                 )
-        if isinstance(ret, property):
-            fget = ret.fget
-            if fget is None:
-                raise KeyError(f'Can not read {key} attribute. fget not provided')
-            ret = fget(None)  # self already bound with closure
-        return ret
+        return _resolve_property(ret, key)
 
     def __call__(self, *args, **kwargs):
         raise RuntimeError('Could not find registered event.')
@@ -127,17 +198,17 @@ class State(dict):
             super().__delitem__(key)
         except KeyError as e:
             raise AttributeError(str(e)) from e
+        _record_deletion(self, key)
 
     def __delitem__(self, key):
-        try:
-            key = key.split('.')
-        except AttributeError:
-            pass
+        if isinstance(key, str):
+            key = _split_key(key)
         if len(key) > 1:
             substate, rest = super().__getitem__(key[0]), key[1:]
             del substate[rest]
         else:
             super().__delitem__(key[0])
+            _record_deletion(self, key[0])
 
     def get(self, key, default=None):
         if key in self:
@@ -145,6 +216,11 @@ class State(dict):
         else:
             return default
 
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
     def update(self, other):
         for k, val in other.items():
             if isinstance(val, Mapping):
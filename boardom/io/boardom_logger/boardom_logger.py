@@ -1,10 +1,13 @@
+import os
+import math
 import atexit
 import time
 import zmq
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition, current_thread
 from multiprocessing import Process, Value
 from .subprocess import _LoggerSubprocess
 from .serialization import MsgpackContext
+from .coalescing import XYBatcher, QUEUE_POLICIES
 from ...multiprocessing import _PROCESS_ID
 import boardom as bd
 
@@ -32,7 +35,7 @@ class _PrivateAPIMixin:
     # This should only be called after bd.cfg.setup()
     def _send_cfg_full(self):
         bd.log('Sending config store.')
-        self.to_child.send_msgpack(
+        self._send(
             {'type': 'ENGINE_CFG_FULL', 'payload': bd.cfg._get_data_dict()}
         )
 
@@ -40,11 +43,11 @@ class _PrivateAPIMixin:
     def _start_lmdb(self):
         bd.log('Starting LMDB.')
         payload = {'session_path': bd.cfg.session_path}
-        self.to_child.send_msgpack({'type': 'START_LMDB', 'payload': payload})
+        self._send({'type': 'START_LMDB', 'payload': payload})
 
     # This is used by Config.set
     def _update_cfg_value(self, arg_name, group, value):
-        self.to_child.send_msgpack(
+        self._send(
             {
                 'type': 'SET_CFG_VALUE',
                 'payload': {'arg_name': arg_name, 'value': value, 'group': group},
@@ -54,30 +57,43 @@ class _PrivateAPIMixin:
 
 # This is user facing API
 class _APIMixin:
+    # Points are coalesced per series and sent to the subprocess in batches
+    # (PLOT_XY_SCATTER_BATCH), at most every coalesce_interval seconds
     def plot_xy(self, x, y, name):
-        # This is further processed by subprocess
-        self.to_child.send_msgpack(
-            {
-                'type': 'PLOT_XY_SCATTER',
-                'payload': {
-                    'x': x,
-                    'y': y,
-                    'name': name,
-                    'time': int(time.time() * 1000),
-                },
-            }
-        )
+        if not self._started:
+            raise RuntimeError(_NOT_STARTED_MESSAGE)
+        if self._xy_batcher.add(x, y, name, int(time.time() * 1000)):
+            # The watcher thread flushes the batch if no more points arrive
+            self._wake_watcher()
+        if self._xy_batcher.due():
+            self.flush()
+
+    # Sends the points that were not sent yet
+    def flush(self):
+        task = self._xy_batcher.pop()
+        if task is not None:
+            self._send(task)
+
+    @property
+    def coalescing_stats(self):
+        return {
+            'points': self._xy_batcher.num_points,
+            'batches': self._xy_batcher.num_batches,
+        }
 
 
 def _shutdown():
     BoardomLogger()._exit()
 
 
+_NOT_STARTED_MESSAGE = (
+    'Must call bd.boardom_logger.start() before using the Boardom Logger.'
+)
+
+
 class _NullChild:
     def __getattr__(self, *args, **kwargs):
-        raise RuntimeError(
-            'Must call bd.boardom_logger.start() before using the Boardom Logger.'
-        )
+        raise RuntimeError(_NOT_STARTED_MESSAGE)
 
 
 class BoardomLogger(
@@ -87,8 +103,24 @@ class BoardomLogger(
 
     def __init__(self):
         self.to_child = _NullChild()
+        self._send_lock = Lock()
+        self._xy_batcher = XYBatcher()
+
+    # The child watcher thread also sends (coalesced points)
+    def _send(self, task):
+        with self._send_lock:
+            self.to_child.send_msgpack(task)
 
-    def start(self):
+    # coalesce_interval: Seconds between batches of plot_xy points.
+    # queue_limit, queue_policy: Bound and policy of the queue of data for
+    #     the board in the subprocess (see coalescing.py).
+    def start(self, coalesce_interval=0.05, queue_limit=10000, queue_policy='merge'):
+        if queue_policy not in QUEUE_POLICIES:
+            raise ValueError(
+                f'Invalid queue policy: {queue_policy}'
+                f'\nValid policies: {", ".join(QUEUE_POLICIES)}'
+            )
+        self._xy_batcher.interval = coalesce_interval
         if not BoardomLogger._started:
             BoardomLogger._started = True
             self._started = True
@@ -115,6 +147,7 @@ class BoardomLogger(
                     2,
                     _PROCESS_ID,
                 ),
+                kwargs=dict(queue_limit=queue_limit, queue_policy=queue_policy),
             )
             # TODO: MAKE THESE STATEMENTS WITHSTAND KEYBOARDINTERRUPTS
             # and SIGINT
@@ -125,11 +158,7 @@ class BoardomLogger(
             while (self.child_port.value == 0) and self.process.is_alive():
                 time.sleep(0.005)
             self.from_child.connect(f'tcp://127.0.0.1:{self.child_port.value}')
-            self._task_lock = Lock()
-            self._queued_tasks = []
-            self._child_watcher_sleep_time = 0.01
-            thr = Thread(target=self._watch_child, daemon=True)
-            thr.start()
+            self._start_child_watcher()
             if bd.cfg._prv['done_setup']:
                 self._send_cfg_full()
                 self._start_lmdb()
@@ -157,54 +186,148 @@ class BoardomLogger(
             print('Boardom connected, unblocking...')
 
     def _exit(self):
-        self.to_child.send_msgpack({'type': 'EXIT'})
+        self.flush()
+        self._send({'type': 'EXIT'})
         while (self.exited.value == 0) and self.process.is_alive():
             time.sleep(0.01)
+        self._stop_child_watcher()
 
-    def _check_and_do_task(self, task, do_passive, do_synced):
-        if (task['meta'].get('passive', False) and do_passive) or (
-            task['meta'].get('needs_sync', False) and do_synced
-        ):
+    # The watcher thread blocks on the socket from the child and on a wakeup
+    # pipe (see _wake_watcher), so it does not use any CPU while idle.
+    def _start_child_watcher(self):
+        self._task_lock = Lock()
+        self._queued_tasks = []
+        # Requests to receive the available messages (see _receive_available)
+        self._receive_cond = Condition()
+        self._receive_requests = 0
+        self._received_requests = 0
+        self._watcher_done = False
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._watcher = Thread(target=self._watch_child, daemon=True)
+        self._watcher.start()
+
+    def _stop_child_watcher(self, timeout=1.0):
+        self._watcher_done = True
+        self._wake_watcher()
+        self._watcher.join(timeout)
+        if not self._watcher.is_alive():
+            wake_r, wake_w = self._wake_r, self._wake_w
+            self._wake_r = self._wake_w = None
+            os.close(wake_r)
+            os.close(wake_w)
+
+    # Wakes the watcher (on shutdown, or to schedule a flush of plot_xy points)
+    def _wake_watcher(self):
+        wake_w = getattr(self, '_wake_w', None)
+        if wake_w is not None:
             try:
-                handler = getattr(self, f'_handle_{task["type"].lower()}')
-            except AttributeError:
-                handler = self._handle_default
-            handler(task)
-            return True
-        else:
-            return False
+                os.write(wake_w, b'\0')
+            except OSError:  # Pipe is full, so the watcher will wake anyway
+                pass
 
-    def _do_tasks(self, do_passive, do_synced):
-        # First try and do earlier tasks
-        self._task_lock.acquire()
-        should_release = True
-        self._queued_tasks = [
-            x
-            for x in self._queued_tasks
-            if not self._check_and_do_task(x, do_passive, do_synced)
-        ]
+    def _drain_wakeups(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except OSError:
+            pass
 
+    @staticmethod
+    def _should_do_task(task, do_passive, do_synced):
+        return (task['meta'].get('passive', False) and do_passive) or (
+            task['meta'].get('needs_sync', False) and do_synced
+        )
+
+    def _do_task(self, task):
+        try:
+            handler = getattr(self, f'_handle_{task["type"].lower()}')
+        except AttributeError:
+            handler = self._handle_default
+        handler(task)
+
+    # Only the watcher thread receives from the child
+    def _receive_tasks(self):
+        tasks = []
         while True:
             try:
-                task = self.from_child.recv_msgpack(zmq.NOBLOCK)
-            except zmq.ZMQError:
-                self._task_lock.release()
-                should_release = False
+                tasks.append(self.from_child.recv_msgpack(zmq.NOBLOCK))
+            except zmq.Again:
                 break
-            else:
-                handled = self._check_and_do_task(task, do_passive, do_synced)
-                if not handled:
-                    self._queued_tasks.insert(task, 0)
-        if should_release:
-            self._task_lock.release()
+        with self._task_lock:
+            self._queued_tasks.extend(tasks)
+
+    # The lock is only held while taking tasks out of the queue, so handlers
+    # run (and may call synchronize) without blocking the watcher.
+    def _do_tasks(self, do_passive, do_synced):
+        todo, queued = [], []
+        with self._task_lock:
+            for task in self._queued_tasks:
+                if self._should_do_task(task, do_passive, do_synced):
+                    todo.append(task)
+                else:
+                    queued.append(task)
+            self._queued_tasks = queued
+        for task in todo:
+            self._do_task(task)
+
+    # Receives the messages that the child sent before the call (and that
+    # reached the socket), through the watcher thread
+    def _receive_available(self):
+        watcher = self._watcher
+        if (current_thread() is watcher) or not watcher.is_alive():
+            self._receive_tasks()
+            return
+        with self._receive_cond:
+            self._receive_requests += 1
+            request = self._receive_requests
+            self._wake_watcher()
+            self._receive_cond.wait_for(
+                lambda: (self._received_requests >= request)
+                or not watcher.is_alive()
+            )
 
     def _watch_child(self):
-        while True:
-            self._do_tasks(do_passive=True, do_synced=False)
-            time.sleep(self._child_watcher_sleep_time)
+        try:
+            self._watch_child_loop()
+        finally:
+            with self._receive_cond:
+                self._receive_cond.notify_all()
+
+    def _watch_child_loop(self):
+        poller = zmq.Poller()
+        poller.register(self.from_child, zmq.POLLIN)
+        poller.register(self._wake_r, zmq.POLLIN)
+        while not self._watcher_done:
+            # Block until a message or wakeup (or until pending points are due)
+            timeout = None
+            if len(self._xy_batcher):
+                timeout = math.ceil(max(self._xy_batcher.time_left(), 0) * 1000)
+            events = dict(poller.poll(timeout))
+            if self._watcher_done:
+                break
+            if self._wake_r in events:
+                self._drain_wakeups()
+            with self._receive_cond:
+                requested = self._receive_requests
+            if (self.from_child in events) or (requested != self._received_requests):
+                self._receive_tasks()
+                self._do_tasks(do_passive=True, do_synced=False)
+            if requested != self._received_requests:
+                with self._receive_cond:
+                    self._received_requests = requested
+                    self._receive_cond.notify_all()
+            if self._xy_batcher.due():
+                self.flush()
 
+    # Handles the tasks that need synchronization, including those of messages
+    # the child sent before the call (messages still in transit are not
+    # waited for).
     def synchronize(self):
-        self._do_tasks(self, do_passive=False, do_synced=True)
+        self._receive_available()
+        self._do_tasks(do_passive=False, do_synced=True)
 
     def synchronize_all(self):
-        self._do_tasks(self, do_passive=True, do_synced=True)
+        self._receive_available()
+        self._do_tasks(do_passive=True, do_synced=True)
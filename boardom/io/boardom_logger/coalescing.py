@@ -0,0 +1,161 @@
+import time
+import asyncio
+import threading
+import numpy as np
+
+# Coalescing and backpressure of logged data.
+#
+# XYBatcher collects plot_xy points per series in the main process, so that
+# they are sent to the logger subprocess as one PLOT_XY_SCATTER_BATCH
+# message every interval seconds.
+#
+# TaskQueue is the bounded queue of tasks that the logger subprocess sends
+# to the board. When it is full, droppable (data) tasks are handled with a
+# policy:
+#     drop_oldest: The oldest queued data task is dropped.
+#     drop_newest: The new data task is dropped.
+#     merge: The new batch is merged into the last queued batch (or the
+#            oldest data task is dropped if there is no batch to merge into).
+# Other tasks (e.g. config updates, disconnect) are always queued.
+
+BATCH_TYPE = 'PLOT_XY_SCATTER_BATCH'
+DROPPABLE_TYPES = ['PLOT_XY_SCATTER', BATCH_TYPE]
+QUEUE_POLICIES = ['drop_oldest', 'drop_newest', 'merge']
+
+
+class XYBatcher:
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self._series = {}
+        self._lock = threading.Lock()
+        self._last_pop = time.monotonic()
+        self.num_points = 0
+        self.num_batches = 0
+
+    # Returns True for the first point of a batch
+    def add(self, x, y, name, walltime):
+        with self._lock:
+            first = not self._series
+            series = self._series.get(name, None)
+            if series is None:
+                series = self._series[name] = {
+                    'name': name,
+                    'x': [],
+                    'y': [],
+                    'time': [],
+                }
+            series['x'].append(x)
+            series['y'].append(y)
+            series['time'].append(walltime)
+            self.num_points += 1
+        return first
+
+    def __len__(self):
+        return len(self._series)
+
+    # Seconds until the batch is due (negative if it is)
+    def time_left(self):
+        return self.interval - (time.monotonic() - self._last_pop)
+
+    def due(self):
+        return bool(self._series) and self.time_left() <= 0
+
+    # Returns the batch task (None if no points were added)
+    def pop(self):
+        with self._lock:
+            self._last_pop = time.monotonic()
+            if not self._series:
+                return None
+            series, self._series = list(self._series.values()), {}
+            self.num_batches += 1
+        return {'type': BATCH_TYPE, 'payload': {'series': series}}
+
+
+# Merges the series of batch task src into dst
+def merge_batches(dst, src):
+    series = {s['name']: s for s in dst['payload']['series']}
+    for s in src['payload']['series']:
+        if s['name'] in series:
+            for key in ['x', 'y', 'time']:
+                series[s['name']][key].extend(s[key])
+        else:
+            dst['payload']['series'].append(s)
+            series[s['name']] = s
+
+
+# Copy of a batch task with numeric series as arrays (for binary transport)
+def batch_arrays(task):
+    if task.get('type', None) != BATCH_TYPE:
+        return task
+    series = []
+    for s in task['payload']['series']:
+        s = dict(s)
+        for key in ['x', 'y', 'time']:
+            array = np.asarray(s[key])
+            if array.dtype.kind in 'biuf':
+                s[key] = array
+        series.append(s)
+    return {**task, 'payload': {**task['payload'], 'series': series}}
+
+
+class TaskQueue(asyncio.Queue):
+    """Asyncio queue that holds at most `limit` droppable tasks.
+
+    Args:
+        limit (int): Maximum number of queued droppable tasks (0 for no limit).
+        policy (str): What to do with droppable tasks when the queue is full
+            ('drop_oldest', 'drop_newest' or 'merge').
+    """
+
+    def __init__(self, limit=10000, policy='merge'):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(
+                f'Invalid queue policy: {policy}'
+                f'\nValid policies: {", ".join(QUEUE_POLICIES)}'
+            )
+        super().__init__()
+        self.limit = limit
+        self.policy = policy
+        self._num_droppable = 0
+        self.dropped = 0
+        self.merged = 0
+
+    @staticmethod
+    def _droppable(task):
+        return task.get('type', None) in DROPPABLE_TYPES
+
+    def _drop_oldest(self):
+        for i, task in enumerate(self._queue):
+            if self._droppable(task):
+                del self._queue[i]
+                self._num_droppable -= 1
+                self.dropped += 1
+                # The dropped task will not be got (so that join() returns)
+                self.task_done()
+                return
+
+    def put_nowait(self, task):
+        if self._droppable(task):
+            if self.limit and self._num_droppable >= self.limit:
+                if self.policy == 'drop_newest':
+                    self.dropped += 1
+                    return
+                if (self.policy == 'merge') and task['type'] == BATCH_TYPE:
+                    for queued in reversed(self._queue):
+                        if queued.get('type', None) == BATCH_TYPE:
+                            merge_batches(queued, task)
+                            self.merged += 1
+                            return
+                self._drop_oldest()
+            self._num_droppable += 1
+        super().put_nowait(task)
+
+    def get_nowait(self):
+        task = super().get_nowait()
+        if self._droppable(task):
+            self._num_droppable -= 1
+        return task
+
+    @property
+    def stats(self):
+        return {'queued': self.qsize(), 'dropped': self.dropped, 'merged': self.merged}
@@ -1,39 +1,208 @@
 import os
+import math
+import time
+import numbers
+import numpy as np
 import boardom as bd
 import lmdb
 from .serialization import pack, unpack
+from .timeseries import SeriesWriter, read_series, select_level, check_index
 
+_INDEX_PREFIX = b'index/'
 
+
+def _is_number(x):
+    return isinstance(x, (numbers.Real, np.number)) and not isinstance(
+        x, np.complexfloating
+    )
+
+
+# Scalars are stored as time series "{name}/{process_id}", in the columnar
+# layout of timeseries.py.
+#
+# Other values (e.g. strings) are stored one per key, at
+# "{name}/{process_id}/{count:012d}" with the count at
+# "{name}/{process_id}/count", which is the layout of previous versions.
+# They are read with read_values(). Numeric series of databases written with
+# that layout are converted to the columnar layout when they are first
+# written to or read.
+#
+# The index records of the series are kept in memory (recovered from the
+# database on startup) and writes are buffered, then committed in a single
+# transaction when flush_every writes are pending or flush_interval seconds
+# have passed since the last commit (or when flush() is called).
 class LMDBHandler(metaclass=bd.Singleton):
-    def __init__(self, directory, db_map_size=10485760, readonly=False):
+    def __init__(
+        self,
+        directory,
+        db_map_size=10485760,
+        readonly=False,
+        flush_every=1000,
+        flush_interval=1.0,
+    ):
         self.readonly = readonly
         directory = bd.process_path(directory, create=True)
         self.db_dirname = os.path.join(directory, 'lmdb_data')
         self.env = lmdb.open(self.db_dirname, subdir=True, readonly=self.readonly)
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._num_pending_points = 0
+        self._last_flush = time.monotonic()
+        self._indices = self._recover_indices()
+        self._writers = {}
+        self._dirty_series = set()
+        self._value_counts = {}
 
-    def _write(self, key, data):
+    def _recover_indices(self):
+        indices = {}
+        with self.env.begin() as txn:
+            cursor = txn.cursor()
+            if cursor.set_range(_INDEX_PREFIX):
+                for key, val in cursor:
+                    if not key.startswith(_INDEX_PREFIX):
+                        break
+                    index = unpack(val)
+                    # Values of series named "index" in the previous layout
+                    if not (isinstance(index, dict) and 'count' in index):
+                        continue
+                    series = key[len(_INDEX_PREFIX) :].decode('utf-8')
+                    check_index(index, series)
+                    indices[series] = index
+        return indices
+
+    def _put(self, key, data):
         if not isinstance(data, bytes):
             data = pack(data)
+        self._pending[key.encode('utf-8')] = data
+
+    def _write(self, key, data):
+        self._put(key, data)
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        num_pending = len(self._pending) + self._num_pending_points
+        if (num_pending >= self.flush_every) or (
+            time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    # Commits the pending writes in a single transaction
+    def flush(self):
+        self._last_flush = time.monotonic()
+        for series in self._dirty_series:
+            for key, data in self._writers[series].pop_changes().items():
+                self._put(key, data)
+        self._dirty_series = set()
+        self._num_pending_points = 0
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
         with self.env.begin(write=True) as txn:
-            txn.put(key.encode('utf-8'), data)
+            txn.cursor().putmulti(pending.items())
+
+    def close(self):
+        self.flush()
+        self.env.close()
 
     def _read(self, key):
-        with self.env.begin() as txn:
-            val = txn.get(key.encode('utf-8'))
+        key = key.encode('utf-8')
+        val = self._pending.get(key, None)
+        if val is None:
+            with self.env.begin() as txn:
+                val = txn.get(key)
         if val:
             return unpack(val)
         else:
             return val
 
-    def _create_key(self, *args):
-        key = '/'.join([str(x) for x in args])
-        count_key = f'{key}/count'
-        count = self._read(count_key) or 0
+    def _writer(self, series):
+        writer = self._writers.get(series, None)
+        if writer is None:
+            index = self._indices.get(series, None)
+            with self.env.begin() as txn:
+                writer = SeriesWriter(
+                    series, index, lambda key: txn.get(key.encode('utf-8'))
+                )
+            # The writer updates the index record
+            self._writers[series] = writer
+            self._indices[series] = writer.index
+            if index is None:
+                self._convert_values(writer)
+        return writer
+
+    # Appends the numeric values stored in the previous layout to a new series
+    # (steps are 1, 2, ... and walltimes are unknown)
+    def _convert_values(self, writer):
+        values = self._read_values(writer.series)
+        if values and all(_is_number(x) for x in values):
+            for step, value in enumerate(values, 1):
+                writer.append(step, math.nan, value)
+            self._dirty_series.add(writer.series)
+
+    def _read_values(self, series):
+        count = self._read(f'{series}/count') or 0
+        return [self._read(f'{series}/{i:012d}') for i in range(1, count + 1)]
+
+    def _write_value(self, series, value):
+        count = self._value_counts.get(series, None)
+        if count is None:
+            count = self._read(f'{series}/count') or 0
         count += 1
-        full_key = f'{key}/{count:012d}'
-        return full_key, count_key, count
+        self._value_counts[series] = count
+        self._put(f'{series}/{count:012d}', value)
+        self._put(f'{series}/count', count)
+        self.maybe_flush()
+
+    # Steps default to 1, 2, ... (the number of scalars of the series).
+    # Values that are not real numbers are stored as is (see read_values).
+    def write_scalar(self, value, name, process_id, step=None, walltime=None):
+        series = f'{name}/{process_id}'
+        if not _is_number(value):
+            self._write_value(series, value)
+            return
+        if (step is not None) and not _is_number(step):
+            raise TypeError(f'Expected a numeric step for {series}. Got: {step!r}')
+        writer = self._writer(series)
+        if step is None:
+            step = writer.count + 1
+        if walltime is None:
+            walltime = time.time()
+        writer.append(step, walltime, value)
+        self._dirty_series.add(writer.series)
+        self._num_pending_points += 1
+        self.maybe_flush()
+
+    def series_count(self, name, process_id):
+        index = self._indices.get(f'{name}/{process_id}', None)
+        return 0 if index is None else index['count']
+
+    # Returns the columns of a series as a {column name: array} dictionary.
+    # Level 0 holds the logged points (step, walltime, value) and level l > 0
+    # its (step, min, max, mean, count) summaries (see timeseries.py).
+    # If max_points is given, the finest level with at most max_points rows
+    # is read.
+    def read_series(self, name, process_id, level=0, max_points=None):
+        self.flush()
+        series = f'{name}/{process_id}'
+        if (series not in self._indices) and self._read(f'{series}/count'):
+            if not all(_is_number(x) for x in self._read_values(series)):
+                raise KeyError(f'{series} holds non-numeric values (see read_values)')
+            # Converts the series of the previous layout
+            self._writer(series)
+            self.flush()
+        index = self._indices.get(series, None)
+        if index is None:
+            raise KeyError(f'No series named {series}')
+        if max_points is not None:
+            level = select_level(index, max_points)
+        with self.env.begin() as txn:
+            return read_series(
+                index, series, lambda key: txn.get(key.encode('utf-8')), level
+            )
 
-    def write_scalar(self, value, name, process_id):
-        full_key, count_key, count = self._create_key(name, process_id)
-        self._write(full_key, value)
-        self._write(count_key, count)
+    # Values stored one per key (values that are not real numbers, and all
+    # values of databases written with the previous layout)
+    def read_values(self, name, process_id):
+        self.flush()
+        return self._read_values(f'{name}/{process_id}')
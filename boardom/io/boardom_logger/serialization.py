@@ -3,10 +3,17 @@ from msgpack import ExtType
 import zmq
 import zmq.asyncio
 import zlib
+import struct
 import pickle
+import numpy as np
+import torch
 import boardom as bd
 from boardom.config.common import Group
 
+# Numeric arrays (and tensors) are packed as ExtType 4, holding the size of
+# a msgpack (dtype, shape) header, the header and the raw array data.
+_ARRAY_KINDS = 'biuf'
+
 
 def compress(obj, level=6):
     return zlib.compress(pack(obj), level)
@@ -16,8 +23,28 @@ def decompress(c_obj):
     return unpack(zlib.decompress(c_obj))
 
 
+def _pack_array(x):
+    header = msgpack.packb([x.dtype.str, list(x.shape)])
+    data = np.ascontiguousarray(x).tobytes()
+    return struct.pack('<I', len(header)) + header + data
+
+
+# Arrays are read only views of the message data
+def _unpack_array(data):
+    (header_size,) = struct.unpack_from('<I', data)
+    dtype, shape = msgpack.unpackb(data[4 : 4 + header_size])
+    array = np.frombuffer(data, dtype=np.dtype(dtype), offset=4 + header_size)
+    return array.reshape(shape)
+
+
 def msgpack_ext_pack(x):
-    if isinstance(x, bd.Config):
+    if isinstance(x, torch.Tensor):
+        x = x.detach().cpu().numpy()
+    if isinstance(x, np.ndarray) and x.dtype.kind in _ARRAY_KINDS:
+        return ExtType(4, _pack_array(x))
+    elif isinstance(x, np.generic):
+        return x.item()
+    elif isinstance(x, bd.Config):
         return ExtType(1, pickle.dumps(x))
     elif isinstance(x, Group):
         return ExtType(2, pickle.dumps(str(x)))
@@ -33,6 +60,8 @@ def msgpack_ext_unpack(code, data):
         return Group(*pickle.loads(data).split(Group._SEPARATOR))
     elif code == 3:
         return set(pickle.loads(data))
+    elif code == 4:
+        return _unpack_array(data)
     return msgpack.ExtType(code, data)
 
 
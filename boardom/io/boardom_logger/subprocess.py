@@ -1,12 +1,12 @@
 import traceback
 from concurrent.futures import CancelledError
 import asyncio
-from asyncio import Queue
 import aiohttp
 import zmq
 import json
 import boardom as bd
-from .serialization import MsgpackAsyncContext
+from .serialization import MsgpackAsyncContext, pack, unpack
+from .coalescing import TaskQueue, batch_arrays
 from .subprocess_mixins import (
     _ParentHandlerMixin,
     _ServerHandlerMixin,
@@ -35,11 +35,14 @@ class _LoggerSubprocess(
         t_await_reconnect,
         process_id,
         quiet=True,
+        queue_limit=10000,
+        queue_policy='merge',
     ):
         self.quiet = quiet
         try:
             self.should_exit = False
-            self.queue_for_ws_tasks = Queue()
+            # Bounded queue of tasks for the board (see coalescing.py)
+            self.queue_for_ws_tasks = TaskQueue(queue_limit, queue_policy)
             #  ctx = Context.instance()
             ctx = MsgpackAsyncContext.instance()
             self.to_parent = ctx.socket(zmq.PAIR)
@@ -59,6 +62,8 @@ class _LoggerSubprocess(
             #          s, lambda s=s: asyncio.create_task(self._exit(s))
             #      )
             self.ws = None
+            # Negotiated with the server on handshake (json or msgpack)
+            self.ws_protocol = 'json'
             self.connection_id = None
             self.process_id = process_id
             persistent_socket_task = asyncio.create_task(self.persist_socket())
@@ -76,6 +81,8 @@ class _LoggerSubprocess(
         except Exception:
             self.write(traceback.format_exc())
 
+        if hasattr(self, 'queue_for_ws_tasks'):
+            self.write(f'[Daemon] Task queue stats: {self.queue_for_ws_tasks.stats}')
         self.write('[Daemon] Process complete.')
         self.exited.value = 1
 
@@ -137,10 +144,13 @@ class _LoggerSubprocess(
             raise e
         self.connected.value = 0
 
+    # The handshake is sent as JSON. Servers supporting binary msgpack
+    # messages reply with WS_PROTOCOL (see server_ws_protocol).
     async def do_handshake(self):
         self.write('[Daemon] Doing handshake with server (sending process_id)')
+        self.ws_protocol = 'json'
         handshake = {
-            'payload': {'process_id': self.process_id},
+            'payload': {'process_id': self.process_id, 'protocols': ['msgpack']},
             'type': 'ENGINE_HANDSHAKE',
         }
         try:
@@ -164,9 +174,18 @@ class _LoggerSubprocess(
                 self.write('[Daemon] Main process exiting, disconnecting..')
                 return
 
+    async def send_to_ws(self, task):
+        if self.ws_protocol == 'msgpack':
+            await self.ws.send_bytes(pack(batch_arrays(task)))
+        else:
+            await self.ws.send_json(task)
+
     async def _handle_msg_from_server(self, msg):
-        if msg.type == aiohttp.WSMsgType.TEXT:
-            task = json.loads(msg.data)
+        if msg.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                task = json.loads(msg.data)
+            else:
+                task = unpack(msg.data)
             request = task['type'].lower()
             try:
                 handler = getattr(self, f'server_{request.lower()}')
@@ -237,7 +256,7 @@ class _LoggerSubprocess(
             while True:
                 if self.ws_is_alive() and not self.should_exit:
                     try:
-                        await self.ws.send_json(data)
+                        await self.send_to_ws(data)
                         break
                     except CancelledError:
                         self.should_exit = True
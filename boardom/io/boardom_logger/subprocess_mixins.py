@@ -1,3 +1,4 @@
+import asyncio
 import boardom as bd
 from .lmdb_handler import LMDBHandler
 
@@ -25,6 +26,11 @@ class _ServerHandlerMixin:
         print(f'[Daemon] Got assigned connection id: {self.connection_id}')
         return True
 
+    async def server_ws_protocol(self, task):
+        self.ws_protocol = task['payload']
+        print(f'[Daemon] Using {self.ws_protocol} websocket messages')
+        return True
+
     async def server_default_handler(self, task):
         tt = task['type']
         payload = task.get('payload', None)
@@ -42,18 +48,26 @@ class _ParentHandlerMixin:
     async def parent_start_lmdb(self, task):
         print('[Daemon] Starting LMDB')
         self.lmdb_handler = LMDBHandler(task['payload']['session_path'])
+        self.lmdb_flush_task = asyncio.create_task(self._flush_lmdb_periodically())
+
+    # Commits buffered LMDB writes even when no new values are logged
+    async def _flush_lmdb_periodically(self):
+        while not self.should_exit:
+            await asyncio.sleep(self.lmdb_handler.flush_interval)
+            self.lmdb_handler.maybe_flush()
 
     async def parent_exit(self, task):
         print('[Daemon] Got parent EXIT task. Disconnecting from server.')
         self.should_exit = True
+        if hasattr(self, 'lmdb_handler'):
+            self.lmdb_handler.flush()
         await self.queue_for_ws_tasks.put(
             dict(payload=None, type='disconnect', meta={})
         )
         await self._close_ws()
 
-    async def parent_plot_xy_scatter(self, task):
-        # Generate id for x, y,
-        payload = task['payload']
+    # Generates the names and ids of the x, y series of a plot
+    def _assign_xy_ids_(self, payload):
         name = payload['name']
         x_name, y_name = f'{name}_x', f'{name}_y'
         payload['x_name'] = x_name
@@ -66,6 +80,26 @@ class _ParentHandlerMixin:
             )
         )
 
+    def _write_xy(self, payload, x, y, time):
+        walltime = time / 1000
+        self.lmdb_handler.write_scalar(
+            x, payload['x_name'], self.process_id, walltime=walltime
+        )
+        self.lmdb_handler.write_scalar(
+            y, payload['y_name'], self.process_id, walltime=walltime
+        )
+
+    async def parent_plot_xy_scatter(self, task):
+        payload = task['payload']
+        self._assign_xy_ids_(payload)
+        await self.queue_for_ws_tasks.put(task)
+        self._write_xy(payload, payload['x'], payload['y'], payload['time'])
+
+    # Points of several series, coalesced by the parent (see coalescing.py)
+    async def parent_plot_xy_scatter_batch(self, task):
+        for series in task['payload']['series']:
+            self._assign_xy_ids_(series)
         await self.queue_for_ws_tasks.put(task)
-        self.lmdb_handler.write_scalar(payload['x'], x_name, self.process_id)
-        self.lmdb_handler.write_scalar(payload['y'], y_name, self.process_id)
+        for series in task['payload']['series']:
+            for x, y, time in zip(series['x'], series['y'], series['time']):
+                self._write_xy(series, x, y, time)
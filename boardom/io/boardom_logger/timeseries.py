@@ -0,0 +1,183 @@
+import numpy as np
+
+# Columnar storage of scalar time series in LMDB.
+#
+# Every series (e.g. "loss/<process_id>") has an index record at
+# "index/<series>" and its rows are stored in chunks of CHUNK_SIZE rows at
+# "chunk/<series>/<level>/<chunk number>". A chunk holds the packed arrays of
+# its columns, one after the other, so it is decoded with numpy.frombuffer.
+#
+# Level 0 holds the logged points (step, walltime, value). Level l > 0 is a
+# downsampled copy of the series, with one row (first step, min, max, mean,
+# count) per bucket of FACTOR ** l consecutive points, for plotting long
+# series. The last row of a level may summarize a partial bucket.
+#
+# Only the chunk holding the last row of each level is rewritten when
+# points are appended.
+#
+# Index records hold the VERSION of the layout they were written with.
+
+VERSION = 1
+CHUNK_SIZE = 1024
+FACTOR = 16
+LEVELS = 3
+RAW_COLUMNS = (('step', np.int64), ('walltime', np.float64), ('value', np.float64))
+SUMMARY_COLUMNS = (
+    ('step', np.int64),
+    ('min', np.float64),
+    ('max', np.float64),
+    ('mean', np.float64),
+    ('count', np.int64),
+)
+
+
+def level_columns(level):
+    return RAW_COLUMNS if level == 0 else SUMMARY_COLUMNS
+
+
+# Raises for index records of unknown layouts (records without a version
+# were written with version 1)
+def check_index(index, series):
+    version = index.get('version', 1) if isinstance(index, dict) else None
+    if version != VERSION:
+        raise RuntimeError(
+            f'Series {series} was stored with an unsupported layout '
+            f'(version {version}, expected {VERSION}).'
+        )
+
+
+def index_key(series):
+    return f'index/{series}'
+
+
+def chunk_key(series, level, chunk):
+    return f'chunk/{series}/{level}/{chunk:08d}'
+
+
+# Number of rows of a level, for a series of count points
+def num_rows(count, level, factor=FACTOR):
+    bucket = factor ** level
+    return -(-count // bucket)
+
+
+def encode_chunk(columns, level):
+    return b''.join(
+        np.asarray(col, dtype=dtype).tobytes()
+        for col, (_, dtype) in zip(columns, level_columns(level))
+    )
+
+
+# Returns a {column name: array} dictionary
+def decode_chunk(data, level):
+    columns = level_columns(level)
+    row_nbytes = sum(np.dtype(dtype).itemsize for _, dtype in columns)
+    n = len(data) // row_nbytes
+    ret, offset = {}, 0
+    for name, dtype in columns:
+        ret[name] = np.frombuffer(data, dtype=dtype, count=n, offset=offset)
+        offset += n * np.dtype(dtype).itemsize
+    return ret
+
+
+class SeriesWriter:
+    """Appends points to a time series (and its downsampled levels).
+
+    The rows of the last chunk of every level are kept in memory.
+
+    Args:
+        series (str): Name of the series.
+        index (dict, optional): Index record of an existing series.
+        get (Callable, optional): get(key) returns the stored bytes of a key
+            (used to read the last chunks of an existing series).
+    """
+
+    def __init__(self, series, index=None, get=None):
+        self.series = series
+        if index is None:
+            index = {
+                'version': VERSION,
+                'count': 0,
+                'chunk_size': CHUNK_SIZE,
+                'factor': FACTOR,
+                'levels': LEVELS,
+            }
+        self.index = index
+        self._ready = {}
+        self._dirty = set()
+        self._chunks, self._tails = [], []
+        for level in range(index['levels'] + 1):
+            rows = num_rows(index['count'], level, index['factor'])
+            chunk = max(rows - 1, 0) // index['chunk_size']
+            tail = [[] for _ in level_columns(level)]
+            if rows > 0:
+                stored = decode_chunk(get(chunk_key(series, level, chunk)), level)
+                tail = [stored[name].tolist() for name, _ in level_columns(level)]
+            self._chunks.append(chunk)
+            self._tails.append(tail)
+
+    @property
+    def count(self):
+        return self.index['count']
+
+    def _new_row(self, level, row):
+        tail = self._tails[level]
+        if len(tail[0]) == self.index['chunk_size']:
+            key = chunk_key(self.series, level, self._chunks[level])
+            self._ready[key] = encode_chunk(tail, level)
+            self._chunks[level] += 1
+            tail = self._tails[level] = [[] for _ in tail]
+        for col, val in zip(tail, row):
+            col.append(val)
+
+    def append(self, step, walltime, value):
+        value = float(value)
+        i = self.index['count']
+        self._new_row(0, (step, walltime, value))
+        for level in range(1, self.index['levels'] + 1):
+            if i % (self.index['factor'] ** level) == 0:
+                self._new_row(level, (step, value, value, value, 1))
+            else:
+                _, mins, maxs, means, counts = self._tails[level]
+                n = counts[-1] + 1
+                mins[-1] = min(mins[-1], value)
+                maxs[-1] = max(maxs[-1], value)
+                means[-1] += (value - means[-1]) / n
+                counts[-1] = n
+        self.index['count'] = i + 1
+        self._dirty.update(range(self.index['levels'] + 1))
+
+    # Returns the (key, bytes) items that changed since the last call
+    def pop_changes(self):
+        changes, self._ready = self._ready, {}
+        for level in self._dirty:
+            key = chunk_key(self.series, level, self._chunks[level])
+            changes[key] = encode_chunk(self._tails[level], level)
+        if self._dirty:
+            changes[index_key(self.series)] = dict(self.index)
+        self._dirty = set()
+        return changes
+
+
+# Reads a level of a series as a {column name: array} dictionary.
+# get(key) returns the stored bytes of a key.
+def read_series(index, series, get, level=0):
+    rows = num_rows(index['count'], level, index['factor'])
+    num_chunks = -(-rows // index['chunk_size'])
+    chunks = [
+        decode_chunk(get(chunk_key(series, level, chunk)), level)
+        for chunk in range(num_chunks)
+    ]
+    return {
+        name: np.concatenate([c[name] for c in chunks])
+        if chunks
+        else np.empty(0, dtype=dtype)
+        for name, dtype in level_columns(level)
+    }
+
+
+# Finest level of the series with at most max_points rows
+def select_level(index, max_points):
+    for level in range(index['levels'] + 1):
+        if num_rows(index['count'], level, index['factor']) <= max_points:
+            return level
+    return index['levels']
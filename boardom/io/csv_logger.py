@@ -44,6 +44,8 @@ class CSVLogger:
         file_handler = logging.FileHandler(self.file)
         # Adding underscore to avoid clashes with reserved words from logging
         field_tmpl = delimiter.join([f'{{_{x}}}' for x in fields])
+        self._field_tmpl = field_tmpl
+        self._file_handler = file_handler
 
         file_handler.setFormatter(logging.Formatter(field_tmpl, style='{'))
         self.logger.addHandler(file_handler)
@@ -72,3 +74,20 @@ class CSVLogger:
         if not values:
             return
         self.logger.info('', extra=self._create_dict(values))
+
+    def log_rows(self, rows):
+        """Logs multiple rows of values with a single write.
+
+        Args:
+            rows (list): List of dictionaries containing the names and values.
+        """
+        lines = [self._field_tmpl.format(**self._create_dict(x)) for x in rows if x]
+        if not lines:
+            return
+        handler = self._file_handler
+        handler.acquire()
+        try:
+            handler.stream.write('\n'.join(lines) + '\n')
+            handler.flush()
+        finally:
+            handler.release()
@@ -1,6 +1,14 @@
 import uuid
 from .handler import PersistentProcessPool
-from .util import is_main_process, only_main_process
+from .util import (
+    is_main_process,
+    only_main_process,
+    is_distributed,
+    get_rank,
+    get_world_size,
+    is_main_rank,
+    only_main_rank,
+)
 
 if is_main_process():
     _PROCESS_ID = uuid.uuid4().hex
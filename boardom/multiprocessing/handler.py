@@ -11,11 +11,25 @@ from torch._utils import ExceptionWrapper
 from torch.utils.data import _utils as torch_data_utils
 from torch.utils.data._utils import signal_handling
 import queue
+import functools
+import itertools
+import collections
 from torch._six import string_classes
 from .pin_memory import _pin_memory_loop
 from .worker import _worker_loop
-
-
+from .shared_results import SharedResultWriter, SharedResultReader, SHARED_MIN_NBYTES
+from .waiting import NotifyingQueue, get_async
+from .scheduling import TaskChunk, ChunkSizer
+
+
+# With shared_memory=True, arrays and (cpu) tensors of at least
+# shared_min_nbytes bytes are returned through shared memory instead of being
+# pickled through the result queues (see shared_results.py). The returned
+# arrays and tensors are then views of shared memory that is reused by the
+# worker once they are garbage collected.
+#
+# Asynchronous waiting is event driven (see waiting.py); async_sleep is only
+# used as a polling interval on event loops that cannot wait on pipes.
 class PersistentProcessPool(object):
     __initialized = False
 
@@ -27,6 +41,8 @@ class PersistentProcessPool(object):
         worker_init_fn=None,
         multiprocessing_context=None,
         async_sleep=0.01,
+        shared_memory=False,
+        shared_min_nbytes=SHARED_MIN_NBYTES,
     ):
         if num_workers < 1:
             raise ValueError('num_workers option should be positive')
@@ -47,11 +63,20 @@ class PersistentProcessPool(object):
         self._worker_is_active = []
         self._task_queues = []
         self._worker_result_queues = []
+        self._free_slot_queues = []
         self._workers = []
         self._available_worker_queue = queue.Queue()
+        # Futures of tasks waiting for an available worker
+        self._worker_waiters = collections.deque()
         for i in range(self.num_workers):
             task_queue = multiprocessing_context.Queue()
             result_queue = multiprocessing_context.Queue()
+            if shared_memory:
+                free_slot_queue = multiprocessing_context.Queue()
+                self._free_slot_queues.append(free_slot_queue)
+                result_writer = SharedResultWriter(free_slot_queue, shared_min_nbytes)
+            else:
+                result_writer = None
             w = multiprocessing_context.Process(
                 target=_worker_loop,
                 args=(
@@ -60,6 +85,7 @@ class PersistentProcessPool(object):
                     self._workers_done_event,
                     worker_init_fn,
                     i,
+                    result_writer,
                 ),
             )
             w.daemon = True
@@ -76,9 +102,14 @@ class PersistentProcessPool(object):
             self._worker_is_active.append(True)
             self._available_worker_queue.put(i)
 
+        if shared_memory:
+            self._result_reader = SharedResultReader(self._free_slot_queues)
+        else:
+            self._result_reader = None
+
         if self._pin_memory:
             self._pin_memory_thread_done_event = threading.Event()
-            self._results_queues = [queue.Queue() for _ in range(self.num_workers)]
+            self._results_queues = [NotifyingQueue() for _ in range(self.num_workers)]
             pin_memory_thread = threading.Thread(
                 target=_pin_memory_loop,
                 args=(
@@ -87,6 +118,7 @@ class PersistentProcessPool(object):
                     self._pinned_device,
                     self._pin_memory_thread_done_event,
                     self._async_sleep,
+                    self._read_fns(),
                 ),
             )
             pin_memory_thread.daemon = True
@@ -104,6 +136,21 @@ class PersistentProcessPool(object):
         self.__multiprocessing_context = multiprocessing_context
         self.__initialized = True
 
+    # Functions that read the (shared memory) results of each worker
+    def _read_fns(self):
+        if self._result_reader is None:
+            return None
+        return [
+            functools.partial(self._result_reader.unpack, worker_id=i)
+            for i in range(self.num_workers)
+        ]
+
+    # Reads results that were not already read by the pin memory thread
+    def _read_result(self, result, worker_id):
+        if (self._result_reader is None) or self._pin_memory:
+            return result
+        return self._result_reader.unpack(result, worker_id)
+
     def _maybe_fd_error(self):
         import tempfile
         import errno
@@ -153,8 +200,10 @@ class PersistentProcessPool(object):
         try:
             result = self._results_queues[worker_id].get(timeout=timeout)
             if isinstance(result, ExceptionWrapper):
+                # The worker is done with the failed task
+                self._release_worker(worker_id)
                 result.reraise()
-            return (True, result)
+            return (True, self._read_result(result, worker_id))
         except Exception as e:
             self._maybe_failed_workers()
             if isinstance(e, queue.Empty):
@@ -176,7 +225,7 @@ class PersistentProcessPool(object):
         if timeout > 0:
             success, result = self._get_helper(worker_id, timeout=timeout)
             if success:
-                self._available_worker_queue.put(worker_id)
+                self._release_worker(worker_id)
                 return result
             else:
                 raise RuntimeError('Timed out after {timeout} seconds')
@@ -186,7 +235,7 @@ class PersistentProcessPool(object):
                     worker_id, timeout=torch_data_utils.MP_STATUS_CHECK_INTERVAL
                 )
                 if success:
-                    self._available_worker_queue.put(worker_id)
+                    self._release_worker(worker_id)
                     return result
             else:
                 # while condition is false, i.e., pin_memory_thread died.
@@ -199,24 +248,29 @@ class PersistentProcessPool(object):
                     worker_id, timeout=torch_data_utils.MP_STATUS_CHECK_INTERVAL
                 )
                 if success:
-                    self._available_worker_queue.put(worker_id)
+                    self._release_worker(worker_id)
                     return result
 
     async def _get_async(self, worker_id):
+        # Similar to `_get`, workers' status is checked every
+        # `MP_STATUS_CHECK_INTERVAL` seconds while waiting.
         while (not self._pin_memory) or self._pin_memory_thread.is_alive():
             try:
-                result = self._results_queues[worker_id].get_nowait()
+                result = await get_async(
+                    self._results_queues[worker_id],
+                    timeout=torch_data_utils.MP_STATUS_CHECK_INTERVAL,
+                    poll_interval=self._async_sleep,
+                )
             except Exception as e:
                 self._maybe_failed_workers()
                 if isinstance(e, queue.Empty):
-                    await asyncio.sleep(self._async_sleep)
                     continue
                 self._maybe_fd_error()
                 raise
+            self._release_worker(worker_id)
             if isinstance(result, ExceptionWrapper):
                 result.reraise()
-            self._available_worker_queue.put(worker_id)
-            return result
+            return self._read_result(result, worker_id)
         else:
             raise RuntimeError('Pin memory thread exited unexpectedly')
 
@@ -224,24 +278,122 @@ class PersistentProcessPool(object):
         worker_id = await self._put_async(func)
         return await self._get_async(worker_id)
 
-    async def run_async(self, *funcs):
+    # Asynchronously yields the results of funcs (an iterable of callables,
+    # e.g. a generator), which are submitted in chunks of chunk_size tasks
+    # (see scheduling.py). At most max_in_flight chunks (2 per worker by
+    # default) are submitted or waiting to be yielded at any time, so funcs
+    # is only consumed as results are yielded. If ordered is False, results
+    # are yielded as soon as their chunk completes.
+    async def imap_async(
+        self, funcs, ordered=True, chunk_size=None, max_in_flight=None
+    ):
+        chunks = self._imap_chunks(funcs, ordered, chunk_size, max_in_flight)
+        try:
+            async for results in chunks:
+                for result in results:
+                    yield result
+        finally:
+            await chunks.aclose()
+
+    # Yields the results of imap_async per chunk
+    async def _imap_chunks(self, funcs, ordered, chunk_size, max_in_flight):
+        if max_in_flight is None:
+            max_in_flight = 2 * self.num_workers
+        sizer = ChunkSizer(chunk_size)
+        funcs = iter(funcs)
+        exhausted = False
+        pending = {}  # task: chunk index
+        completed = {}  # chunk index: results (ordered only)
+        num_chunks = next_index = 0
+        try:
+            while True:
+                while not exhausted and len(pending) + len(completed) < max_in_flight:
+                    chunk = list(itertools.islice(funcs, sizer.size))
+                    if not chunk:
+                        exhausted = True
+                        break
+                    task = asyncio.create_task(self._run_func(TaskChunk(chunk)))
+                    pending[task] = num_chunks
+                    num_chunks += 1
+                if not pending:
+                    return
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    index = pending.pop(task)
+                    results, elapsed = task.result()
+                    sizer.update(len(results), elapsed)
+                    if ordered:
+                        completed[index] = results
+                    else:
+                        yield results
+                while next_index in completed:
+                    yield completed.pop(next_index)
+                    next_index += 1
+        finally:
+            # Wait for the submitted chunks, so that their workers are released
+            if pending:
+                await asyncio.wait(pending)
+                for task in pending:
+                    if not task.cancelled():
+                        task.exception()
+
+    # Synchronous version of imap_async
+    def imap(self, funcs, ordered=True, chunk_size=None, max_in_flight=None):
+        loop = asyncio.new_event_loop()
+        chunks = self._imap_chunks(funcs, ordered, chunk_size, max_in_flight)
+        try:
+            while True:
+                try:
+                    results = loop.run_until_complete(chunks.__anext__())
+                except StopAsyncIteration:
+                    return
+                yield from results
+        finally:
+            loop.run_until_complete(chunks.aclose())
+            loop.close()
+
+    async def run_async(self, *funcs, chunk_size=None):
         if len(funcs) == 1 and isinstance(funcs[0], types.GeneratorType):
             funcs = funcs[0]
-        return await asyncio.gather(
-            *[asyncio.create_task(self._run_func(f)) for f in funcs]
-        )
-
-    def run(self, *funcs):
-        return asyncio.run(self.run_async(*funcs))
+        chunks = self._imap_chunks(funcs, True, chunk_size, None)
+        try:
+            return [r async for results in chunks for r in results]
+        finally:
+            await chunks.aclose()
+
+    def run(self, *funcs, chunk_size=None):
+        return asyncio.run(self.run_async(*funcs, chunk_size=chunk_size))
+
+    # Hands the worker to the first waiting task, or makes it available
+    def _release_worker(self, worker_id):
+        while self._worker_waiters:
+            waiter = self._worker_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(worker_id)
+                return
+        self._available_worker_queue.put(worker_id)
+
+    async def _acquire_worker_async(self):
+        try:
+            return self._available_worker_queue.get_nowait()
+        except queue.Empty:
+            pass
+        waiter = asyncio.get_running_loop().create_future()
+        self._worker_waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            # The worker may have been handed over before the cancellation
+            if waiter.done() and not waiter.cancelled():
+                self._release_worker(waiter.result())
+            raise
 
     async def _put_async(self, func):
-        while True:
-            try:
-                available_worker_idx = self._available_worker_queue.get_nowait()
-                self._task_queues[available_worker_idx].put(func)
-                return available_worker_idx
-            except queue.Empty:
-                await asyncio.sleep(self._async_sleep)
+        available_worker_idx = await self._acquire_worker_async()
+        self._task_queues[available_worker_idx].put(func)
+        return available_worker_idx
 
     def _put(self, func):
         return asyncio.run(self._put_async(func))
@@ -297,6 +449,8 @@ class PersistentProcessPool(object):
                     for worker_id in range(len(self._workers)):
                         self._worker_result_queues[worker_id].cancel_join_thread()
                         self._worker_result_queues[worker_id].close()
+                    for q in self._results_queues:
+                        q.close()
 
                 # Exit workers now.
                 self._workers_done_event.set()
@@ -308,9 +462,11 @@ class PersistentProcessPool(object):
                         self._shutdown_worker(worker_id)
                 for w in self._workers:
                     w.join()
-                for q in self._task_queues:
+                for q in self._task_queues + self._free_slot_queues:
                     q.cancel_join_thread()
                     q.close()
+                if self._result_reader is not None:
+                    self._result_reader.close()
             finally:
                 # Even though all this function does is putting into queues that
                 # we have called `cancel_join_thread` on, weird things can
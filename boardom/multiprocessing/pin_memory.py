@@ -8,17 +8,23 @@ from collections import abc as container_abcs
 from torch._six import string_classes
 from torch.utils.data._utils import MP_STATUS_CHECK_INTERVAL
 from torch._utils import ExceptionWrapper
+from .waiting import get_async
 
 
-async def _single_task(in_queue, out_queue, device_id, done_event, async_sleep):
+async def _single_task(
+    in_queue, out_queue, device_id, done_event, async_sleep, read_fn=None
+):
     while not done_event.is_set():
         try:
-            task = in_queue.get_nowait()
+            task = await get_async(
+                in_queue, timeout=MP_STATUS_CHECK_INTERVAL, poll_interval=async_sleep
+            )
         except queue.Empty:
-            await asyncio.sleep(async_sleep)
             continue
         if not done_event.is_set() and not isinstance(task, ExceptionWrapper):
             try:
+                if read_fn is not None:
+                    task = read_fn(task)
                 task = pin_memory(task)
             except Exception:
                 task = ExceptionWrapper(
@@ -33,7 +39,10 @@ async def _single_task(in_queue, out_queue, device_id, done_event, async_sleep):
         del task
 
 
-def _pin_memory_loop(in_queues, out_queues, device_id, done_event, async_sleep):
+# read_fns (optional) are called on the results of each in_queue before pinning
+def _pin_memory_loop(
+    in_queues, out_queues, device_id, done_event, async_sleep, read_fns=None
+):
     # This setting is thread local, and prevents the copy in pin_memory from
     # consuming all CPU cores.
     torch.set_num_threads(1)
@@ -42,16 +51,24 @@ def _pin_memory_loop(in_queues, out_queues, device_id, done_event, async_sleep):
 
     # See NOTE [ Data Loader Multiprocessing Shutdown Logic ] for details on the
     # logic of this function.
-    asyncio.run(_run_tasks(in_queues, out_queues, device_id, done_event, async_sleep))
+    if read_fns is None:
+        read_fns = [None] * len(in_queues)
+    asyncio.run(
+        _run_tasks(in_queues, out_queues, device_id, done_event, async_sleep, read_fns)
+    )
 
 
-async def _run_tasks(in_queues, out_queues, device_id, done_event, async_sleep):
+async def _run_tasks(
+    in_queues, out_queues, device_id, done_event, async_sleep, read_fns
+):
     await asyncio.gather(
         *[
             asyncio.create_task(
-                _single_task(in_queue, out_queue, device_id, done_event, async_sleep)
+                _single_task(
+                    in_queue, out_queue, device_id, done_event, async_sleep, read_fn
+                )
             )
-            for in_queue, out_queue in zip(in_queues, out_queues)
+            for in_queue, out_queue, read_fn in zip(in_queues, out_queues, read_fns)
         ]
     )
 
@@ -0,0 +1,58 @@
+import time
+
+# Chunked task submission.
+#
+# Tasks are sent to the workers in chunks, i.e. one queue message (and one
+# result) per chunk instead of per task. Chunks are handed to whichever
+# worker becomes available first, so faster workers process more chunks.
+# Unless a fixed chunk size is given, chunk sizes are tuned from the task
+# times measured by the workers, so that chunks take about target_time
+# seconds.
+
+
+class TaskChunk:
+    def __init__(self, funcs):
+        self.funcs = funcs
+
+    # Returns the results and the time spent computing them
+    def __call__(self):
+        start = time.perf_counter()
+        results = [func() for func in self.funcs]
+        return results, time.perf_counter() - start
+
+
+class ChunkSizer:
+    """Chooses chunk sizes from the measured task times.
+
+    Args:
+        chunk_size (int, optional): Fixed chunk size. If None, chunk sizes
+            start from 1 and are tuned from the measured task times.
+        target_time (float): Target time (in seconds) of chunks.
+        max_chunk_size (int): Maximum tuned chunk size.
+        decay (float): Decay of the moving average of the task times.
+    """
+
+    def __init__(
+        self, chunk_size=None, target_time=0.01, max_chunk_size=256, decay=0.7
+    ):
+        if (chunk_size is not None) and chunk_size < 1:
+            raise ValueError('chunk_size should be positive')
+        self.fixed = chunk_size is not None
+        self.size = 1 if chunk_size is None else chunk_size
+        self.target_time = target_time
+        self.max_chunk_size = max_chunk_size
+        self.decay = decay
+        self.task_time = None
+
+    def update(self, num_tasks, elapsed):
+        if self.fixed or num_tasks == 0:
+            return
+        task_time = elapsed / num_tasks
+        if self.task_time is None:
+            self.task_time = task_time
+        else:
+            self.task_time = self.decay * self.task_time + (1 - self.decay) * task_time
+        if self.task_time * self.max_chunk_size <= self.target_time:
+            self.size = self.max_chunk_size
+        else:
+            self.size = max(1, int(self.target_time / self.task_time))
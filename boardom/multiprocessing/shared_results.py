@@ -0,0 +1,217 @@
+import queue
+import weakref
+from collections import abc as container_abcs
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import torch
+from torch._six import string_classes
+
+# Shared memory transport of task results.
+#
+# Workers copy large arrays and (cpu) tensors of their results to shared
+# memory slots and only send SharedRefs through the result queues. Slots are
+# reused across tasks: the main process returns a slot to its worker (through
+# the worker's free queue) when the array or tensor it was read into is
+# garbage collected, so results are zero copy in the main process.
+
+SHARED_MIN_NBYTES = 1 << 16
+PAGE_SIZE = 4096
+
+
+class SharedRef:
+    __slots__ = ['slot', 'name', 'shape', 'dtype', 'kind']
+
+    def __init__(self, slot, name, shape, dtype, kind):
+        self.slot = slot
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+        self.kind = kind
+
+    def __getstate__(self):
+        return (self.slot, self.name, self.shape, self.dtype, self.kind)
+
+    def __setstate__(self, state):
+        self.slot, self.name, self.shape, self.dtype, self.kind = state
+
+    @property
+    def nbytes(self):
+        itemsize = torch.empty((), dtype=self.dtype).element_size()
+        return int(np.prod(self.shape, dtype=np.int64)) * itemsize
+
+
+def _map_results(fn, data):
+    if isinstance(data, (np.ndarray, torch.Tensor, SharedRef)):
+        return fn(data)
+    elif isinstance(data, string_classes):
+        return data
+    elif isinstance(data, container_abcs.Mapping):
+        return type(data)({k: _map_results(fn, v) for k, v in data.items()})
+    elif isinstance(data, tuple) and hasattr(data, '_fields'):  # namedtuple
+        return type(data)(*(_map_results(fn, x) for x in data))
+    elif isinstance(data, (list, tuple)):
+        return type(data)(_map_results(fn, x) for x in data)
+    else:
+        return data
+
+
+def _torch_dtype(array):
+    try:
+        # Only the dtype is checked (the array may have negative strides)
+        return torch.from_numpy(np.empty((0,), dtype=array.dtype)).dtype
+    except (TypeError, ValueError):
+        # e.g. object arrays or non-native byte order
+        return None
+
+
+# The views of buf are released on return (so that the slot can be closed)
+def _copy_to(buf, x, dtype, kind):
+    buffer = np.ndarray((len(buf),), dtype=np.uint8, buffer=buf)
+    if kind == 'torch':
+        dst = torch.from_numpy(buffer[: x.numel() * x.element_size()])
+        dst.view(dtype).reshape(x.shape).copy_(x)
+    else:
+        # Copies from any strides (e.g. negative ones)
+        np.copyto(buffer[: x.nbytes].view(x.dtype).reshape(x.shape), x)
+
+
+class SharedResultWriter:
+    """Copies the arrays and tensors of results to shared memory (in a worker).
+
+    Args:
+        free_queue (Queue): Queue of slots returned by the main process.
+        min_nbytes (int): Smaller arrays and tensors are sent through the
+            result queue.
+        max_slots (int): Maximum number of slots. When all slots are in use,
+            results are sent through the result queue.
+    """
+
+    def __init__(self, free_queue, min_nbytes=SHARED_MIN_NBYTES, max_slots=16):
+        self.free_queue = free_queue
+        self.min_nbytes = min_nbytes
+        self.max_slots = max_slots
+        self.slots = []
+        self.free = set()
+
+    def _collect_free(self):
+        while True:
+            try:
+                self.free.add(self.free_queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def _allocate(self, nbytes):
+        size = -(-nbytes // PAGE_SIZE) * PAGE_SIZE
+        fitting = [i for i in self.free if self.slots[i].size >= size]
+        if fitting:
+            slot = min(fitting, key=lambda i: self.slots[i].size)
+        elif len(self.slots) < self.max_slots:
+            slot = len(self.slots)
+            self.slots.append(shared_memory.SharedMemory(create=True, size=size))
+            return slot
+        elif self.free:
+            # Grow the smallest free slot
+            slot = min(self.free, key=lambda i: self.slots[i].size)
+            self._release(self.slots[slot])
+            self.slots[slot] = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            return None
+        self.free.remove(slot)
+        return slot
+
+    def _share(self, x):
+        if isinstance(x, torch.Tensor):
+            if x.device.type != 'cpu' or x.requires_grad:
+                return x
+            nbytes, kind = x.numel() * x.element_size(), 'torch'
+        else:
+            nbytes, kind = x.nbytes, 'numpy'
+        # Also skips 0-d arrays and tensors
+        if nbytes < self.min_nbytes:
+            return x
+        dtype = x.dtype if kind == 'torch' else _torch_dtype(x)
+        if dtype is None:
+            return x
+        slot = self._allocate(nbytes)
+        if slot is None:
+            return x
+        shm = self.slots[slot]
+        try:
+            _copy_to(shm.buf, x, dtype, kind)
+        except Exception:
+            self.free.add(slot)
+            raise
+        return SharedRef(slot, shm.name, tuple(x.shape), dtype, kind)
+
+    def pack(self, result):
+        self._collect_free()
+        return _map_results(self._share, result)
+
+    @staticmethod
+    def _release(shm):
+        shm.close()
+        shm.unlink()
+
+    def close(self):
+        for shm in self.slots:
+            self._release(shm)
+        self.slots = []
+
+
+def _return_slot(free_queue, slot):
+    try:
+        free_queue.put(slot)
+    except (ValueError, OSError, AssertionError):
+        # The pool was shut down
+        pass
+
+
+class SharedResultReader:
+    """Reads results written by SharedResultWriters (in the main process).
+
+    Arrays and tensors are views of the shared memory slots, which are
+    returned to their workers when the views are garbage collected.
+
+    Args:
+        free_queues (list): Free queue of every worker.
+    """
+
+    def __init__(self, free_queues):
+        self.free_queues = free_queues
+        self._attached = {}
+
+    def _attach(self, worker_id, ref):
+        key = (worker_id, ref.slot)
+        shm = self._attached.get(key, None)
+        if (shm is None) or (shm.name != ref.name):
+            if shm is not None:
+                # Slots are only replaced when free (not viewed)
+                shm.close()
+            shm = shared_memory.SharedMemory(name=ref.name)
+            # The worker owns (and unlinks) the shared memory
+            resource_tracker.unregister(shm._name, 'shared_memory')
+            self._attached[key] = shm
+        return shm
+
+    def _read(self, worker_id, ref):
+        if not isinstance(ref, SharedRef):
+            return ref
+        shm = self._attach(worker_id, ref)
+        nbytes = ref.nbytes
+        buffer = np.ndarray((nbytes,), dtype=np.uint8, buffer=shm.buf)
+        # Tensors keep the buffer alive (and numpy views keep their base alive)
+        weakref.finalize(buffer, _return_slot, self.free_queues[worker_id], ref.slot)
+        tensor = torch.from_numpy(buffer).view(ref.dtype).reshape(ref.shape)
+        return tensor if ref.kind == 'torch' else tensor.numpy()
+
+    def unpack(self, result, worker_id):
+        return _map_results(lambda x: self._read(worker_id, x), result)
+
+    def close(self):
+        for shm in self._attached.values():
+            try:
+                shm.close()
+            except BufferError:
+                # Results are still in use; closed when garbage collected
+                pass
+        self._attached = {}
@@ -1,7 +1,7 @@
-import boardom as bd
-
-#  import torch.distributed as dist
+from functools import wraps
 from multiprocessing import current_process
+import torch.distributed as dist
+import boardom as bd
 
 
 def is_main_process():
@@ -13,3 +13,30 @@ def only_main_process(func):
         return func
     else:
         return bd.null_function
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_rank():
+    return get_rank() == 0
+
+
+# Unlike only_main_process, the rank is checked when func is called
+# (the process group is usually initialized after functions are defined)
+def only_main_rank(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if is_main_rank():
+            return func(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,83 @@
+import os
+import time
+import queue
+import asyncio
+
+# Event driven waiting on queues in asyncio loops.
+#
+# Multiprocessing queues are read through a pipe, so a loop can wait for
+# them to become readable (loop.add_reader) instead of polling them.
+# NotifyingQueues are thread queues with a pipe that holds a byte per item,
+# so they can be waited on in the same way.
+
+
+class NotifyingQueue(queue.Queue):
+    def __init__(self, maxsize=0):
+        super().__init__(maxsize)
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+
+    # _put and _get are called with the queue's mutex held
+    def _put(self, item):
+        super()._put(item)
+        os.write(self._write_fd, b'\0')
+
+    def _get(self):
+        item = super()._get()
+        try:
+            os.read(self._read_fd, 1)
+        except BlockingIOError:
+            pass
+        return item
+
+    def fileno(self):
+        return self._read_fd
+
+    def close(self):
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+
+def queue_fileno(q):
+    if isinstance(q, NotifyingQueue):
+        return q.fileno()
+    # multiprocessing.Queue
+    return q._reader.fileno()
+
+
+def _set_pending(future):
+    if not future.done():
+        future.set_result(None)
+
+
+# Waits (at most timeout seconds) for fd to become readable.
+# Falls back to sleeping for poll_interval seconds on loops without
+# add_reader support (e.g. the Windows proactor loop).
+async def wait_readable(fd, timeout=None, poll_interval=0.01):
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    try:
+        loop.add_reader(fd, _set_pending, future)
+    except NotImplementedError:
+        await asyncio.sleep(poll_interval)
+        return
+    try:
+        await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        loop.remove_reader(fd)
+
+
+# Asynchronous queue.get(timeout=timeout) of multiprocessing queues and
+# NotifyingQueues.
+async def get_async(q, timeout=None, poll_interval=0.01):
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        try:
+            return q.get_nowait()
+        except queue.Empty:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if (remaining is not None) and remaining <= 0:
+                raise
+        await wait_readable(queue_fileno(q), remaining, poll_interval)
@@ -11,7 +11,9 @@ from torch.utils.data._utils import (
 from torch.utils.data._utils.worker import WorkerInfo, ManagerWatchdog
 
 
-def _worker_loop(input_queue, output_queue, done_event, init_fn, worker_id):
+def _worker_loop(
+    input_queue, output_queue, done_event, init_fn, worker_id, result_writer=None
+):
     try:
         # Initialize C side signal handlers for SIGBUS and SIGSEGV. Python signal
         # module's handlers are executed after Python returns from C low-level
@@ -52,6 +54,8 @@ def _worker_loop(input_queue, output_queue, done_event, init_fn, worker_id):
                 continue
             try:
                 result = func()
+                if result_writer is not None:
+                    result = result_writer.pack(result)
             except Exception:
                 # It is important that we don't store exc_info in a variable.
                 # `ExceptionWrapper` does the correct thing.
@@ -62,5 +66,7 @@ def _worker_loop(input_queue, output_queue, done_event, init_fn, worker_id):
     except KeyboardInterrupt:
         # Main process will raise KeyboardInterrupt anyways.
         pass
+    if result_writer is not None:
+        result_writer.close()
     output_queue.cancel_join_thread()
     output_queue.close()
@@ -84,7 +84,7 @@ from .layers import (
 )
 
 
-from .meter import Average, MeanVar
+from .meter import Average, MeanVar, EMA, LogHistogram
 
 from .model_hooks import (
     forward_hook,
@@ -1,3 +1,7 @@
+import math
+import torch
+
+
 class Average:
     """Keeps an average of values."""
 
@@ -48,3 +52,177 @@ class MeanVar:
 
     def sample_variance(self):
         return self.m2 / (self.count - 1)
+
+
+def _as_tensor(values):
+    if torch.is_tensor(values):
+        return values.detach().reshape(-1)
+    return torch.as_tensor(values, dtype=torch.float64).reshape(-1)
+
+
+class EMA:
+    """Exponentially decayed moving average.
+
+    The average is bias corrected (as in Adam), so that the first values
+    are not biased towards 0. Values are kept on the device of the added
+    tensors.
+
+    Args:
+        decay (float): Decay of the average per added value.
+    """
+
+    def __init__(self, decay=0.99):
+        if not (0 <= decay < 1):
+            raise ValueError(f'Expected decay in [0, 1) (got {decay}).')
+        self.decay = decay
+        self.reset()
+
+    def reset(self):
+        """Resets the average."""
+        self.value = 0
+        self.weight = 0.0
+
+    def add(self, values):
+        """Adds a value or a batch of values (in order).
+
+        Args:
+            values: Number or tensor (of any shape).
+        """
+        x = _as_tensor(values)
+        n = x.numel()
+        if n == 0:
+            return
+        decay = self.decay
+        powers = torch.arange(n - 1, -1, -1, device=x.device, dtype=torch.float64)
+        weights = (1 - decay) * torch.pow(decay, powers)
+        total_decay = decay**n
+        self.value = self.value * total_decay + (weights * x).sum()
+        self.weight = self.weight * total_decay + (1 - total_decay)
+
+    def merge(self, other):
+        """Merges the average of another EMA (e.g. of another process)."""
+        if other.weight == 0:
+            return
+        self.value = self.value + other.value
+        self.weight = self.weight + other.weight
+
+    def get(self):
+        """Returns the current average."""
+        if self.weight == 0:
+            return None
+        return float(self.value / self.weight)
+
+
+class LogHistogram:
+    """Histogram with logarithmically spaced bins, for streaming quantiles.
+
+    Memory is bounded by the number of bins. Quantiles are estimated within
+    a relative error of about 10 ** (1 / bins_per_decade) - 1 (~12% with the
+    default 20 bins per decade), which suits positive quantities such as
+    latencies, losses and gradient norms. Values below min_value (including
+    zero and negative values) and above max_value are counted in an
+    underflow and an overflow bin. Counts are kept on the device of the
+    added tensors.
+
+    Args:
+        quantiles (Sequence[float]): Quantiles returned by get().
+        min_value (float): Lower edge of the first bin.
+        max_value (float): Upper edge of the last bin.
+        bins_per_decade (int): Resolution of the bins.
+    """
+
+    def __init__(
+        self,
+        quantiles=(0.5, 0.9, 0.99),
+        min_value=1e-8,
+        max_value=1e8,
+        bins_per_decade=20,
+    ):
+        if not (0 < min_value < max_value):
+            raise ValueError('Expected 0 < min_value < max_value.')
+        self.quantiles = tuple(quantiles)
+        self.min_value = min_value
+        self.max_value = max_value
+        self.bins_per_decade = bins_per_decade
+        decades = math.log10(max_value / min_value)
+        n_edges = math.ceil(decades * bins_per_decade) + 1
+        self.edges = torch.logspace(
+            math.log10(min_value), math.log10(max_value), n_edges, dtype=torch.float64
+        )
+        self.reset()
+
+    def reset(self):
+        """Resets the histogram."""
+        # Underflow bin, len(edges) - 1 bins and overflow bin
+        self.counts = torch.zeros(len(self.edges) + 1, dtype=torch.int64)
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, values):
+        """Adds a value or a batch of values.
+
+        Args:
+            values: Number or tensor (of any shape).
+        """
+        x = _as_tensor(values)
+        if x.numel() == 0:
+            return
+        x = x.to(torch.float64)
+        if self.edges.device != x.device:
+            self.edges = self.edges.to(x.device)
+            self.counts = self.counts.to(x.device)
+        bins = torch.bucketize(x, self.edges, right=True)
+        self.counts += torch.bincount(bins, minlength=len(self.counts))
+        self.min = torch.minimum(torch.as_tensor(self.min, device=x.device), x.min())
+        self.max = torch.maximum(torch.as_tensor(self.max, device=x.device), x.max())
+
+    def merge(self, other):
+        """Merges the counts of another histogram with the same bins."""
+        if len(other.edges) != len(self.edges) or not torch.allclose(
+            other.edges.cpu(), self.edges.cpu()
+        ):
+            raise ValueError('Can not merge histograms with different bins.')
+        self.counts = self.counts + other.counts.to(self.counts.device)
+        self.min = min(float(self.min), float(other.min))
+        self.max = max(float(self.max), float(other.max))
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def quantile(self, q):
+        """Estimates a quantile (0 <= q <= 1) of the added values."""
+        return self._quantiles([q])[0]
+
+    def _quantiles(self, qs):
+        counts = self.counts.cpu()
+        total = int(counts.sum())
+        if total == 0:
+            return [None] * len(qs)
+        cumulative = torch.cumsum(counts, 0).tolist()
+        edges = self.edges.cpu().tolist()
+        low, high = float(self.min), float(self.max)
+        ret = []
+        for q in qs:
+            if not (0 <= q <= 1):
+                raise ValueError(f'Expected a quantile in [0, 1] (got {q}).')
+            rank = q * (total - 1) + 1
+            b = next(i for i, c in enumerate(cumulative) if c >= rank)
+            if b == 0 or q == 0:
+                ret.append(low)
+                continue
+            if b == len(counts) - 1 or q == 1:
+                ret.append(high)
+                continue
+            # Geometric interpolation within the bin
+            prev = cumulative[b - 1]
+            frac = (rank - prev) / (cumulative[b] - prev)
+            lo_edge, hi_edge = edges[b - 1], edges[b]
+            value = lo_edge * (hi_edge / lo_edge) ** frac
+            ret.append(min(max(value, low), high))
+        return ret
+
+    def get(self):
+        """Returns a dictionary with the quantiles (e.g. {'p50': ...})."""
+        values = self._quantiles(self.quantiles)
+        return {f'p{100 * q:g}': v for q, v in zip(self.quantiles, values)}
@@ -0,0 +1,508 @@
+import os
+import json
+import pickle
+import time
+import threading
+import pytest
+import torch
+import boardom as bd
+from boardom.components import chunk_store
+
+
+def _make_engine(directory, asynchronous=False, **kwargs):
+    eng = bd.Checkpoint()
+    eng.models = {'main': torch.nn.Linear(4, 4)}
+    eng.attach_checkpointers(
+        'models.main', directory=directory, asynchronous=asynchronous, **kwargs
+    )
+    return eng
+
+
+def _pth_files(directory):
+    return sorted(x for x in os.listdir(directory) if x.endswith('.pth'))
+
+
+class TestCheckpoint:
+    @pytest.mark.parametrize('asynchronous', [False, True])
+    def test_save_and_load(self, tmp_path, asynchronous):
+        eng = _make_engine(tmp_path, asynchronous)
+        eng.save_checkpoint()
+        expected = eng.models.main.weight.detach().clone()
+        eng.wait_for_checkpoints()
+        other = _make_engine(tmp_path)
+        assert not torch.equal(other.models.main.weight, expected)
+        other.load_latest()
+        assert torch.equal(other.models.main.weight, expected)
+
+    def test_overwrite_removes_previous(self, tmp_path):
+        eng = _make_engine(tmp_path, use_timestamps=False, overwrite=True)
+        eng.save_checkpoint(tag=1)
+        eng.save_checkpoint(tag=2)
+        eng.wait_for_checkpoints()
+        assert _pth_files(tmp_path) == ['models.main.2.pth']
+        assert list(eng.checkpointing.metadata.models_main.files) == [
+            'models_main_chk2'
+        ]
+
+
+class TestAsyncCheckpoint:
+    def test_snapshot_is_not_affected_by_training(self, tmp_path):
+        eng = _make_engine(tmp_path, asynchronous=True)
+        expected = eng.models.main.weight.detach().clone()
+        eng.save_checkpoint()
+        with torch.no_grad():
+            eng.models.main.weight += 1
+        eng.wait_for_checkpoints()
+        other = _make_engine(tmp_path)
+        other.load_latest()
+        assert torch.equal(other.models.main.weight, expected)
+
+    def test_metafile_written_after_files(self, tmp_path):
+        eng = _make_engine(tmp_path, asynchronous=True)
+        release = threading.Event()
+
+        def slow_save(obj, filename):
+            release.wait()
+            torch.save(obj, filename)
+
+        eng.save_checkpoint(save_fn=slow_save)
+        assert eng.checkpoint_writer.in_flight() == 1
+        assert not os.path.exists(eng.checkpointing.metafile)
+        release.set()
+        eng.wait_for_checkpoints()
+        assert eng.checkpoint_writer.in_flight() == 0
+        with open(eng.checkpointing.metafile) as f:
+            meta = json.load(f)
+        assert meta['previous_checkpoint_num'] == 1
+        (basename,) = [
+            x['basename'] for x in meta['metadata']['models_main']['files'].values()
+        ]
+        assert os.path.exists(os.path.join(tmp_path, basename))
+        assert not [x for x in os.listdir(tmp_path) if x.endswith('.tmp')]
+
+    def test_wait_raises_write_errors(self, tmp_path):
+        eng = _make_engine(tmp_path, asynchronous=True)
+
+        def failing_save(obj, filename):
+            raise IOError('disk full')
+
+        eng.save_checkpoint(save_fn=failing_save)
+        with pytest.raises(IOError):
+            eng.wait_for_checkpoints()
+        assert not os.path.exists(eng.checkpointing.metafile)
+
+    @pytest.mark.parametrize('asynchronous', [False, True])
+    def test_failed_writes_are_rolled_back(self, tmp_path, asynchronous):
+        eng = _make_engine(tmp_path, asynchronous, overwrite=False)
+
+        def failing_save(obj, filename):
+            raise IOError('disk full')
+
+        eng.save_checkpoint(step=1)
+        eng.wait_for_checkpoints()
+        with pytest.raises(IOError):
+            eng.save_checkpoint(step=2, save_fn=failing_save)
+            eng.wait_for_checkpoints()
+        chkp = eng.checkpointing
+        assert chkp.previous_checkpoint_num == 1
+        assert [x.step for x in chkp.metadata.models_main.files.values()] == [1]
+        eng.save_checkpoint(step=3)
+        eng.wait_for_checkpoints()
+        assert [x.step for x in chkp.metadata.models_main.files.values()] == [1, 3]
+        assert len(_pth_files(tmp_path)) == 2
+        other = _make_engine(tmp_path)
+        other.load_latest()
+        assert torch.equal(other.models.main.weight, eng.models.main.weight)
+
+    def test_next_save_raises_write_errors(self, tmp_path):
+        eng = _make_engine(tmp_path, asynchronous=True)
+
+        def failing_save(obj, filename):
+            raise IOError('disk full')
+
+        eng.save_checkpoint(save_fn=failing_save)
+        while eng.checkpoint_writer.in_flight():
+            time.sleep(0.001)
+        with pytest.raises(IOError):
+            eng.save_checkpoint()
+        assert eng.checkpointing.previous_checkpoint_num == 0
+        assert not eng.checkpointing.metadata.models_main.files
+
+    def test_waits_at_training_end(self, tmp_path):
+        eng = _make_engine(tmp_path, asynchronous=True)
+        eng.save_checkpoint()
+        eng.event('training_end')
+        assert eng.checkpoint_writer.in_flight() == 0
+        assert len(_pth_files(tmp_path)) == 1
+
+    def test_in_flight_names_are_not_reused(self, tmp_path):
+        eng = _make_engine(
+            tmp_path, asynchronous=True, use_timestamps=False, overwrite=False
+        )
+        release = threading.Event()
+
+        def slow_save(obj, filename):
+            release.wait()
+            torch.save(obj, filename)
+
+        eng.save_checkpoint(save_fn=slow_save)
+        eng.save_checkpoint(save_fn=slow_save)
+        release.set()
+        eng.wait_for_checkpoints()
+        assert _pth_files(tmp_path) == ['models.main.pth', 'models.main_1.pth']
+
+
+def _chunk_files(directory):
+    chunk_dir = os.path.join(directory, 'chunks')
+    if not os.path.exists(chunk_dir):
+        return []
+    return sorted(os.listdir(chunk_dir))
+
+
+def _make_frozen_engine(directory, **kwargs):
+    eng = bd.Checkpoint()
+    eng.models = {
+        'main': torch.nn.Sequential(torch.nn.Linear(4, 4), torch.nn.Linear(4, 2))
+    }
+    eng.models.main[0].requires_grad_(False)
+    eng.attach_checkpointers('models.main', directory=directory, **kwargs)
+    return eng
+
+
+def _train_step(eng):
+    with torch.no_grad():
+        eng.models.main[1].weight += 1
+
+
+class TestDeduplicatedCheckpoint:
+    def test_unchanged_tensors_are_written_once(self, tmp_path):
+        eng = _make_frozen_engine(tmp_path, deduplicate=True, overwrite=False)
+        eng.save_checkpoint()
+        assert len(_chunk_files(tmp_path)) == 4
+        _train_step(eng)
+        eng.save_checkpoint()
+        # Only the changed weight is written
+        assert len(_chunk_files(tmp_path)) == 5
+        files = eng.checkpointing.metadata.models_main.files
+        assert all(len(x.chunks) == 4 for x in files.values())
+
+    @pytest.mark.parametrize('asynchronous', [False, True])
+    def test_load_latest(self, tmp_path, asynchronous):
+        eng = _make_frozen_engine(
+            tmp_path, deduplicate=True, asynchronous=asynchronous
+        )
+        eng.save_checkpoint()
+        _train_step(eng)
+        eng.save_checkpoint()
+        expected = {k: v.clone() for k, v in eng.models.main.state_dict().items()}
+        eng.wait_for_checkpoints()
+        other = _make_frozen_engine(tmp_path, deduplicate=True)
+        other.load_latest()
+        loaded = other.models.main.state_dict()
+        assert all(torch.equal(loaded[k], v) for k, v in expected.items())
+
+    @pytest.mark.parametrize('asynchronous', [False, True])
+    def test_tensors_are_hashed_once_by_the_writer(
+        self, tmp_path, monkeypatch, asynchronous
+    ):
+        threads, compacted = [], []
+        digest, compact = chunk_store._digest, chunk_store._compact
+
+        def _digest(tensor):
+            threads.append(threading.current_thread().name)
+            return digest(tensor)
+
+        def _compact(tensor):
+            compacted.append(tensor)
+            return compact(tensor)
+
+        monkeypatch.setattr(chunk_store, '_digest', _digest)
+        monkeypatch.setattr(chunk_store, '_compact', _compact)
+        eng = _make_frozen_engine(
+            tmp_path,
+            deduplicate=True,
+            asynchronous=asynchronous,
+            overwrite=False,
+            keep_last=1,
+        )
+        eng.save_checkpoint()
+        _train_step(eng)
+        eng.save_checkpoint()
+        eng.wait_for_checkpoints()
+        assert len(threads) == len(compacted) == 8
+        if asynchronous:
+            assert all(x.startswith('bd_checkpoint_writer') for x in threads)
+        (file_meta,) = eng.checkpointing.metadata.models_main.files.values()
+        assert len(_chunk_files(tmp_path)) == len(file_meta.chunks) == 4
+        with open(eng.checkpointing.metafile) as f:
+            meta = json.load(f)
+        (written,) = meta['metadata']['models_main']['files'].values()
+        assert written['chunks'] == file_meta.chunks
+
+    def test_overwrite_collects_unreferenced_chunks(self, tmp_path):
+        eng = _make_frozen_engine(tmp_path, deduplicate=True, overwrite=True)
+        eng.save_checkpoint()
+        first = set(_chunk_files(tmp_path))
+        _train_step(eng)
+        eng.save_checkpoint()
+        eng.wait_for_checkpoints()
+        second = set(_chunk_files(tmp_path))
+        assert len(second) == 4
+        assert len(first - second) == 1
+        assert len(_pth_files(tmp_path)) == 1
+
+    def test_shared_tensors_are_not_collected(self, tmp_path):
+        eng = _make_frozen_engine(tmp_path, deduplicate=True, overwrite=True)
+        eng.frozen = eng.models.main[0]
+        eng.attach_checkpointers(
+            'models.main', 'frozen', directory=tmp_path, deduplicate=True
+        )
+        eng.save_checkpoint()
+        eng.save_checkpoint('models.main')
+        eng.wait_for_checkpoints()
+        assert len(_chunk_files(tmp_path)) == 4
+        other = _make_frozen_engine(tmp_path, deduplicate=True)
+        other.frozen = torch.nn.Linear(4, 4)
+        other.load_latest('frozen')
+
+    def test_sanitize_drops_checkpoints_with_missing_chunks(self, tmp_path):
+        eng = _make_frozen_engine(tmp_path, deduplicate=True, overwrite=False)
+        eng.save_checkpoint()
+        _train_step(eng)
+        eng.save_checkpoint()
+        files = eng.checkpointing.metadata.models_main.files
+        changed = set(files.models_main_chk2.chunks) - set(
+            files.models_main_chk1.chunks
+        )
+        (digest,) = changed
+        os.remove(os.path.join(tmp_path, 'chunks', f'{digest}.pth'))
+        other = _make_frozen_engine(
+            tmp_path, deduplicate=True, sanitize_metadata=True
+        )
+        assert list(other.checkpointing.metadata.models_main.files) == [
+            'models_main_chk1'
+        ]
+        assert len(_chunk_files(tmp_path)) == 4
+
+
+class TestFlatCheckpoint:
+    def test_save_flat_and_load(self, tmp_path):
+        from boardom.components.flat_checkpoint import FlatCheckpoint, save_flat
+
+        state = {
+            'a': torch.randn(3, 4),
+            'b': {'c': torch.arange(5, dtype=torch.bfloat16), 'd': [1, 'x']},
+            'e': (torch.tensor(True), torch.empty(0, 2)),
+            'f': torch.randn(4, 4)[:, 1],
+        }
+        filename = str(tmp_path / 'state.flat')
+        save_flat(state, filename)
+        flat = FlatCheckpoint(filename)
+        assert set(flat.keys()) == {'a', 'b.c', 'e.0', 'e.1', 'f'}
+        loaded = flat.load()
+        assert torch.equal(loaded['a'], state['a'])
+        assert torch.equal(loaded['b']['c'], state['b']['c'])
+        assert loaded['b']['d'] == [1, 'x']
+        assert loaded['e'][0].item() is True
+        assert loaded['e'][1].shape == (0, 2)
+        assert torch.equal(loaded['f'], state['f'])
+        # Modifying loaded tensors does not modify the file
+        loaded['a'] += 1
+        assert torch.equal(FlatCheckpoint(filename).load()['a'], state['a'])
+
+    def test_load_selected_keys(self, tmp_path):
+        from boardom.components.flat_checkpoint import load_flat, save_flat
+
+        state = torch.nn.Sequential(
+            torch.nn.Linear(2, 2), torch.nn.BatchNorm1d(2)
+        ).state_dict()
+        filename = str(tmp_path / 'state.flat')
+        save_flat(state, filename)
+        loaded = load_flat(filename, patterns=['0.*'])
+        assert list(loaded) == ['0.weight', '0.bias']
+        assert loaded._metadata == state._metadata
+
+    @pytest.mark.parametrize('asynchronous', [False, True])
+    def test_checkpoint_format(self, tmp_path, asynchronous):
+        eng = _make_engine(tmp_path, asynchronous, format='flat')
+        eng.optimizers = {
+            'main': torch.optim.Adam(eng.models.main.parameters(), lr=0.1)
+        }
+        eng.attach_checkpointers(
+            'models.main',
+            'optimizers.main',
+            directory=tmp_path,
+            asynchronous=asynchronous,
+            format='flat',
+        )
+        eng.models.main(torch.randn(2, 4)).sum().backward()
+        eng.optimizers.main.step()
+        eng.save_checkpoint()
+        eng.wait_for_checkpoints()
+        assert sorted(os.listdir(tmp_path)) == [
+            'checkpoints.json',
+            *sorted(x.basename for x in _latest_files(eng)),
+        ]
+        other = _make_engine(tmp_path, format='flat')
+        other.optimizers = {
+            'main': torch.optim.Adam(other.models.main.parameters(), lr=0.1)
+        }
+        other.load_latest()
+        assert torch.equal(other.models.main.weight, eng.models.main.weight)
+        exp_avg = other.optimizers.main.state_dict()['state'][0]['exp_avg']
+        assert torch.equal(
+            exp_avg, eng.optimizers.main.state_dict()['state'][0]['exp_avg']
+        )
+
+    def test_partial_load_latest(self, tmp_path):
+        eng = bd.Checkpoint()
+        eng.models = {
+            'main': torch.nn.Sequential(torch.nn.Linear(4, 4), torch.nn.Linear(4, 4))
+        }
+        eng.attach_checkpointers('models.main', directory=tmp_path, format='flat')
+        eng.save_checkpoint()
+        other = bd.Checkpoint()
+        other.models = {
+            'main': torch.nn.Sequential(torch.nn.Linear(4, 4), torch.nn.Linear(4, 4))
+        }
+        other.attach_checkpointers('models.main', directory=tmp_path, format='flat')
+        other.load_latest('models.main.0.*')
+        main, other_main = eng.models.main, other.models.main
+        assert torch.equal(other_main[0].weight, main[0].weight)
+        assert torch.equal(other_main[0].bias, main[0].bias)
+        assert not torch.equal(other_main[1].weight, main[1].weight)
+
+    def test_load_fn_kwargs_with_flat_format(self, tmp_path):
+        eng = _make_engine(tmp_path, format='flat')
+        eng.save_checkpoint()
+        other = _make_engine(tmp_path, format='flat')
+        other.load_latest(pickle_module=pickle, map_location='cpu')
+        assert torch.equal(other.models.main.weight, eng.models.main.weight)
+
+    def test_partial_load_latest_torch_format(self, tmp_path):
+        eng = _make_engine(tmp_path)
+        eng.save_checkpoint()
+        other = _make_engine(tmp_path)
+        other.load_latest('models.main.bias')
+        assert torch.equal(other.models.main.bias, eng.models.main.bias)
+        assert not torch.equal(other.models.main.weight, eng.models.main.weight)
+
+    def test_invalid_format(self, tmp_path):
+        with pytest.raises(RuntimeError):
+            _make_engine(tmp_path, format='pickle')
+        with pytest.raises(RuntimeError):
+            _make_engine(tmp_path, format='flat', deduplicate=True)
+
+
+def _latest_files(eng):
+    chkp = eng.checkpointing
+    num = chkp.previous_checkpoint_num
+    return [val.files[f'{key}_chk{num}'] for key, val in chkp.metadata.items()]
+
+
+class TestCheckpointRetention:
+    def _save_steps(self, eng, steps, metrics=None):
+        metrics = metrics or [None] * len(steps)
+        for step, metric in zip(steps, metrics):
+            eng.save_checkpoint(step=step, metric=metric)
+
+    def _steps(self, eng):
+        files = eng.checkpointing.metadata.models_main.files
+        return [x.step for x in files.values()]
+
+    def test_keep_last(self, tmp_path):
+        eng = _make_engine(tmp_path, overwrite=False, keep_last=2)
+        self._save_steps(eng, range(5))
+        assert self._steps(eng) == [3, 4]
+        eng.wait_for_checkpoints()
+        assert len(_pth_files(tmp_path)) == 2
+
+    def test_keep_every(self, tmp_path):
+        eng = _make_engine(tmp_path, overwrite=False, keep_every=10)
+        self._save_steps(eng, [4, 8, 12, 16, 20, 24, 31])
+        assert self._steps(eng) == [4, 12, 20, 31]
+
+    @pytest.mark.parametrize('best_mode', ['min', 'max'])
+    def test_keep_best(self, tmp_path, best_mode):
+        eng = _make_engine(
+            tmp_path, overwrite=False, keep_best=2, best_mode=best_mode
+        )
+        metrics = [0.5, 0.1, 0.9, 0.3, 0.7]
+        self._save_steps(eng, range(5), metrics)
+        expected = [1, 3, 4] if best_mode == 'min' else [2, 4]
+        assert self._steps(eng) == expected
+
+    def test_policies_are_combined(self, tmp_path):
+        eng = _make_engine(
+            tmp_path, overwrite=False, keep_last=1, keep_best=1, keep_every=100
+        )
+        eng.save_checkpoint(step=100, metric=3, force_no_overwrite=True)
+        self._save_steps(eng, [110, 120, 130, 200, 210], [2, 1, 4, 5, 6])
+        assert self._steps(eng) == [100, 120, 200, 210]
+        eng.wait_for_checkpoints()
+        assert len(_pth_files(tmp_path)) == 4
+
+    def test_step_defaults_to_global_step(self, tmp_path):
+        eng = _make_engine(tmp_path, overwrite=False, keep_last=1)
+        eng.training = {'global_step': 7}
+        eng.save_checkpoint()
+        assert self._steps(eng) == [7]
+
+    def test_asynchronous_removal(self, tmp_path):
+        eng = _make_engine(
+            tmp_path, asynchronous=True, overwrite=False, keep_last=1
+        )
+        self._save_steps(eng, range(3))
+        eng.wait_for_checkpoints()
+        assert len(_pth_files(tmp_path)) == 1
+        with open(eng.checkpointing.metafile) as f:
+            meta = json.load(f)
+        assert list(meta['metadata']['models_main']['files']) == [
+            'models_main_chk3'
+        ]
+
+    def test_synchronous_removal_runs_in_the_background(self, tmp_path, monkeypatch):
+        threads = []
+        remove = os.remove
+
+        def _remove(path):
+            threads.append(threading.current_thread().name)
+            remove(path)
+
+        monkeypatch.setattr(os, 'remove', _remove)
+        eng = _make_engine(tmp_path, overwrite=False, keep_last=1)
+        self._save_steps(eng, range(3))
+        eng.wait_for_checkpoints()
+        assert len(_pth_files(tmp_path)) == 1
+        assert len(threads) == 2
+        assert all(x.startswith('bd_checkpoint_writer') for x in threads)
+
+    def test_order_survives_reload(self, tmp_path):
+        eng = _make_engine(tmp_path, overwrite=False, keep_last=3, keep_every=5)
+        self._save_steps(eng, range(11))
+        eng.wait_for_checkpoints()
+        # The metafile has sorted keys ('chk10' before 'chk9')
+        other = _make_engine(tmp_path, overwrite=False, keep_last=3, keep_every=5)
+        self._save_steps(other, [11])
+        files = other.checkpointing.metadata.models_main.files
+        assert sorted(x.step for x in files.values()) == [0, 5, 9, 10, 11]
+        other.wait_for_checkpoints()
+        assert len(_pth_files(tmp_path)) == 5
+
+    def test_retention_removes_unreferenced_chunks(self, tmp_path):
+        eng = _make_frozen_engine(
+            tmp_path, overwrite=False, deduplicate=True, keep_last=1
+        )
+        for _ in range(3):
+            _train_step(eng)
+            eng.save_checkpoint()
+        eng.wait_for_checkpoints()
+        assert len(_chunk_files(tmp_path)) == 4
+
+    def test_invalid_settings(self, tmp_path):
+        with pytest.raises(RuntimeError):
+            _make_engine(tmp_path, keep_last=2)
+        with pytest.raises(RuntimeError):
+            _make_engine(tmp_path, overwrite=False, keep_last=0)
+        with pytest.raises(RuntimeError):
+            _make_engine(tmp_path, overwrite=False, keep_best=1, best_mode='avg')
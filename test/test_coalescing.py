@@ -0,0 +1,169 @@
+import time
+import asyncio
+import pytest
+import boardom as bd
+from boardom.io.boardom_logger.coalescing import (
+    XYBatcher,
+    TaskQueue,
+    merge_batches,
+    BATCH_TYPE,
+)
+from boardom.io.boardom_logger.lmdb_handler import LMDBHandler
+from boardom.io.boardom_logger.subprocess_mixins import _ParentHandlerMixin
+
+
+def _batch(name, *xs):
+    return {
+        'type': BATCH_TYPE,
+        'payload': {
+            'series': [
+                {'name': name, 'x': list(xs), 'y': list(xs), 'time': list(xs)}
+            ]
+        },
+    }
+
+
+class TestXYBatcher:
+    def test_points_are_batched_per_series(self):
+        batcher = XYBatcher(interval=1e6)
+        assert batcher.pop() is None
+        batcher.add(1, 10, 'a', 100)
+        batcher.add(2, 20, 'b', 101)
+        batcher.add(3, 30, 'a', 102)
+        assert not batcher.due()
+        task = batcher.pop()
+        assert task['type'] == BATCH_TYPE
+        assert task['payload']['series'] == [
+            {'name': 'a', 'x': [1, 3], 'y': [10, 30], 'time': [100, 102]},
+            {'name': 'b', 'x': [2], 'y': [20], 'time': [101]},
+        ]
+        assert len(batcher) == 0
+        assert (batcher.num_points, batcher.num_batches) == (3, 1)
+
+    def test_due(self):
+        batcher = XYBatcher(interval=0.01)
+        assert not batcher.due()
+        batcher.add(1, 1, 'a', 0)
+        time.sleep(0.02)
+        assert batcher.due()
+        batcher.pop()
+        assert not batcher.due()
+
+    def test_plot_xy_requires_start(self):
+        if bd.BoardomLogger._started:
+            pytest.skip('Boardom logger already started')
+        with pytest.raises(RuntimeError, match='start()'):
+            bd.BoardomLogger().plot_xy(1, 2, 'a')
+
+
+class TestTaskQueue:
+    def test_merge_batches(self):
+        dst = _batch('a', 1, 2)
+        merge_batches(dst, _batch('a', 3))
+        merge_batches(dst, _batch('b', 4))
+        series = dst['payload']['series']
+        assert [s['name'] for s in series] == ['a', 'b']
+        assert series[0]['x'] == [1, 2, 3]
+        assert series[1]['x'] == [4]
+
+    def test_invalid_policy(self):
+        with pytest.raises(ValueError):
+            TaskQueue(policy='foo')
+
+    def test_drop_oldest(self):
+        q = TaskQueue(limit=2, policy='drop_oldest')
+        for i in range(4):
+            q.put_nowait(_batch('a', i))
+        assert q.stats == {'queued': 2, 'dropped': 2, 'merged': 0}
+        assert q.get_nowait()['payload']['series'][0]['x'] == [2]
+
+    def test_drop_newest(self):
+        q = TaskQueue(limit=2, policy='drop_newest')
+        for i in range(4):
+            q.put_nowait(_batch('a', i))
+        assert q.stats == {'queued': 2, 'dropped': 2, 'merged': 0}
+        assert q.get_nowait()['payload']['series'][0]['x'] == [0]
+        # There is room again
+        q.put_nowait(_batch('a', 5))
+        assert q.qsize() == 2
+
+    def test_merge(self):
+        q = TaskQueue(limit=2, policy='merge')
+        for i in range(5):
+            q.put_nowait(_batch('a', i))
+        assert q.stats == {'queued': 2, 'dropped': 0, 'merged': 3}
+        assert q.get_nowait()['payload']['series'][0]['x'] == [0]
+        assert q.get_nowait()['payload']['series'][0]['x'] == [1, 2, 3, 4]
+        # Single points can not be merged
+        q.put_nowait(_batch('a', 0))
+        q.put_nowait(_batch('a', 1))
+        q.put_nowait({'type': 'PLOT_XY_SCATTER', 'payload': {}})
+        assert q.stats == {'queued': 2, 'dropped': 1, 'merged': 3}
+
+    def test_other_tasks_are_not_dropped(self):
+        q = TaskQueue(limit=1, policy='drop_newest')
+        q.put_nowait(_batch('a', 0))
+        q.put_nowait({'type': 'SET_CFG_VALUE', 'payload': {}})
+        q.put_nowait(_batch('a', 1))
+        q.put_nowait({'type': 'disconnect', 'payload': None})
+        assert [q.get_nowait()['type'] for _ in range(q.qsize())] == [
+            BATCH_TYPE,
+            'SET_CFG_VALUE',
+            'disconnect',
+        ]
+        assert q.dropped == 1
+
+    @pytest.mark.parametrize('policy', ['drop_oldest', 'drop_newest', 'merge'])
+    def test_join_after_drops(self, policy):
+        async def _run():
+            q = TaskQueue(limit=2, policy=policy)
+            for i in range(5):
+                q.put_nowait(_batch('a', i))
+            q.put_nowait({'type': 'PLOT_XY_SCATTER', 'payload': {}})
+            while not q.empty():
+                q.get_nowait()
+                q.task_done()
+            await asyncio.wait_for(q.join(), timeout=1)
+
+        asyncio.run(_run())
+
+    def test_async_get(self):
+        async def _run():
+            q = TaskQueue(limit=1)
+            getter = asyncio.create_task(q.get())
+            await asyncio.sleep(0)
+            await q.put(_batch('a', 1))
+            return await getter
+
+        assert asyncio.run(_run())['payload']['series'][0]['x'] == [1]
+
+
+class _Subprocess(_ParentHandlerMixin):
+    def __init__(self, lmdb_handler):
+        self.process_id = 'pid'
+        self.queue_for_ws_tasks = TaskQueue()
+        self.lmdb_handler = lmdb_handler
+
+
+class TestSubprocessBatchHandler:
+    def test_batches_are_stored_and_forwarded(self, tmp_path):
+        bd.Singleton._instances.pop(LMDBHandler, None)
+        handler = LMDBHandler(str(tmp_path))
+        try:
+            sub = _Subprocess(handler)
+            batcher = XYBatcher()
+            for i in range(5):
+                batcher.add(i, 2 * i, 'loss', 1000 * i)
+            batcher.add(0, 1, 'acc', 0)
+            asyncio.run(sub.parent_plot_xy_scatter_batch(batcher.pop()))
+            task = sub.queue_for_ws_tasks.get_nowait()
+            series = task['payload']['series']
+            assert series[0]['x_name'] == 'loss_x'
+            assert series[0]['plot_id'] == str(hash(('pid', 'loss')))
+            loss_y = handler.read_series('loss_y', 'pid')
+            assert loss_y['value'].tolist() == [0, 2, 4, 6, 8]
+            assert loss_y['walltime'].tolist() == [0, 1, 2, 3, 4]
+            assert handler.read_series('acc_x', 'pid')['value'].tolist() == [0]
+        finally:
+            handler.env.close()
+            bd.Singleton._instances.pop(LMDBHandler, None)
@@ -0,0 +1,160 @@
+import time
+from collections import namedtuple
+import pytest
+import torch
+import boardom as bd
+from boardom.components import Data
+from boardom.data import to_device
+
+
+def _batches(n=5):
+    return [
+        {'x': torch.full((2,), float(i)), 'y': [i, torch.tensor(i)]} for i in range(n)
+    ]
+
+
+class TestPrefetcher:
+    def test_invalid_depth_raises(self):
+        with pytest.raises(ValueError):
+            bd.Prefetcher([], depth=0)
+
+    @pytest.mark.parametrize('depth', [1, 3, 10])
+    def test_yields_all_items_in_order(self, depth):
+        batches = _batches()
+        out = list(bd.Prefetcher(batches, 'cpu', depth))
+        assert len(out) == len(batches)
+        for got, expected in zip(out, batches):
+            assert torch.equal(got['x'], expected['x'])
+            assert got['y'][0] == expected['y'][0]
+            assert torch.equal(got['y'][1], expected['y'][1])
+
+    def test_can_iterate_multiple_times(self):
+        prefetcher = bd.Prefetcher(_batches(), depth=2)
+        assert len(prefetcher) == 5
+        assert len(list(prefetcher)) == 5
+        assert len(list(prefetcher)) == 5
+
+    def test_fetches_ahead(self):
+        fetched = []
+
+        def generate():
+            for i in range(10):
+                fetched.append(i)
+                yield i
+
+        it = iter(bd.Prefetcher(generate(), depth=2))
+        assert next(it) == 0
+        for _ in range(100):
+            if len(fetched) >= 3:
+                break
+            time.sleep(0.01)
+        assert len(fetched) >= 3
+        it.close()
+
+    def test_exceptions_are_raised_in_consumer(self):
+        def generate():
+            yield 1
+            raise KeyError('bad item')
+
+        it = iter(bd.Prefetcher(generate()))
+        assert next(it) == 1
+        with pytest.raises(KeyError):
+            next(it)
+
+    def test_early_stop_does_not_block(self):
+        prefetcher = bd.Prefetcher(range(1000), depth=1)
+        for i in prefetcher:
+            if i == 2:
+                break
+        assert list(prefetcher)[-1] == 999
+
+
+Batch = namedtuple('Batch', ['inputs', 'target'])
+
+
+class TestToDevice:
+    def test_nested_containers(self):
+        batch = {
+            'pair': Batch(torch.ones(2), [torch.zeros(1), 'name']),
+            'values': (torch.arange(3),),
+        }
+        moved = to_device(batch, 'cpu')
+        assert isinstance(moved['pair'], Batch)
+        assert torch.equal(moved['pair'].inputs, torch.ones(2))
+        assert moved['pair'].target[1] == 'name'
+        assert isinstance(moved['values'], tuple)
+        assert torch.equal(moved['values'][0], torch.arange(3))
+
+
+class TestDataPrefetch:
+    def _make_engine(self):
+        eng = Data()
+        eng.data.training = _batches()
+        return eng
+
+    @pytest.mark.parametrize('depth', [0, 2])
+    def test_iterate_data(self, depth):
+        eng = self._make_engine().set_data_prefetch(depth)
+        seen = []
+
+        @bd.on('training_iteration_start')
+        def check(engine):
+            seen.append(engine.datum.training['y'][0])
+
+        eng.register(check)
+        for i, datum in enumerate(eng.iterate_data('training')):
+            assert torch.equal(datum['x'], torch.full((2,), float(i)))
+            assert eng.datum.training is datum
+        assert seen == list(range(5))
+        assert 'training' not in eng.datum
+
+    def test_set_data_prefetch_modes(self):
+        eng = Data().set_data_prefetch(2, 'validation')
+        assert dict(eng.data_prefetch) == {'validation': 2}
+        eng.set_data_prefetch(0)
+        assert dict(eng.data_prefetch) == {
+            'training': 0,
+            'validation': 0,
+            'testing': 0,
+        }
+
+    def test_iterate_data_no_events(self):
+        eng = self._make_engine().set_data_prefetch(1)
+        assert len(list(eng.iterate_data_no_events('training'))) == 5
+
+
+class TestResumableSampler:
+    def test_order_depends_on_seed_and_epoch(self):
+        data = list(range(20))
+        sampler = bd.ResumableSampler(data, seed=1)
+        first = list(sampler)
+        assert sorted(first) == data
+        assert list(bd.ResumableSampler(data, seed=1)) == first
+        sampler.set_epoch(1)
+        assert list(sampler) != first
+        sampler.set_epoch(0)
+        assert list(sampler) == first
+
+    def test_start(self):
+        data = list(range(20))
+        sampler = bd.ResumableSampler(data, seed=1)
+        full = list(sampler)
+        sampler.set_start(15)
+        assert len(sampler) == 5
+        assert list(sampler) == full[15:]
+        sampler.set_start(30)
+        assert len(sampler) == 0
+        assert list(sampler) == []
+        with pytest.raises(ValueError):
+            sampler.set_start(-1)
+
+    def test_no_shuffle(self):
+        sampler = bd.ResumableSampler(range(5), shuffle=False)
+        sampler.set_start(2)
+        assert list(sampler) == [2, 3, 4]
+
+    def test_state_dict(self):
+        sampler = bd.ResumableSampler(range(10))
+        other = bd.ResumableSampler(range(10))
+        other.load_state_dict(sampler.state_dict())
+        assert list(other) == list(sampler)
@@ -0,0 +1,127 @@
+import os
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.distributed.algorithms.ddp_comm_hooks import default_hooks
+import boardom as bd
+
+WORLD_SIZE = 2
+
+
+def _run(rank, init_file, directory, results):
+    bd.verbose = False
+
+    class Trainer(bd.DistributedSGDTrainer, bd.Checkpoint, bd.LoggerEngine):
+        def training_iteration(self):
+            self.seen.extend(self.datum.training[0][:, 0].long().tolist())
+            super().training_iteration()
+            self.loggers.losses.update_averages({'loss': float(self.rank_loss)})
+
+        def do_forward(self):
+            super().do_forward()
+            self.rank_loss = self.distributed.rank + 1
+
+    torch.manual_seed(rank)
+    trainer = Trainer().setup_distributed(
+        init_method=f'file://{init_file}', rank=rank, world_size=WORLD_SIZE
+    )
+    trainer.seen = []
+    trainer.models.main = torch.nn.Linear(4, 1)
+    trainer.criteria.main = torch.nn.MSELoss()
+    trainer.optimizers.main = torch.optim.SGD(
+        trainer.models.main.parameters(), lr=0.1
+    )
+    dataset = [(torch.full((4,), float(i)), torch.ones(1)) for i in range(10)]
+    cfg = bd.State(
+        {
+            'num_workers': 0,
+            'batch_size': 2,
+            'shuffle': True,
+            'pin_memory': False,
+            'drop_last': False,
+            'timeout': 0,
+            'prefetch_factor': 2,
+            'persistent_workers': False,
+        }
+    )
+    trainer.data.training = trainer.create_dataloader_from_cfg(dataset, cfg=cfg)
+    logged = []
+    logger = bd.components.logger.GenericLogger(
+        lambda: None, lambda values, tag='': logged.append(values), 'losses', None
+    )
+    logger.track_averages(
+        meters={'quantiles': lambda: bd.LogHistogram(quantiles=(0.0, 1.0))}
+    )
+    trainer.loggers.losses = logger
+    trainer.attach_checkpointers('models.main', directory=directory)
+    # Each rank has 3 batches, so gradients are only all-reduced once
+    trainer.accumulate_gradients(3)
+    trainer.distribute_models()
+    all_reduces = []
+
+    def _counting_hook(state, bucket):
+        all_reduces.append(bucket.index())
+        return default_hooks.allreduce_hook(None, bucket)
+
+    trainer.models.main.register_comm_hook(None, _counting_hook)
+    trainer.fit(max_epochs=1)
+    trainer.save_checkpoint()
+    averages = logger._trackers['average'].get()
+    logger.log_averages()
+    weight = trainer.models.main.state_dict()['weight'].tolist()
+    num = trainer.checkpointing.previous_checkpoint_num
+    results.put(
+        (rank, sorted(trainer.seen), weight, averages, logged, all_reduces, num)
+    )
+    dist.barrier()
+    dist.destroy_process_group()
+
+
+class TestDistributedSGDTrainer:
+    def test_not_distributed_by_default(self):
+        trainer = bd.DistributedSGDTrainer()
+        assert not bd.is_distributed()
+        assert bd.get_rank() == 0
+        assert bd.get_world_size() == 1
+        trainer.models.main = torch.nn.Linear(2, 2)
+        trainer.distribute_models()
+        assert isinstance(trainer.models.main, torch.nn.Linear)
+
+    def test_only_main_rank(self):
+        @bd.only_main_rank
+        def func(x):
+            return x
+
+        assert func(3) == 3
+
+    def test_two_processes(self, tmp_path):
+        ctx = mp.get_context('spawn')
+        results = ctx.Queue()
+        init_file = tmp_path / 'init'
+        directory = tmp_path / 'checkpoints'
+        mp.start_processes(
+            _run,
+            args=(str(init_file), str(directory), results),
+            nprocs=WORLD_SIZE,
+            start_method='spawn',
+        )
+        out = sorted(results.get(timeout=60) for _ in range(WORLD_SIZE))
+        (_, seen0, w0, avg0, logged0, ar0, num0) = out[0]
+        (_, seen1, w1, avg1, logged1, ar1, num1) = out[1]
+        # Data is sharded
+        assert sorted(seen0 + seen1) == list(range(10))
+        # Parameters are synchronized
+        assert w0 == w1
+        # Averages are all-reduced and only logged by rank 0
+        assert avg0 == avg1 == {'loss': 1.5}
+        assert logged0 == [{'loss': 1.5}, {'loss': 1.0}, {'loss': 2.0}]
+        assert logged1 == []
+        # Gradients are only all-reduced before the optimizer step
+        assert ar0 == ar1 == [0]
+        # Checkpoint counters are advanced on every rank
+        assert num0 == num1 == 1
+        # Checkpoints are only written once
+        files = [x for x in os.listdir(directory) if x.endswith('.pth')]
+        assert len(files) == 1
+        loaded = torch.load(directory / files[0])
+        assert list(loaded) == ['weight', 'bias']
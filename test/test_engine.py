@@ -1,5 +1,7 @@
+import threading
 import pytest
 import boardom as bd
+from boardom.engine import cleanup_context
 
 
 class TestEngine:
@@ -1170,6 +1172,80 @@ class TestEngine:
         assert f.bonk() == [10]
 
 
+class TestNameCache:
+    def test_state_keys_are_cached_and_follow_changes(self):
+        eng = bd.Engine()
+        eng.a = 1
+        assert eng.a == 1
+        assert eng.a == 1
+        eng.state.a = 2
+        assert eng.a == 2
+        eng.pop('a')
+        with pytest.raises(AttributeError):
+            eng.a
+        eng.update({'a': 3})
+        assert eng.a == 3
+
+    def test_cached_reads_match_resolution(self):
+        from boardom.engine.engine import _resolve_name
+
+        trainer = bd.DefaultSGDTrainer()
+        trainer.datum.training = (1, 2)
+        names = ['training', 'datum', 'models', 'optimizers', 'do_forward', 'event']
+        for _ in range(2):
+            for name in names:
+                assert getattr(trainer, name) == _resolve_name(trainer, name)
+
+    def test_state_takes_precedence_over_cached_attributes(self):
+        eng = bd.Engine()
+        items = eng.items
+        assert eng.items == items
+        eng.state.update({'items': 5})
+        assert eng.items == 5
+        eng.state.pop('items')
+        assert eng.items() == eng.state.items()
+
+    def test_register_invalidates_cached_names(self):
+        eng = bd.Engine()
+        eng.register('foo', lambda: 5)
+        assert eng.foo() == [5]
+        with pytest.raises(AttributeError):
+            eng.bar
+        eng.register('bar', lambda: 7)
+        assert eng.bar() == [7]
+
+    def test_deleting_prior_members_raises_after_caching(self):
+        class Foo(bd.Engine):
+            val = 2
+
+        f = Foo()
+        assert f.val == 2
+        del f.val
+        with pytest.raises(AttributeError) as e:
+            f.val
+        assert 'not accessible' in str(e)
+        f['val'] = 3
+        assert f.val == 3
+        del f['val']
+        with pytest.raises(AttributeError):
+            f.val
+
+    def test_cached_properties_work(self):
+        class Foo(bd.Engine):
+            def __init__(self):
+                super().__init__()
+                self._x = 1
+
+            @property
+            def x(self):
+                return self._x
+
+        f = Foo()
+        assert f.x == 1
+        f._x = 5
+        assert f.x == 5
+
+
 class TestCleanup:
     def test_cleanup_works(self):
         eng = bd.Engine()
@@ -1193,3 +1269,289 @@ class TestCleanup:
         assert 'g.h' not in eng.state
         assert 'g' not in eng.state
         assert 'b.c.w' not in eng.state
+
+
+    def test_cleanup_only_deletes_keys_of_the_engine(self):
+        eng = bd.Engine()
+        other = bd.Engine()
+        eng.state = {'a': {'b': 1}}
+        external = bd.State()
+        with bd.CleanupState(eng):
+            other.x = 1
+            external.y = 2
+            local = bd.State()
+            local.z = 3
+            eng.a.c = local
+            local.w = 4
+        assert other.x == 1
+        assert external.y == 2
+        assert local.z == 3
+        assert 'a.c' not in eng
+        assert eng.a.b == 1
+
+    def test_cleanup_works_when_nested(self):
+        eng = bd.Engine()
+        eng.a = 1
+        with bd.CleanupState(eng):
+            eng.b = 2
+            with bd.CleanupState(eng):
+                eng.c = 3
+                eng.setdefault('d', 4)
+            assert 'c' not in eng
+            assert 'd' not in eng
+            assert eng.b == 2
+        assert 'b' not in eng
+        assert eng.a == 1
+
+    def test_cleanup_keeps_existing_keys_that_are_reassigned(self):
+        eng = bd.Engine()
+        eng.state = {'a': {'b': 1}, 'c': 2}
+        with bd.CleanupState(eng):
+            eng.c = 3
+            eng.a = {'b': 5, 'd': 6}
+            eng.a.e = 7
+        assert eng.c == 3
+        assert eng.a.b == 5
+        assert 'a.e' not in eng
+
+    def test_cleanup_keeps_existing_keys_that_are_deleted_and_reassigned(self):
+        eng = bd.Engine()
+        eng.state = {'a': 1, 'b': {'c': 2}}
+        with bd.CleanupState(eng):
+            del eng.a
+            eng.a = 5
+            del eng.state['b.c']
+            eng.b.c = 3
+            eng.d = 4
+            del eng.d
+            eng.d = 6
+        assert eng.a == 5
+        assert eng.b.c == 3
+        assert 'd' not in eng
+
+    def test_temporary_states_do_not_search_the_engine(self, monkeypatch):
+        eng = bd.Engine()
+        eng.state = {'a': {'b': {'c': 1}}, 'd': 2}
+        indexed = []
+        index_paths = cleanup_context._index_paths
+        monkeypatch.setattr(
+            cleanup_context,
+            '_index_paths',
+            lambda root: indexed.append(root) or index_paths(root),
+        )
+        for i in range(5):
+            with bd.CleanupState(eng):
+                tmp = bd.State()
+                tmp.x = i
+                eng.a.b.e = i
+            assert tmp.x == i
+            assert 'a.b.e' not in eng
+        assert len(indexed) == 1
+        # States stored in the engine later are found
+        eng.a.tmp = tmp
+        with bd.CleanupState(eng):
+            tmp.y = 1
+        assert 'y' not in tmp
+        assert len(indexed) == 2
+
+    def test_cleanup_ignores_other_threads(self):
+        eng = bd.Engine()
+        with bd.CleanupState(eng):
+            thread = threading.Thread(target=lambda: setattr(eng, 'x', 1))
+            thread.start()
+            thread.join()
+            eng.y = 2
+        assert eng.x == 1
+        assert 'y' not in eng
+
+
+class TestCompiledEvents:
+    def test_can_enable_with_class_keyword(self):
+        class Foo(bd.Engine, compile_events=True):
+            @bd.on('foo')
+            def foo(self):
+                return 5
+
+        class Bar(Foo):
+            pass
+
+        assert Foo().foo() == [5]
+        assert Bar()._compile_events
+        assert not bd.Engine()._compile_events
+
+    def test_compiled_events_return_same_values(self):
+        class Foo(bd.Engine):
+            val = 2
+
+            @bd.on('foo')
+            def foo(self, a=3):
+                return self.val * a
+
+            @bd.on('foo')
+            def bar(self, b=1):
+                return self.val + b
+
+        class Other(bd.Engine):
+            val = 7
+
+        f = Foo()
+        other = Other()
+        expected = [f.event('foo'), f.event('foo', 5), f.event('foo', other)]
+        f.compile_events()
+        assert f.event('foo') == expected[0]
+        assert f.event('foo', 5) == expected[1]
+        assert f.event('foo', other) == expected[2]
+        assert isinstance(f.event('foo'), bd.EventReturnValue)
+        assert f.event('unregistered') is None
+
+    def test_register_invalidates_compiled_plan(self):
+        eng = bd.Engine().compile_events()
+        eng.register('do', lambda: 1)
+        assert eng.event('do') == [1]
+        eng.register('do', lambda: 2)
+        assert eng.event('do') == [1, 2]
+
+    def test_middleware_added_after_compiling_is_applied(self):
+        def doublermw(engine, callback, **kwargs):
+            return 2 * callback(**kwargs)
+
+        class Foo(bd.Engine, compile_events=True):
+            @bd.on('foo')
+            def foo_fn(self):
+                return 3
+
+        f = Foo()
+        assert f.foo() == [3]
+        bd.middleware(doublermw)(f.foo_fn)
+        assert f.foo() == [6]
+
+    def test_method_with_event_name_runs_first(self):
+        out = []
+
+        class Foo(bd.Engine, compile_events=True):
+            def foo(self):
+                out.append('method')
+                return 1
+
+            @bd.on('foo')
+            def other(self):
+                out.append('other')
+                return 2
+
+        f = Foo()
+        assert f.foo() == [1, 2]
+        assert f.foo() == [1, 2]
+        assert out == ['method', 'other', 'method', 'other']
+
+
+class TestExecutors:
+    def test_invalid_executor_raises(self):
+        with pytest.raises(ValueError):
+            bd.on('foo', executor='process')
+        with pytest.raises(ValueError):
+            bd.Engine().set_executor('foo', 'nope')
+
+    @pytest.mark.parametrize('compiled', [False, True])
+    def test_thread_executor_returns_futures(self, compiled):
+        import threading
+        from concurrent.futures import Future
+
+        class Foo(bd.Engine, compile_events=compiled):
+            @bd.on('foo', executor='thread')
+            def threaded(self, a=1):
+                return threading.current_thread().name, a
+
+            @bd.on('foo')
+            def inline(self, a=1):
+                return threading.current_thread().name, a
+
+        f = Foo()
+        ret = f.foo(a=5)
+        futures = [x for x in ret if isinstance(x, Future)]
+        assert len(futures) == 1
+        assert (threading.current_thread().name, 5) in ret
+        name, a = futures[0].result()
+        assert name != threading.current_thread().name
+        assert a == 5
+        assert f.wait_for_events() == [(name, 5)]
+        assert f.wait_for_events() == []
+
+    @pytest.mark.parametrize('compiled', [False, True])
+    def test_executor_per_event(self, compiled):
+        eng = bd.Engine().compile_events(compiled)
+        eng.register('foo', lambda: 1)
+        eng.register('bar', lambda: 2)
+        eng.set_executor('foo', 'thread')
+        assert eng.foo()[0].result() == 1
+        assert eng.bar() == [2]
+        eng.bar()
+        assert eng.wait_for_events('bar') == []
+        assert eng.wait_for_events('foo') == [1]
+        eng.set_executor('foo', 'sync')
+        assert eng.foo() == [1]
+
+    def test_action_executor_overrides_event_executor(self):
+        class Foo(bd.Engine):
+            @bd.on('foo', executor='sync')
+            def foo_fn(self):
+                return 1
+
+        f = Foo()
+        f.set_executor('foo', 'thread')
+        f.register('foo', lambda: 2)
+        ret = f.foo()
+        assert ret[0] == 1
+        assert ret[1].result() == 2
+
+    def test_async_executor_awaits_coroutines(self):
+        import asyncio
+
+        class Foo(bd.Engine):
+            @bd.on('foo', executor='async')
+            async def foo_fn(self, x=1):
+                await asyncio.sleep(0)
+                return x * 2
+
+            @bd.on('foo', executor='async')
+            def bar_fn(self, x=1):
+                return x
+
+        f = Foo()
+        f.foo(x=3)
+        assert sorted(f.wait_for_events('foo')) == [3, 6]
+
+    def test_engine_and_middleware_are_resolved(self):
+        def doublermw(engine, callback, **kwargs):
+            return 2 * callback(**kwargs)
+
+        class Foo(bd.Engine):
+            val = 3
+
+            @bd.middleware(doublermw)
+            @bd.on('foo', executor='thread')
+            def foo_fn(self):
+                return self.val
+
+        other = bd.Engine()
+        other.val = 5
+        f = Foo()
+        f.foo()
+        f.foo(other)
+        assert f.wait_for_events() == [6, 10]
+
+    def test_wait_raises_action_exceptions(self):
+        def fail():
+            raise ValueError('failed')
+
+        eng = bd.Engine().register('foo', fail).set_executor('foo', 'thread')
+        eng.foo()
+        with pytest.raises(ValueError):
+            eng.wait_for_events()
+        assert eng.wait_for_events() == []
+
+    def test_completed_futures_are_dropped_after_max_pending(self):
+        eng = bd.Engine().register('foo', lambda: 1).set_executor('foo', 'thread')
+        eng._pending_futures.max_pending = 4
+        for _ in range(10):
+            eng.foo()[0].result()
+        assert len(eng.wait_for_events('foo')) <= 5
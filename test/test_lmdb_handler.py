@@ -0,0 +1,187 @@
+import numpy as np
+import pytest
+import boardom as bd
+from boardom.io.boardom_logger.lmdb_handler import LMDBHandler
+from boardom.io.boardom_logger import timeseries
+
+
+@pytest.fixture
+def make_handler(tmp_path):
+    handlers = []
+
+    # LMDBHandler is a singleton
+    def _make(**kwargs):
+        bd.Singleton._instances.pop(LMDBHandler, None)
+        handler = LMDBHandler(str(tmp_path), **kwargs)
+        handlers.append(handler)
+        return handler
+
+    yield _make
+    bd.Singleton._instances.pop(LMDBHandler, None)
+    for handler in handlers:
+        handler.env.close()
+
+
+def _stored(handler):
+    with handler.env.begin() as txn:
+        return {k.decode(): v for k, v in txn.cursor()}
+
+
+class TestLMDBHandler:
+    def test_write_and_read_series(self, make_handler):
+        handler = make_handler(flush_every=1)
+        handler.write_scalar(1.5, 'loss_x', 'pid', walltime=10.0)
+        handler.write_scalar(2.5, 'loss_x', 'pid', walltime=11.0)
+        handler.write_scalar(3, 'loss_y', 'pid', step=7)
+        series = handler.read_series('loss_x', 'pid')
+        assert series['step'].tolist() == [1, 2]
+        assert series['walltime'].tolist() == [10.0, 11.0]
+        assert series['value'].tolist() == [1.5, 2.5]
+        assert handler.read_series('loss_y', 'pid')['step'].tolist() == [7]
+        assert handler.series_count('loss_x', 'pid') == 2
+        assert handler.series_count('other', 'pid') == 0
+        with pytest.raises(KeyError):
+            handler.read_series('other', 'pid')
+
+    def test_writes_are_batched(self, make_handler):
+        handler = make_handler(flush_every=5, flush_interval=1e6)
+        for i in range(4):
+            handler.write_scalar(i, 'x', 'pid')
+        assert _stored(handler) == {}
+        handler.write_scalar(4, 'x', 'pid')
+        stored = _stored(handler)
+        # Index and one chunk per level
+        assert len(stored) == 2 + timeseries.LEVELS
+        assert bd.unpack(stored['index/x/pid'])['count'] == 5
+        handler.write_scalar(5, 'x', 'pid')
+        assert bd.unpack(_stored(handler)['index/x/pid'])['count'] == 5
+        handler.flush()
+        assert bd.unpack(_stored(handler)['index/x/pid'])['count'] == 6
+
+    def test_flush_interval(self, make_handler):
+        handler = make_handler(flush_every=1000, flush_interval=0.0)
+        handler.write_scalar(1, 'x', 'pid')
+        assert 'index/x/pid' in _stored(handler)
+
+    def test_series_are_recovered(self, make_handler):
+        handler = make_handler(flush_every=1000, flush_interval=1e6)
+        n = timeseries.CHUNK_SIZE + 10
+        for i in range(n):
+            handler.write_scalar(i, 'x', 'pid')
+        handler.write_scalar(0, 'y', 'pid')
+        handler.close()
+        handler = make_handler()
+        assert handler.series_count('x', 'pid') == n
+        assert handler.series_count('y', 'pid') == 1
+        handler.write_scalar(n, 'x', 'pid')
+        series = handler.read_series('x', 'pid')
+        assert series['value'].tolist() == list(range(n + 1))
+        assert series['step'].tolist() == list(range(1, n + 2))
+        summary = handler.read_series('x', 'pid', level=1)
+        assert summary['count'].sum() == n + 1
+        assert summary['max'][-1] == n
+
+    def test_max_points(self, make_handler):
+        handler = make_handler()
+        for i in range(1000):
+            handler.write_scalar(i, 'x', 'pid')
+        assert len(handler.read_series('x', 'pid', max_points=1000)['value']) == 1000
+        summary = handler.read_series('x', 'pid', max_points=100)
+        assert len(summary['mean']) == 63
+        assert summary['min'][0] == 0 and summary['max'][0] == 15
+
+
+    def test_non_numeric_values(self, make_handler):
+        handler = make_handler(flush_every=1)
+        handler.write_scalar('a', 'text_x', 'pid')
+        handler.write_scalar(np.float32(0.5), 'text_y', 'pid')
+        handler.write_scalar([1, 2], 'text_x', 'pid')
+        assert handler.read_values('text_x', 'pid') == ['a', [1, 2]]
+        assert handler.read_series('text_y', 'pid')['value'].tolist() == [0.5]
+        with pytest.raises(KeyError, match='read_values'):
+            handler.read_series('text_x', 'pid')
+        with pytest.raises(TypeError):
+            handler.write_scalar(1, 'text_y', 'pid', step='a')
+
+    def test_previous_layout_is_converted(self, make_handler):
+        handler = make_handler()
+        # Keys written by previous versions
+        with handler.env.begin(write=True) as txn:
+            for i, value in enumerate([0.5, 1.5, 2], 1):
+                txn.put(f'loss/pid/{i:012d}'.encode(), bd.pack(value))
+            txn.put(b'loss/pid/count', bd.pack(3))
+        handler.close()
+        handler = make_handler()
+        series = handler.read_series('loss', 'pid')
+        assert series['step'].tolist() == [1, 2, 3]
+        assert series['value'].tolist() == [0.5, 1.5, 2]
+        assert np.isnan(series['walltime']).all()
+        handler.write_scalar(3, 'loss', 'pid')
+        handler.close()
+        handler = make_handler()
+        assert handler.read_series('loss', 'pid')['step'].tolist() == [1, 2, 3, 4]
+        assert handler.read_values('loss', 'pid') == [0.5, 1.5, 2]
+
+    def test_unknown_layout_version(self, make_handler):
+        handler = make_handler(flush_every=1)
+        handler.write_scalar(1, 'x', 'pid')
+        index = dict(handler._indices['x/pid'], version=timeseries.VERSION + 1)
+        with handler.env.begin(write=True) as txn:
+            txn.put(b'index/x/pid', bd.pack(index))
+        handler.close()
+        with pytest.raises(RuntimeError, match='unsupported layout'):
+            make_handler()
+
+
+class TestTimeSeries:
+    def _write(self, values):
+        stored = {}
+        writer = timeseries.SeriesWriter('s')
+        for i, val in enumerate(values):
+            writer.append(i, 0.5 * i, val)
+            if i % 700 == 0:
+                stored.update(writer.pop_changes())
+        stored.update(writer.pop_changes())
+        return stored
+
+    def test_chunks(self):
+        values = np.random.randn(3000)
+        stored = self._write(values)
+        index = stored['index/s']
+        assert index['count'] == 3000
+        assert 'chunk/s/0/00000002' in stored
+        assert 'chunk/s/0/00000003' not in stored
+        series = timeseries.read_series(index, 's', stored.__getitem__)
+        assert np.array_equal(series['value'], values)
+        assert np.array_equal(series['step'], np.arange(3000))
+        assert np.array_equal(series['walltime'], 0.5 * np.arange(3000))
+
+    @pytest.mark.parametrize('level', [1, 2, 3])
+    def test_pyramid(self, level):
+        values = np.random.randn(5000)
+        stored = self._write(values)
+        index = stored['index/s']
+        summary = timeseries.read_series(index, 's', stored.__getitem__, level)
+        bucket = timeseries.FACTOR ** level
+        num_buckets = -(-5000 // bucket)
+        padded = np.full(num_buckets * bucket, np.nan)
+        padded[:5000] = values
+        padded = padded.reshape(num_buckets, bucket)
+        assert np.array_equal(summary['step'], np.arange(0, 5000, bucket))
+        assert np.allclose(summary['min'], np.nanmin(padded, 1))
+        assert np.allclose(summary['max'], np.nanmax(padded, 1))
+        assert np.allclose(summary['mean'], np.nanmean(padded, 1))
+        assert summary['count'].sum() == 5000
+
+    def test_resume_writer(self):
+        values = np.random.randn(2500)
+        stored = self._write(values[:1500])
+        writer = timeseries.SeriesWriter('s', stored['index/s'], stored.__getitem__)
+        for i, val in enumerate(values[1500:], 1500):
+            writer.append(i, 0.5 * i, val)
+        stored.update(writer.pop_changes())
+        index = stored['index/s']
+        series = timeseries.read_series(index, 's', stored.__getitem__)
+        assert np.array_equal(series['value'], values)
+        summary = timeseries.read_series(index, 's', stored.__getitem__, 2)
+        assert np.allclose(summary['mean'][0], values[:256].mean())
@@ -0,0 +1,226 @@
+import os
+import pytest
+import torch
+import boardom as bd
+from boardom.components.log_buffer import LogBuffer
+from boardom.components.logger import AverageTracker
+
+
+def _read_csv(directory, name):
+    with open(os.path.join(directory, f'{name}.csv')) as f:
+        return f.read().splitlines()
+
+
+def _read_scalars(directory):
+    from tensorboard.backend.event_processing.event_accumulator import (
+        EventAccumulator,
+    )
+
+    acc = EventAccumulator(str(directory))
+    acc.Reload()
+    return {
+        tag: [(x.step, x.value) for x in acc.Scalars(tag)]
+        for tag in acc.Tags()['scalars']
+    }
+
+
+class TestLogBuffer:
+    def test_flush_every(self):
+        written = []
+        buffer = LogBuffer(written.append, flush_every=3)
+        for i in range(7):
+            buffer.add({'a': torch.tensor(float(i)), 'b': i}, info=i)
+        buffer.flush(wait=False)
+        buffer.flush(wait=True)
+        assert [len(x) for x in written] == [3, 3, 1]
+        rows = [row for rows in written for row in rows]
+        assert [info for info, _, _ in rows] == list(range(7))
+        assert [values for _, _, values in rows] == [
+            {'a': float(i), 'b': i} for i in range(7)
+        ]
+        assert all(isinstance(v['a'], float) for _, _, v in rows)
+
+    def test_flush_interval(self):
+        written = []
+        buffer = LogBuffer(written.append, flush_interval=3600)
+        for i in range(5):
+            buffer.add({'a': i})
+        assert len(buffer) == 5
+        buffer.flush_interval = 0
+        buffer.add({'a': 5})
+        buffer.flush(wait=True)
+        assert len(buffer) == 0
+        assert [len(x) for x in written] == [6]
+
+    def test_values_are_detached(self):
+        x = torch.ones((), requires_grad=True)
+        buffer = LogBuffer(lambda rows: None, flush_every=10)
+        buffer.add({'a': x * 2})
+        assert not buffer._rows[0][2]['a'].requires_grad
+
+    def test_write_errors_are_raised(self):
+        def write_fn(rows):
+            raise IOError('disk full')
+
+        buffer = LogBuffer(write_fn, flush_every=1)
+        buffer.add({'a': 1})
+        with pytest.raises(IOError):
+            buffer.flush(wait=True)
+
+
+class TestAverageTracker:
+    def test_weighted_averages(self):
+        eng = bd.Engine()
+        tracker = AverageTracker(eng, 'size', None)
+        data = [(2, 1.0, 3), (1, 4.0, 5), (3, 2.0, 1)]
+        for size, a, b in data:
+            eng.size = size
+            tracker.update({'a': torch.tensor(a), 'b': b})
+        total = sum(x[0] for x in data)
+        expected_a = sum(s * a for s, a, _ in data) / total
+        expected_b = sum(s * b for s, _, b in data) / total
+        assert tracker.get() == pytest.approx({'a': expected_a, 'b': expected_b})
+
+    def test_fields_can_be_missing(self):
+        tracker = AverageTracker(None, None, ['a', 'b'])
+        tracker.update({'a': 1.0, 'c': 5.0})
+        tracker.update({'a': 3.0})
+        assert tracker.get() == {'a': 2.0}
+        tracker.update({'b': torch.tensor(4.0)})
+        assert tracker.get() == {'a': 2.0, 'b': 4.0}
+        tracker.reset()
+        assert tracker.get() == {}
+        tracker.update({'b': 1})
+        assert tracker.get() == {'b': 1.0}
+
+    def test_values_are_detached(self):
+        tracker = AverageTracker(None, None, None)
+        x = torch.ones((), requires_grad=True)
+        tracker.update({'a': x * 2, 'b': torch.tensor([3])})
+        assert not tracker._stats.requires_grad
+        assert tracker.get() == {'a': 2.0, 'b': 3.0}
+
+    def test_batches_are_averaged(self):
+        tracker = AverageTracker(None, None, None)
+        tracker.update({'a': torch.tensor([1.0, 3.0]), 'b': 1})
+        tracker.update({'a': torch.tensor(4.0), 'b': 2})
+        assert tracker.get() == {'a': 3.0, 'b': 1.5}
+
+    @pytest.mark.parametrize('unbiased', [False, True])
+    def test_variance(self, unbiased):
+        torch.manual_seed(0)
+        values = torch.randn(20, 3) * torch.tensor([1.0, 10.0, 0.1]) + 5
+        tracker = AverageTracker(None, None, None, variance=True)
+        for row in values:
+            tracker.update({'a': row[0], 'b': row[1], 'c': float(row[2])})
+        means = values.double().mean(0).tolist()
+        variances = values.double().var(0, unbiased=unbiased).tolist()
+        assert tracker.get() == pytest.approx(dict(zip('abc', means)))
+        assert tracker.get_variances(unbiased) == pytest.approx(
+            dict(zip('abc', variances))
+        )
+
+    def test_weighted_variance(self):
+        eng = bd.Engine()
+        tracker = AverageTracker(eng, 'size', None, variance=True)
+        for size, x in [(1, 1.0), (2, 4.0), (1, 7.0)]:
+            eng.size = size
+            tracker.update({'a': x})
+        expanded = torch.tensor([1.0, 4.0, 4.0, 7.0], dtype=torch.float64)
+        assert tracker.get()['a'] == pytest.approx(expanded.mean().item())
+        assert tracker.get_variances()['a'] == pytest.approx(
+            expanded.var(unbiased=False).item()
+        )
+
+    def test_variance_must_be_tracked(self):
+        tracker = AverageTracker(None, None, None)
+        tracker.update({'a': 1})
+        with pytest.raises(RuntimeError):
+            tracker.get_variances()
+
+
+class TestLoggerEngine:
+    @pytest.mark.parametrize('flush_every', [None, 4])
+    def test_csv_logger(self, tmp_path, flush_every):
+        eng = bd.LoggerEngine()
+        eng.losses = {}
+        eng.loggers.losses = eng.setup_csv_logger(
+            'losses', ['a', 'b'], directory=tmp_path, flush_every=flush_every
+        )
+        for i in range(6):
+            eng.losses = {'a': torch.tensor(i + 0.5), 'b': i}
+            eng.log()
+        eng.flush_loggers()
+        lines = _read_csv(tmp_path, 'losses')
+        assert lines == ['a,b'] + [f'{i + 0.5},{i}' for i in range(6)]
+
+    def test_buffered_csv_logger_averages(self, tmp_path):
+        eng = bd.LoggerEngine()
+        logger = eng.setup_csv_logger(
+            'losses', ['a'], directory=tmp_path, flush_every=10
+        )
+        logger.track_averages()
+        eng.loggers.losses = logger
+        for i in range(4):
+            logger.update_averages({'a': i})
+            logger.log({'a': i})
+        eng.log_averages()
+        eng.event('training_end')
+        assert _read_csv(tmp_path, 'losses') == ['a', '0', '1', '2', '3']
+        assert _read_csv(tmp_path, 'losses_average') == ['a', '1.5']
+
+    def test_log_variances(self, tmp_path):
+        eng = bd.LoggerEngine()
+        logger = eng.setup_csv_logger('losses', ['a'], directory=tmp_path)
+        logger.track_averages(variance=True)
+        eng.loggers.losses = logger
+        for i in range(4):
+            logger.update_averages({'a': torch.tensor(float(i))})
+        eng.log_averages()
+        assert _read_csv(tmp_path, 'losses_average') == ['a', '1.5']
+        assert _read_csv(tmp_path, 'losses_variance') == ['a', '1.25']
+
+    def test_log_meters(self, tmp_path):
+        eng = bd.LoggerEngine()
+        logger = eng.setup_csv_logger('losses', ['a'], directory=tmp_path)
+        logger.track_averages(
+            meters={
+                'ema': lambda: bd.EMA(0.5),
+                'quantiles': lambda: bd.LogHistogram(quantiles=(0.0, 1.0)),
+            }
+        )
+        eng.loggers.losses = logger
+        logger.update_averages({'a': torch.tensor([1.0, 3.0])})
+        logger.update_averages({'a': 2.0})
+        eng.log_averages()
+        assert _read_csv(tmp_path, 'losses_average') == ['a', '2.0']
+        ema = float(_read_csv(tmp_path, 'losses_ema')[1])
+        assert ema == pytest.approx(((0.25 * 1 + 0.5 * 3) * 0.5 + 0.5 * 2) / 0.875)
+        assert _read_csv(tmp_path, 'losses_quantiles_p0') == ['a', '1.0']
+        assert _read_csv(tmp_path, 'losses_quantiles_p100') == ['a', '3.0']
+        eng.reset_averages()
+        assert logger._trackers['ema'].get() == {}
+
+    def test_reserved_meter_names(self):
+        eng = bd.LoggerEngine()
+        logger = eng.setup_csv_logger('losses', ['a'], directory='.')
+        with pytest.raises(RuntimeError):
+            logger.track_averages(meters={'variance': bd.EMA})
+
+    @pytest.mark.parametrize('flush_every', [None, 4])
+    def test_tensorboard_logger(self, tmp_path, flush_every):
+        eng = bd.LoggerEngine()
+        eng.loggers.losses = eng.setup_tensorboard_logger(
+            'losses', 'step', directory=tmp_path, flush_every=flush_every
+        )
+        for i in range(6):
+            eng.step = i
+            eng.losses = {'a': torch.tensor(float(i)), 'b': 2.0 * i}
+            eng.log()
+        eng.flush_loggers()
+        eng.tensorboard.flush()
+        scalars = _read_scalars(tmp_path)
+        assert scalars == {
+            'plots/losses.a': [(i, float(i)) for i in range(6)],
+            'plots/losses.b': [(i, 2.0 * i) for i in range(6)],
+        }
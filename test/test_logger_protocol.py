@@ -0,0 +1,165 @@
+import json
+import asyncio
+import numpy as np
+import torch
+import aiohttp
+from aiohttp import web
+import boardom as bd
+from boardom.io.boardom_logger.coalescing import XYBatcher, batch_arrays
+from boardom.io.boardom_logger.subprocess import _LoggerSubprocess
+from boardom.board.server.socket_manager import SocketManager, EngineMixin
+from boardom.board.server.datastore import datastore
+
+
+def _batch():
+    batcher = XYBatcher()
+    for i in range(4):
+        batcher.add(i, 0.5 * i, 'loss', 1000 + i)
+    batcher.add('a', 'b', 'text', 0)
+    return batcher.pop()
+
+
+class TestArraySerialization:
+    def test_arrays_roundtrip(self):
+        arrays = [
+            np.arange(12, dtype=np.float32).reshape(3, 4),
+            np.arange(5, dtype=np.int64)[::2],
+            np.zeros((0, 2), dtype=np.uint8),
+            np.array([True, False]),
+        ]
+        for array in arrays:
+            unpacked = bd.unpack(bd.pack({'a': array}))['a']
+            assert unpacked.dtype == array.dtype
+            assert np.array_equal(unpacked, array)
+
+    def test_tensors_and_scalars(self):
+        unpacked = bd.unpack(bd.pack([torch.arange(3.0), np.int64(2)]))
+        assert np.array_equal(unpacked[0], np.arange(3.0, dtype=np.float32))
+        assert unpacked[1] == 2
+
+    def test_batch_arrays(self):
+        task = _batch()
+        packed = batch_arrays(task)
+        loss, text = packed['payload']['series']
+        assert loss['x'].dtype == np.int64
+        assert loss['y'].dtype == np.float64
+        assert np.array_equal(loss['time'], np.arange(1000, 1004))
+        assert text['x'] == ['a']
+        # The task is not modified
+        assert task['payload']['series'][0]['x'] == [0, 1, 2, 3]
+
+
+class _WS:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, task):
+        self.sent.append(('json', task))
+
+    async def send_bytes(self, data):
+        self.sent.append(('bytes', data))
+
+
+class TestSubprocessProtocol:
+    def test_send_to_ws(self):
+        sub = _LoggerSubprocess.__new__(_LoggerSubprocess)
+        sub.ws = _WS()
+        sub.ws_protocol = 'json'
+        asyncio.run(sub.send_to_ws({'type': 'A'}))
+        asyncio.run(sub.server_ws_protocol({'payload': 'msgpack'}))
+        asyncio.run(sub.send_to_ws(_batch()))
+        (kind_a, task_a), (kind_b, data) = sub.ws.sent
+        assert (kind_a, task_a) == ('json', {'type': 'A'})
+        assert kind_b == 'bytes'
+        series = bd.unpack(data)['payload']['series']
+        assert np.array_equal(series[0]['y'], 0.5 * np.arange(4))
+
+
+async def _engine_roundtrip():
+    app = web.Application()
+    app.router.add_get('/engine_socket', SocketManager.engine_socket)
+    app.router.add_get('/front_socket', SocketManager.front_socket)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f'http://127.0.0.1:{port}'
+    try:
+        async with aiohttp.ClientSession() as session:
+            front = await session.ws_connect(f'{url}/front_socket')
+            for _ in range(3):  # connection id, process list, cfg store
+                await front.receive_json()
+            engine = await session.ws_connect(f'{url}/engine_socket')
+            assert (await engine.receive_json())['type'] == 'WS_CONNECTION_ID'
+            await engine.send_json(
+                {
+                    'type': 'ENGINE_HANDSHAKE',
+                    'payload': {'process_id': 'pid', 'protocols': ['msgpack']},
+                }
+            )
+            protocol = await engine.receive()
+            assert protocol.type == aiohttp.WSMsgType.TEXT
+            assert json.loads(protocol.data)['payload'] == 'msgpack'
+            request = await engine.receive()
+            assert request.type == aiohttp.WSMsgType.BINARY
+            assert bd.unpack(request.data)['type'] == 'REQUEST_CFG_STORE'
+            assert (await front.receive_json())['type'] == 'UPDATE_PROCESS_INFO'
+
+            task = _batch()
+            task['payload']['series'] = task['payload']['series'][:1]
+            series = task['payload']['series'][0]
+            series.update(plot_id='p', x_id='x', y_id='y')
+            await engine.send_bytes(bd.pack(batch_arrays(task)))
+            received = [await front.receive_json() for _ in range(9)]
+            await engine.close()
+            await front.close()
+        return received
+    finally:
+        await runner.cleanup()
+
+
+class TestServerProtocol:
+    def test_msgpack_engine_and_json_front(self):
+        datastore.store = {
+            'cfg': {},
+            'data': {'ids': {}},
+            'visualisations': {'ids': {}},
+            'processes': {},
+        }
+        try:
+            received = asyncio.run(_engine_roundtrip())
+        finally:
+            del datastore.store
+        data = [t['payload'] for t in received if t['type'] == 'RECEIVED_NEW_DATA']
+        assert [d['datapoint'] for d in data if d['dataId'] == 'y'] == [
+            0.0,
+            0.5,
+            1.0,
+            1.5,
+        ]
+        assert [d['datapoint'] for d in data if d['dataId'] == 'x'] == [0, 1, 2, 3]
+        assert received[-1]['type'] == 'PLOT_XY_SCATTER'
+
+    def test_empty_series_are_skipped(self, monkeypatch):
+        broadcast = []
+
+        class _Engine(EngineMixin):
+            process_id = 'pid'
+
+            async def broadcast_to_all_fronts(self, task):
+                broadcast.append(task)
+
+        def add_xy_data(payload, process_id):
+            return {'type': 'PLOT_XY_SCATTER', 'name': payload['name']}, []
+
+        monkeypatch.setattr(datastore, 'add_xy_data', add_xy_data, raising=False)
+        empty = {'x': [], 'y': [], 'time': []}
+        series = [
+            {'name': 'a', **empty},
+            {'name': 'b', 'x': [1], 'y': [2], 'time': [3]},
+            {'name': 'c', **empty},
+        ]
+        task = {'type': 'PLOT_XY_SCATTER_BATCH', 'payload': {'series': series}}
+        asyncio.run(_Engine().plot_xy_scatter_batch(task))
+        assert [t['name'] for t in broadcast] == ['b']
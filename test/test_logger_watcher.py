@@ -0,0 +1,119 @@
+import time
+import zmq
+import pytest
+import boardom as bd
+from boardom.io.boardom_logger.serialization import MsgpackContext
+from boardom.io.boardom_logger.coalescing import BATCH_TYPE
+
+
+class _Child:
+    def __init__(self):
+        self.sent = []
+
+    def send_msgpack(self, task):
+        self.sent.append(task)
+
+
+def _task(name, **meta):
+    return {'type': name, 'payload': None, 'meta': meta}
+
+
+def _wait_for(condition, timeout=2.0):
+    start = time.monotonic()
+    while not condition():
+        if time.monotonic() - start > timeout:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+# A started logger (without the subprocess) and the socket of the child
+@pytest.fixture
+def logger():
+    ctx = MsgpackContext()
+    child = ctx.socket(zmq.PAIR)
+    child.bind('inproc://boardom_logger_watcher')
+    logger = bd.BoardomLogger.__new__(bd.BoardomLogger)
+    logger.__init__()
+    logger._started = True
+    logger.to_child = _Child()
+    logger.from_child = ctx.socket(zmq.PAIR)
+    logger.from_child.connect('inproc://boardom_logger_watcher')
+    logger._start_child_watcher()
+    logger.child = child
+    yield logger
+    if logger._watcher.is_alive():
+        logger._stop_child_watcher()
+    logger.from_child.close()
+    child.close()
+    ctx.term()
+
+
+class TestChildWatcher:
+    def test_passive_tasks_are_dispatched(self, logger):
+        handled = []
+        logger._handle_ping = handled.append
+        start = time.monotonic()
+        logger.child.send_msgpack(_task('PING', passive=True))
+        assert _wait_for(lambda: handled)
+        assert time.monotonic() - start < 0.5
+        assert handled[0]['type'] == 'PING'
+
+    def test_synced_tasks_wait_for_synchronize(self, logger):
+        handled = []
+        logger._handle_sync = handled.append
+        logger._handle_ping = handled.append
+        logger.child.send_msgpack(_task('SYNC', needs_sync=True))
+        logger.child.send_msgpack(_task('PING', passive=True))
+        assert _wait_for(lambda: handled)
+        assert [t['type'] for t in handled] == ['PING']
+        logger.synchronize()
+        assert [t['type'] for t in handled] == ['PING', 'SYNC']
+        assert logger._queued_tasks == []
+
+    def test_synchronize_receives_sent_messages(self, logger):
+        handled = []
+        logger._handle_sync = handled.append
+        for i in range(50):
+            logger.child.send_msgpack(_task('SYNC', needs_sync=True))
+        logger.synchronize()
+        assert len(handled) == 50
+        logger._stop_child_watcher()
+        logger.child.send_msgpack(_task('SYNC', needs_sync=True))
+        logger.synchronize()
+        assert len(handled) == 51
+
+    def test_handlers_run_without_the_lock(self, logger):
+        handled = []
+
+        def handler(task):
+            # Would deadlock if the watcher held the task lock
+            logger.synchronize()
+            handled.append(task)
+
+        logger._handle_ping = handler
+        logger.child.send_msgpack(_task('PING', passive=True))
+        assert _wait_for(lambda: handled)
+
+    def test_pending_points_are_flushed(self, logger):
+        logger._xy_batcher.interval = 0.02
+        logger.plot_xy(1, 2, 'loss')
+        assert logger.to_child.sent == []
+        assert _wait_for(lambda: logger.to_child.sent)
+        assert logger.to_child.sent[0]['type'] == BATCH_TYPE
+
+    def test_stop_wakes_the_watcher(self, logger):
+        start = time.monotonic()
+        logger._stop_child_watcher()
+        assert not logger._watcher.is_alive()
+        assert time.monotonic() - start < 0.5
+        # Waking a stopped watcher is a no-op
+        logger._wake_watcher()
+
+    def test_idle_watcher_does_not_spin(self, logger):
+        if not hasattr(time, 'pthread_getcpuclockid'):
+            pytest.skip('Thread CPU time is not available')
+        clock = time.pthread_getcpuclockid(logger._watcher.ident)
+        cpu_start = time.clock_gettime(clock)
+        time.sleep(0.2)
+        assert time.clock_gettime(clock) - cpu_start < 0.01
@@ -0,0 +1,89 @@
+import math
+import pytest
+import torch
+import boardom as bd
+
+
+class TestEMA:
+    def test_matches_sequential_updates(self):
+        values = torch.rand(50, dtype=torch.float64)
+        batched, sequential = bd.EMA(0.9), bd.EMA(0.9)
+        batched.add(values[:20])
+        batched.add(values[20:])
+        value, weight = 0.0, 0.0
+        for x in values.tolist():
+            sequential.add(x)
+            value = 0.9 * value + 0.1 * x
+            weight = 0.9 * weight + 0.1
+        assert batched.get() == pytest.approx(value / weight)
+        assert sequential.get() == pytest.approx(value / weight)
+
+    def test_is_bias_corrected(self):
+        ema = bd.EMA(0.99)
+        assert ema.get() is None
+        ema.add(torch.full((3,), 2.0))
+        assert ema.get() == pytest.approx(2.0)
+        ema.reset()
+        assert ema.get() is None
+
+    def test_merge(self):
+        a, b = bd.EMA(0.9), bd.EMA(0.9)
+        a.add(torch.ones(100))
+        b.add(torch.full((100,), 3.0))
+        a.merge(b)
+        assert a.get() == pytest.approx(2.0)
+        a.merge(bd.EMA(0.9))
+        assert a.get() == pytest.approx(2.0)
+
+    def test_invalid_decay(self):
+        with pytest.raises(ValueError):
+            bd.EMA(1.0)
+
+
+class TestLogHistogram:
+    def test_quantiles(self):
+        torch.manual_seed(0)
+        values = torch.distributions.LogNormal(0, 2).sample((20000,))
+        hist = bd.LogHistogram(quantiles=(0.1, 0.5, 0.99))
+        for chunk in values.split(1000):
+            hist.add(chunk)
+        assert hist.count == len(values)
+        q = torch.tensor([0.1, 0.5, 0.99], dtype=torch.float64)
+        expected = values.double().quantile(q).tolist()
+        result = hist.get()
+        assert list(result) == ['p10', 'p50', 'p99']
+        for val, exp in zip(result.values(), expected):
+            assert val == pytest.approx(exp, rel=0.13)
+        assert hist.quantile(0) == values.min().item()
+        assert hist.quantile(1) == values.max().item()
+
+    def test_out_of_range_values(self):
+        hist = bd.LogHistogram(min_value=1, max_value=100)
+        hist.add([-5.0, 0.0, 50.0, 1000.0])
+        assert hist.counts[0] == 2
+        assert hist.counts[-1] == 1
+        assert hist.quantile(0) == -5.0
+        assert hist.quantile(1) == 1000.0
+
+    def test_memory_is_bounded(self):
+        hist = bd.LogHistogram(min_value=1e-3, max_value=1e3, bins_per_decade=10)
+        size = len(hist.counts)
+        hist.add(torch.rand(10000) * 100)
+        assert len(hist.counts) == size == 6 * 10 + 2
+
+    def test_merge(self):
+        values = torch.rand(1000) + 0.5
+        full, a, b = bd.LogHistogram(), bd.LogHistogram(), bd.LogHistogram()
+        full.add(values)
+        a.add(values[:300])
+        b.add(values[300:])
+        a.merge(b)
+        assert torch.equal(a.counts, full.counts)
+        assert a.get() == full.get()
+        with pytest.raises(ValueError):
+            a.merge(bd.LogHistogram(bins_per_decade=5))
+
+    def test_empty(self):
+        hist = bd.LogHistogram(quantiles=(0.5,))
+        assert hist.get() == {'p50': None}
+        assert not math.isfinite(hist.min)
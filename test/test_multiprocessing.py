@@ -0,0 +1,359 @@
+import gc
+import time
+import queue
+import asyncio
+import threading
+import functools
+import multiprocessing
+from collections import namedtuple
+import numpy as np
+import torch
+import pytest
+from boardom.multiprocessing import PersistentProcessPool
+from boardom.multiprocessing import shared_results
+from boardom.multiprocessing.shared_results import (
+    SharedRef,
+    SharedResultWriter,
+    SharedResultReader,
+)
+from boardom.multiprocessing.waiting import NotifyingQueue, get_async
+from boardom.multiprocessing.scheduling import ChunkSizer
+
+Pair = namedtuple('Pair', ['first', 'second'])
+
+
+def _make_result(value):
+    return {
+        'array': np.full((64, 64, 3), value, dtype=np.float32),
+        'tensor': torch.full((128, 128), value, dtype=torch.float64),
+        'pair': Pair(torch.arange(10), [np.ones(3), 'name']),
+        'value': value,
+    }
+
+
+def _strided_result():
+    return [np.array(3.0), np.ones((256, 256, 3), np.float32)[..., ::-1]]
+
+
+def _fail():
+    raise ValueError('Failed in worker')
+
+
+def _identity(value):
+    return value
+
+
+def _sleep_and_return(value, seconds):
+    time.sleep(seconds)
+    return value
+
+
+def _fail_on(value, bad):
+    if value == bad:
+        raise ValueError(f'Failed on {value}')
+    return value
+
+
+def _put_later(q, item, delay=0.05):
+    def _put():
+        time.sleep(delay)
+        q.put(item)
+
+    thread = threading.Thread(target=_put)
+    thread.start()
+    return thread
+
+
+class TestChunkSizer:
+    def test_fixed_size(self):
+        sizer = ChunkSizer(8)
+        sizer.update(8, 10.0)
+        assert sizer.size == 8
+        with pytest.raises(ValueError):
+            ChunkSizer(0)
+
+    def test_tuned_size(self):
+        sizer = ChunkSizer(target_time=0.01, max_chunk_size=100)
+        assert sizer.size == 1
+        sizer.update(1, 0.001)
+        assert sizer.size == 10
+        sizer.update(10, 0.0)
+        assert 10 < sizer.size <= 100
+        for _ in range(20):
+            sizer.update(sizer.size, 0.0)
+        assert sizer.size == 100
+        for _ in range(20):
+            sizer.update(sizer.size, sizer.size * 1.0)
+        assert sizer.size == 1
+
+
+class TestWaiting:
+    def test_notifying_queue(self):
+        q = NotifyingQueue()
+        thread = _put_later(q, 'item')
+        assert asyncio.run(get_async(q, timeout=5)) == 'item'
+        thread.join()
+        q.put(1)
+        q.put(2)
+        assert asyncio.run(get_async(q)) == 1
+        assert q.get_nowait() == 2
+        with pytest.raises(queue.Empty):
+            asyncio.run(get_async(q, timeout=0.01))
+        q.close()
+
+    def test_multiprocessing_queue(self):
+        q = multiprocessing.Queue()
+        thread = _put_later(q, 'item')
+        assert asyncio.run(get_async(q, timeout=5)) == 'item'
+        thread.join()
+        with pytest.raises(queue.Empty):
+            asyncio.run(get_async(q, timeout=0.01))
+        q.close()
+
+
+class TestSharedResults:
+    def _transport(self, **kwargs):
+        free_queue = queue.Queue()
+        writer = SharedResultWriter(free_queue, min_nbytes=1024, **kwargs)
+        reader = SharedResultReader([free_queue])
+        return writer, reader, free_queue
+
+    def test_roundtrip(self):
+        writer, reader, _ = self._transport()
+        packed = writer.pack(_make_result(3))
+        assert isinstance(packed['array'], SharedRef)
+        assert isinstance(packed['tensor'], SharedRef)
+        # Small arrays and tensors are not shared
+        assert isinstance(packed['pair'].first, torch.Tensor)
+        assert isinstance(packed['pair'].second[0], np.ndarray)
+        result = reader.unpack(packed, 0)
+        assert isinstance(result['array'], np.ndarray)
+        assert result['array'].dtype == np.float32
+        assert result['array'].shape == (64, 64, 3)
+        assert (result['array'] == 3).all()
+        assert isinstance(result['tensor'], torch.Tensor)
+        assert result['tensor'].dtype == torch.float64
+        assert (result['tensor'] == 3).all()
+        assert isinstance(result['pair'], Pair)
+        assert result['pair'].second[1] == 'name'
+        assert result['value'] == 3
+        del result
+        reader.close()
+        writer.close()
+
+    def test_non_contiguous_and_unsupported(self):
+        writer, reader, _ = self._transport()
+        tensor = torch.arange(4096, dtype=torch.float32).reshape(64, 64).t()
+        objects = np.array([object()] * 1024)
+        param = torch.zeros(4096, requires_grad=True)
+        packed = writer.pack([tensor, objects, param])
+        assert isinstance(packed[0], SharedRef)
+        assert packed[1] is objects
+        assert packed[2] is param
+        result = reader.unpack(packed, 0)
+        assert torch.equal(result[0], tensor)
+        del result
+        reader.close()
+        writer.close()
+
+    def test_zero_dim_and_negative_strides(self):
+        writer, reader, _ = self._transport(max_slots=1)
+        scalar = np.array(3.0)
+        flipped = np.arange(1024, dtype=np.float32)[::-1]
+        swapped = np.arange(1024, dtype='>f4')
+        packed = writer.pack([scalar, flipped, swapped])
+        assert packed[0] is scalar
+        assert isinstance(packed[1], SharedRef)
+        # Non-native byte order is not supported by torch
+        assert packed[2] is swapped
+        result = reader.unpack(packed, 0)
+        assert np.array_equal(result[1], flipped)
+        del result
+        gc.collect()
+        # The slot was released
+        assert isinstance(writer.pack(flipped), SharedRef)
+        reader.close()
+        writer.close()
+
+    def test_failed_copy_frees_the_slot(self):
+        writer, reader, _ = self._transport(max_slots=1)
+        tensor = torch.zeros(1024)
+
+        def _fail_copy(*args):
+            raise RuntimeError('Copy failed')
+
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr(shared_results, '_copy_to', _fail_copy)
+            with pytest.raises(RuntimeError, match='Copy failed'):
+                writer.pack(tensor)
+        assert writer.free == {0}
+        assert isinstance(writer.pack(tensor), SharedRef)
+        reader.close()
+        writer.close()
+
+    def test_slots_are_reused_when_released(self):
+        writer, reader, free_queue = self._transport(max_slots=2)
+        result = reader.unpack(writer.pack(_make_result(1)), 0)
+        assert len(writer.slots) == 2
+        assert free_queue.empty()
+        # Views keep the slots in use
+        view = result['tensor'][0]
+        del result
+        gc.collect()
+        assert free_queue.qsize() == 1
+        # No free slot for the tensor, so it is sent as is
+        packed = writer.pack(_make_result(2))
+        assert isinstance(packed['array'], SharedRef)
+        assert isinstance(packed['tensor'], torch.Tensor)
+        result = reader.unpack(packed, 0)
+        assert (result['array'] == 2).all()
+        assert (view == 1).all()
+        del view, packed, result
+        gc.collect()
+        packed = writer.pack(_make_result(4))
+        assert len(writer.slots) == 2
+        assert isinstance(packed['tensor'], SharedRef)
+        result = reader.unpack(packed, 0)
+        assert (result['array'] == 4).all()
+        assert (result['tensor'] == 4).all()
+        del result
+        reader.close()
+        writer.close()
+
+    def test_free_slots_grow(self):
+        writer, reader, _ = self._transport(max_slots=1)
+        result = reader.unpack(writer.pack(np.zeros(1024, dtype=np.uint8)), 0)
+        name = writer.slots[0].name
+        del result
+        gc.collect()
+        result = reader.unpack(writer.pack(np.ones(8192, dtype=np.uint8)), 0)
+        assert writer.slots[0].name != name
+        assert writer.slots[0].size >= 8192
+        assert (result == 1).all()
+        del result
+        reader.close()
+        writer.close()
+
+
+class TestPersistentProcessPool:
+    @pytest.mark.parametrize('shared_memory', [False, True])
+    def test_run(self, shared_memory):
+        pool = PersistentProcessPool(num_workers=2, shared_memory=shared_memory)
+        try:
+            for _ in range(3):
+                results = pool.run(
+                    *[functools.partial(_make_result, i) for i in range(4)]
+                )
+                for i, result in enumerate(results):
+                    assert result['value'] == i
+                    assert (result['array'] == i).all()
+                    assert (result['tensor'] == i).all()
+                    assert torch.equal(result['pair'].first, torch.arange(10))
+                del results, result
+                gc.collect()
+        finally:
+            pool._shutdown_workers()
+
+    @pytest.mark.parametrize('shared_memory', [False, True])
+    def test_strided_results(self, shared_memory):
+        pool = PersistentProcessPool(num_workers=1, shared_memory=shared_memory)
+        try:
+            scalar, flipped = pool.run(_strided_result)[0]
+            assert scalar == 3.0
+            assert flipped.shape == (256, 256, 3)
+            assert (flipped == 1).all()
+            del flipped
+        finally:
+            pool._shutdown_workers()
+
+    @pytest.mark.parametrize('shared_memory', [False, True])
+    def test_worker_exception(self, shared_memory):
+        pool = PersistentProcessPool(num_workers=1, shared_memory=shared_memory)
+        try:
+            with pytest.raises(ValueError, match='Failed in worker'):
+                pool.run(_fail)
+        finally:
+            pool._shutdown_workers()
+
+    def test_tasks_wait_for_available_workers(self):
+        pool = PersistentProcessPool(num_workers=2)
+        try:
+            funcs = [functools.partial(_identity, i) for i in range(100)]
+            assert pool.run(*funcs) == list(range(100))
+            assert not pool._worker_waiters
+            worker_id = pool._put(functools.partial(_identity, 'sync'))
+            assert pool._get(worker_id) == 'sync'
+        finally:
+            pool._shutdown_workers()
+
+    @pytest.mark.parametrize('chunk_size', [None, 1, 7])
+    def test_imap_ordered(self, chunk_size):
+        pool = PersistentProcessPool(num_workers=2)
+        try:
+            funcs = (functools.partial(_identity, i) for i in range(500))
+            results = list(pool.imap(funcs, chunk_size=chunk_size))
+            assert results == list(range(500))
+            funcs = [functools.partial(_identity, i) for i in range(50)]
+            assert pool.run(*funcs, chunk_size=chunk_size) == list(range(50))
+        finally:
+            pool._shutdown_workers()
+
+    def test_imap_unordered(self):
+        pool = PersistentProcessPool(num_workers=2)
+        try:
+            # The first task is the slowest
+            funcs = [
+                functools.partial(_sleep_and_return, i, 0.3 if i == 0 else 0)
+                for i in range(4)
+            ]
+            results = list(pool.imap(funcs, ordered=False, chunk_size=1))
+            assert sorted(results) == list(range(4))
+            assert results[-1] == 0
+        finally:
+            pool._shutdown_workers()
+
+    def test_imap_async(self):
+        pool = PersistentProcessPool(num_workers=2)
+
+        async def _collect():
+            funcs = (functools.partial(_identity, i) for i in range(100))
+            return [r async for r in pool.imap_async(funcs)]
+
+        try:
+            assert asyncio.run(_collect()) == list(range(100))
+        finally:
+            pool._shutdown_workers()
+
+    def test_imap_backpressure(self):
+        pool = PersistentProcessPool(num_workers=2)
+        consumed = []
+
+        def _funcs():
+            for i in range(10 ** 9):
+                consumed.append(i)
+                yield functools.partial(_identity, i)
+
+        try:
+            results = pool.imap(_funcs(), chunk_size=2, max_in_flight=3)
+            for i, result in enumerate(results):
+                assert result == i
+                assert len(consumed) <= i + 1 + 3 * 2
+                if i == 100:
+                    break
+            results.close()
+            # All workers were released
+            assert pool.run(functools.partial(_identity, 1)) == [1]
+            assert pool._available_worker_queue.qsize() == 2
+        finally:
+            pool._shutdown_workers()
+
+    def test_imap_exception(self):
+        pool = PersistentProcessPool(num_workers=2)
+        try:
+            funcs = [functools.partial(_fail_on, i, 13) for i in range(50)]
+            with pytest.raises(ValueError, match='Failed on 13'):
+                list(pool.imap(funcs, chunk_size=4))
+            assert pool._available_worker_queue.qsize() == 2
+            assert pool.run(*funcs[:10]) == list(range(10))
+        finally:
+            pool._shutdown_workers()
@@ -0,0 +1,280 @@
+import pytest
+import torch
+from torch.utils.data import DataLoader
+import boardom as bd
+
+
+def _make_trainer(directory, dataset, stop_at=None, seen=None):
+    class Trainer(bd.SGDTrainer, bd.Checkpoint):
+        def training_iteration(self):
+            seen.extend(self.datum.training.tolist())
+
+        @bd.on('training_iteration_end')
+        def maybe_stop(self):
+            if self.training.global_step == stop_at:
+                self.save_checkpoint()
+                self.training.should_stop_training = True
+
+    trainer = Trainer()
+    sampler = bd.ResumableSampler(dataset, shuffle=True, seed=3)
+    trainer.data.training = DataLoader(dataset, batch_size=2, sampler=sampler)
+    trainer.attach_checkpointers(directory=directory)
+    return trainer
+
+
+class TestResumeTraining:
+    def test_resumes_mid_epoch(self, tmp_path):
+        dataset = list(range(10))
+        uninterrupted = []
+        _make_trainer(tmp_path / 'a', dataset, seen=uninterrupted).fit(max_epochs=2)
+        assert sorted(uninterrupted[:10]) == dataset
+        assert uninterrupted[:10] != uninterrupted[10:]
+
+        first, second = [], []
+        directory = tmp_path / 'b'
+        _make_trainer(directory, dataset, stop_at=7, seen=first).fit(max_epochs=2)
+        # The stop flag is checked after the next iteration
+        assert first == uninterrupted[:16]
+
+        trainer = _make_trainer(directory, dataset, seen=second)
+        trainer.load_latest()
+        assert trainer.training.epoch == 2
+        assert trainer.training.epoch_step == 2
+        assert trainer.training.global_step == 7
+        trainer.fit(max_epochs=2)
+        assert second == uninterrupted[14:]
+        assert trainer.training.global_step == 10
+
+    def test_skipped_batches_are_not_loaded(self, tmp_path):
+        loaded = []
+
+        class Dataset(torch.utils.data.Dataset):
+            def __len__(self):
+                return 10
+
+            def __getitem__(self, idx):
+                loaded.append(idx)
+                return idx
+
+        seen = []
+        trainer = _make_trainer(tmp_path, Dataset(), seen=seen)
+        trainer.training.epoch_step = 3
+        trainer.fit(max_epochs=1)
+        assert len(seen) == 4
+        assert sorted(loaded) == sorted(seen)
+
+    def test_resumes_without_resumable_sampler(self):
+        seen = []
+
+        class Trainer(bd.SGDTrainer):
+            def training_iteration(self):
+                seen.append(self.datum.training)
+
+        trainer = Trainer()
+        trainer.data.training = list(range(5))
+        trainer.training.epoch_step = 3
+        trainer.fit(max_epochs=2)
+        assert seen == [3, 4, 0, 1, 2, 3, 4]
+
+    def test_fit_again_after_max_epochs(self):
+        seen = []
+
+        class Trainer(bd.SGDTrainer):
+            def training_iteration(self):
+                seen.append(self.datum.training)
+
+        trainer = Trainer()
+        trainer.data.training = list(range(5))
+        trainer.fit(max_epochs=1)
+        assert trainer.training.epoch_step == 0
+        seen.clear()
+        trainer.fit(max_epochs=2)
+        # The last epoch is not resumed at its end
+        assert seen == [0, 1, 2, 3, 4] * 2
+        assert trainer.training.global_step == 15
+
+
+def _make_default_trainer(n=4, lr=0.1, cls=None):
+    class Trainer(cls or bd.DefaultSGDTrainer):
+        pass
+
+    torch.manual_seed(0)
+    trainer = Trainer()
+    trainer.models.main = torch.nn.Sequential(
+        torch.nn.Linear(8, 16), torch.nn.ReLU(), torch.nn.Linear(16, 1)
+    )
+    trainer.criteria.main = torch.nn.MSELoss()
+    trainer.optimizers.main = torch.optim.SGD(trainer.models.main.parameters(), lr=lr)
+    trainer.data.training = [(torch.randn(4, 8), torch.randn(4, 1)) for _ in range(n)]
+    return trainer
+
+
+class TestAmp:
+    def test_autocast_bfloat16_on_cpu(self):
+        dtypes = []
+        trainer = _make_default_trainer().set_amp()
+
+        @bd.on('did_forward')
+        def check(engine):
+            dtypes.append(engine.training.predictions.dtype)
+
+        trainer.register(check)
+        before = trainer.models.main[0].weight.clone()
+        trainer.fit(max_epochs=1)
+        assert dtypes == [torch.bfloat16] * 4
+        assert trainer.models.main[0].weight.dtype == torch.float32
+        assert not torch.equal(before, trainer.models.main[0].weight)
+        assert trainer.training.amp_dtype == torch.bfloat16
+        assert not trainer.grad_scaler.is_enabled()
+        assert trainer.setup_grad_scaler_checkpoints() is None
+
+    def test_autocast_saves_smaller_activations(self):
+        # Bytes of the tensors saved for backward by an iteration
+        def saved_bytes(trainer):
+            saved = []
+
+            def pack(x):
+                saved.append(x.numel() * x.element_size())
+                return x
+
+            trainer.datum.training = trainer.data.training[0]
+            trainer.training.global_step = 1
+            with torch.autograd.graph.saved_tensors_hooks(pack, lambda x: x):
+                trainer.training_iteration()
+            return sum(saved)
+
+        full = saved_bytes(_make_default_trainer())
+        amp = saved_bytes(_make_default_trainer().set_amp())
+        assert amp < full
+
+    def test_disabled_by_default(self, monkeypatch):
+        def _autocast(*args, **kwargs):
+            raise AssertionError('autocast is entered with amp disabled')
+
+        monkeypatch.setattr(torch, 'autocast', _autocast)
+        dtypes = []
+        trainer = _make_default_trainer()
+
+        @bd.on('did_forward')
+        def check(engine):
+            dtypes.append(engine.training.predictions.dtype)
+
+        trainer.register(check)
+        trainer.fit(max_epochs=1)
+        assert dtypes == [torch.float32] * 4
+
+    def test_setup_from_cfg(self):
+        cfg = bd.State({'amp': True, 'amp_dtype': 'bfloat16'})
+        trainer = _make_default_trainer().setup_amp_from_cfg(cfg)
+        assert trainer.training.amp
+        assert trainer.training.amp_dtype == torch.bfloat16
+        trainer.setup_amp_from_cfg(bd.State({'amp': False, 'amp_dtype': 'auto'}))
+        assert not trainer.training.amp
+
+
+def _grads(trainer):
+    return [p.grad.clone() for p in trainer.models.main.parameters()]
+
+
+class TestGradientAccumulation:
+    def test_split_micro_batches(self):
+        batch = {'x': torch.arange(5), 'y': [torch.zeros(5, 2), 'tag']}
+        chunks = bd.split_micro_batches(batch, 2)
+        assert [c['x'].tolist() for c in chunks] == [[0, 1, 2], [3, 4]]
+        assert [c['y'][0].shape[0] for c in chunks] == [3, 2]
+        assert all(c['y'][1] == 'tag' for c in chunks)
+        assert len(bd.split_micro_batches(batch, 10)) == 5
+        merged = bd.merge_micro_batches(chunks)
+        assert merged['x'].tolist() == [0, 1, 2, 3, 4]
+        assert merged['y'][0].shape == (5, 2) and merged['y'][1] == 'tag'
+        with pytest.raises(ValueError):
+            bd.split_micro_batches(batch, 0)
+
+    def test_micro_batches_match_full_batch(self):
+        full = _make_default_trainer(n=1, lr=0.0)
+        full.fit(max_epochs=1)
+        micro = _make_default_trainer(n=1, lr=0.0).use_micro_batches(3)
+        micro.fit(max_epochs=1)
+        for a, b in zip(_grads(full), _grads(micro)):
+            assert torch.allclose(a, b, atol=1e-6)
+
+    def test_events_for_micro_batches(self):
+        events = []
+        trainer = _make_default_trainer(n=2).use_micro_batches(2)
+
+        for name in ['did_micro_forward', 'did_forward', 'did_backward']:
+
+            def listener(engine, name=name):
+                events.append((name, engine.datum.training[0].shape[0]))
+
+            trainer.register(name, listener)
+        trainer.fit(max_epochs=1)
+        assert events == 2 * [
+            ('did_micro_forward', 2),
+            ('did_micro_forward', 2),
+            ('did_forward', 4),
+            ('did_backward', 4),
+        ]
+        assert trainer.datum.get('training', None) is None
+
+    def test_micro_batches_restore_full_batch_values(self):
+        values = []
+        trainer = _make_default_trainer(n=1, lr=0.0).use_micro_batches(3)
+
+        @bd.on('did_forward')
+        def record(engine):
+            values.append((engine.training.predictions, engine.training.losses))
+
+        trainer.register(record)
+        trainer.fit(max_epochs=1)
+        (predictions, loss), = values
+        x, y = trainer.data.training[0]
+        with torch.no_grad():
+            expected = trainer.models.main(x)
+        assert torch.allclose(predictions, expected, atol=1e-6)
+        assert torch.allclose(loss, trainer.criteria.main(expected, y), atol=1e-6)
+
+    def test_do_backward_override_without_arguments(self):
+        calls = []
+
+        class Trainer(bd.DefaultSGDTrainer):
+            def do_backward(self):
+                calls.append(self.training.losses.item())
+                self.training.losses.backward()
+
+        full = _make_default_trainer(n=1, lr=0.0)
+        full.fit(max_epochs=1)
+        trainer = _make_default_trainer(n=1, lr=0.0, cls=Trainer)
+        trainer.use_micro_batches(2).fit(max_epochs=1)
+        assert len(calls) == 2
+        for a, b in zip(_grads(full), _grads(trainer)):
+            assert torch.allclose(a, b, atol=1e-6)
+
+    def test_intermediate_steps_only_issue_micro_events(self):
+        events = []
+        trainer = _make_default_trainer(n=4)
+        trainer.accumulate_gradients(2)
+        trainer.register('did_forward', lambda engine: events.append('did_forward'))
+        trainer.register('did_backward', lambda engine: events.append('did_backward'))
+        trainer.fit(max_epochs=1)
+        assert events == 2 * ['did_forward', 'did_backward']
+        trainer.register(
+            'did_micro_forward', lambda engine: events.append('did_micro_forward')
+        )
+        events.clear()
+        trainer.fit(max_epochs=2)
+        # Issued for every step once listened to
+        assert events.count('did_micro_forward') == 8
+        assert events.count('did_forward') == 4
+
+    def test_accumulate_gradients_sums_window(self):
+        trainer = _make_default_trainer(n=2, lr=0.0)
+        trainer.accumulate_gradients(2)
+        trainer.fit(max_epochs=1)
+        accumulated = _grads(trainer)
+        model, criterion = trainer.models.main, trainer.criteria.main
+        model.zero_grad()
+        for x, y in trainer.data.training:
+            criterion(model(x), y).backward()
+        for a, b in zip(accumulated, _grads(trainer)):
+            assert torch.allclose(a, b, atol=1e-6)
@@ -134,3 +134,45 @@ class TestState:
         assert s_1.foo.baz.bonkers == 3
         assert s_1.foo.qux == 2
         assert s_1.bar == 7
+
+    def test_can_set_nested_with_dotted_string_and_sequence(self):
+        s = bd.State({'a': {'b': {'c': 1}}})
+        s['a.b.c'] = 2
+        assert s.a.b.c == 2
+        s['a', 'b', 'c'] = 3
+        assert s.a.b.c == 3
+        s['.a.b.d.'] = {'e': 4}
+        assert isinstance(s.a.b.d, bd.State)
+        assert s['a.b.d.e'] == 4
+
+    def test_setting_nested_key_of_missing_or_non_state_item_raises(self):
+        s = bd.State({'a': 1})
+        with pytest.raises(KeyError):
+            s['b.c'] = 2
+        with pytest.raises(KeyError) as e:
+            s['a.c'] = 2
+        assert 'Non state items' in str(e)
+        with pytest.raises(KeyError):
+            s[()] = 2
+        with pytest.raises(KeyError):
+            s['a.b c'] = 2
+
+    def test_properties_are_resolved(self):
+        class Foo:
+            x = 1
+
+        def fset(self, val):
+            Foo.x = val
+
+        s = bd.State()
+        s.a = {'p': property(lambda self: Foo.x, fset), 'q': property(lambda s: 5)}
+        assert s.a.p == 1
+        assert s['a.p'] == 1
+        s['a.p'] = 2
+        assert Foo.x == 2
+        s.a.p = 3
+        assert Foo.x == 3
+        assert s.a.q == 5
+        # Properties without setters are replaced
+        s.a.q = 6
+        assert s.a.q == 6
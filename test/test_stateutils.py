@@ -1,7 +1,10 @@
+from collections import namedtuple
 import boardom as bd
 import numpy as np
 import torch
 
+Pair = namedtuple('Pair', ['first', 'second'])
+
 
 def mul_tensors(x):
     return 5 * x if isinstance(x, torch.Tensor) else x
@@ -226,3 +229,13 @@ class TestStateUtils:
         assert eng.c.e.f.training
         assert eng.c.e.j.k.training
         assert eng.i.training
+
+    def test_apply_keeps_namedtuples(self):
+        eng = bd.StateUtils()
+        eng.pair = Pair(torch.ones(1), [torch.ones(1), 'name'])
+        for recurse in [True, False]:
+            eng.apply(mul_tensors, recurse=recurse)
+        assert isinstance(eng.pair, Pair)
+        assert torch.equal(eng.pair.first, torch.full((1,), 25.0))
+        assert torch.equal(eng.pair.second[0], torch.full((1,), 25.0))
+        assert eng.pair.second[1] == 'name'